@@ -1,21 +1,22 @@
 import matplotlib.pyplot as plt
-import pickle
+from ml.experiment_registry import ExperimentRegistry
 
 alphas = [10, 1, 0.1, 0.01, 0.001]
+registry = ExperimentRegistry()
 plt.figure()
+legend = []
 for alpha in alphas:
-    params = {
-        'tau': -1, 'k': 4, 'alpha': alpha, 'lambda_': 1e-4, 'max_epoch': 5,
-    }
-    save_name = f"model{'_'.join(map(str, params.values()))}"
-
-    with open(f'./output/{save_name}.pickle', 'rb') as f:
-        model = pickle.load(f)
+    record = registry.latest(data_set='./output/fullAllPublicXML.sds', model_class='MiniBatchReLuLatentFactorModel',
+                             tau=-1, k=4, alpha=alpha, lambda_=1e-4, max_epoch=5)
+    if record is None or record['training_history'] is None:
+        print(f"No run of alpha={alpha} in the registry.")
+        continue
     history = [4.27355490]
-    history.extend(model._training_history)
+    history.extend(record['training_history'])
     plt.plot(history)
+    legend.append(alpha)
 
-plt.legend(alphas)
+plt.legend(legend)
 plt.ylabel('Loss')
 plt.xlabel('Epoch')
 plt.savefig('./results/finding_alpha.pdf')
@@ -1,9 +1,9 @@
 import matplotlib.pyplot as plt
 import numpy as np
-import pickle
 import pandas as pd
 import seaborn as sns
 import scipy.special as sps
+from ml.experiment_registry import ExperimentRegistry
 
 
 def integral(tau, k):
@@ -16,7 +16,8 @@ def integral(tau, k):
 taus = [-10, -1, -0.1]
 ks = [2, 4, 16]
 lambda_s = [1, 1e-1]
-paramses = []
+sds_file_path = './output/fullAllPublicXML.sds'
+registry = ExperimentRegistry()
 tmp = {
     'name': [],
     'tau': [],
@@ -30,23 +31,23 @@ for tau in taus:
     for k in ks:
 
         for lam in lambda_s:
-            params = {
-                'tau': tau, 'k': k, 'lambda_': lam, 'alpha': 0.1, 'max_epoch': 5,
-            }
-            paramses.append(params)
-
-            save_name = f"model{'_'.join(map(str, params.values()))}"
-
-            with open(f'./output/{save_name}.pickle', 'rb') as f:
-                model = pickle.load(f)
-
-            tmp['name'].append(save_name)
+            record = registry.latest(data_set=sds_file_path, model_class='MiniBatchReLuLatentFactorModel', tau=tau,
+                                     k=k, lambda_=lam, alpha=0.1, max_epoch=5)
+            if record is None:
+                print(f"No run of tau={tau}, k={k}, lambda={lam} in the registry.")
+                continue
+            if record['mse_test'] is None or record['apk_test'] is None:
+                # e.g. a run of successive halving, which only estimates its search metric
+                print(f"The run of tau={tau}, k={k}, lambda={lam} has no mse_test or apk_test.")
+                continue
+
+            tmp['name'].append(record['name'])
             tmp['tau'].append(tau)
             tmp['k'].append(k)
             tmp['area'].append(integral(tau, k))
             tmp['lambda'].append(lam)
-            tmp['mser'].append(model.mse_test[1])
-            tmp['aptk'].append(model.apk_test[0])
+            tmp['mser'].append(record['mse_test'][1])
+            tmp['aptk'].append(record['apk_test'][0])
 
 df = pd.DataFrame(tmp)
 plt.figure(figsize=(16, 12))
@@ -0,0 +1,79 @@
+from multiprocessing import shared_memory
+from scipy.sparse import csc_matrix
+import numpy as np
+import typing as tp
+
+
+class SharedArray(object):
+    """
+    A numpy array stored in a named shared memory block. Other processes attach to the same memory (no copy) with
+    the descriptor of the array.
+    """
+
+    def __init__(self, shape: tp.Tuple, dtype, name: str = None):
+        """
+        Create a new shared array, or attach to an existing one if the name is given
+        """
+        dtype = np.dtype(dtype)
+        self._owner = name is None
+        if self._owner:
+            size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf)
+
+    @classmethod
+    def copy_of(cls, arr: np.ndarray) -> 'SharedArray':
+        res = cls(arr.shape, arr.dtype)
+        res.array[...] = arr
+        return res
+
+    @classmethod
+    def attach(cls, descriptor: tp.Tuple) -> 'SharedArray':
+        name, shape, dtype = descriptor
+        return cls(shape, dtype, name)
+
+    @property
+    def descriptor(self) -> tp.Tuple:
+        """
+        picklable (name, shape, dtype) used by other processes to attach to the array
+        """
+        return self._shm.name, self.array.shape, self.array.dtype.str
+
+    def close(self):
+        self.array = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class SharedCscMatrix(object):
+    """
+    A csc_matrix whose data, indices and indptr are stored in shared arrays.
+    """
+
+    def __init__(self, shape: tp.Tuple, data: SharedArray, indices: SharedArray, indptr: SharedArray):
+        self._shape = shape
+        self._arrays = (data, indices, indptr)
+        self.matrix = csc_matrix((data.array, indices.array, indptr.array), shape=shape, copy=False)
+
+    @classmethod
+    def copy_of(cls, matrix: csc_matrix) -> 'SharedCscMatrix':
+        matrix = csc_matrix(matrix)
+        return cls(matrix.shape, SharedArray.copy_of(matrix.data), SharedArray.copy_of(matrix.indices),
+                   SharedArray.copy_of(matrix.indptr))
+
+    @classmethod
+    def attach(cls, descriptor: tp.Tuple) -> 'SharedCscMatrix':
+        shape, data, indices, indptr = descriptor
+        return cls(shape, SharedArray.attach(data), SharedArray.attach(indices), SharedArray.attach(indptr))
+
+    @property
+    def descriptor(self) -> tp.Tuple:
+        return (self._shape,) + tuple(arr.descriptor for arr in self._arrays)
+
+    def close(self):
+        self.matrix = None
+        for arr in self._arrays:
+            arr.close()
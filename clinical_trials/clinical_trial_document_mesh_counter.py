@@ -3,6 +3,7 @@ from ir.string_indexer import StringIndexer
 from clinical_trials.clinical_trial_document import ClinicalTrialDocument
 from collections import Counter
 from math import log10
+import typing as tp
 
 
 class ClinicalTrialDocumentMeshCounter(object):
@@ -13,6 +14,10 @@ class ClinicalTrialDocumentMeshCounter(object):
         # array of mesh_index->counter. Counter is doc_index->count (a float number)
         self._counter = [None] * mesh_trie.total_meshes
 
+    @property
+    def mesh_trie(self) -> MeshTrie:
+        return self._mesh_trie
+
     def process(self, record: ClinicalTrialDocument):
         doc_index = self._doc_indexer.add(record.nct_id)
         for attr in ClinicalTrialDocument.MESH_ATTRIBUTES:
@@ -27,6 +32,9 @@ class ClinicalTrialDocumentMeshCounter(object):
     def tf(self, mesh_index: int, doc_index: int):
         return self._counter[mesh_index][doc_index]
 
+    def df(self, mesh_index: int) -> int:
+        return 0 if self._counter[mesh_index] is None else len(self._counter[mesh_index])
+
     def idf(self, mesh_index: int):
         if self._counter[mesh_index] is None:
             return len(self._doc_indexer)
@@ -45,5 +53,12 @@ class ClinicalTrialDocumentMeshCounter(object):
     def __iter__(self):
         return self._counter.__iter__()
 
+    @property
+    def nct_ids(self) -> tp.List[str]:
+        """
+        the nct_id of every doc_index
+        """
+        return [self._doc_indexer[doc_index] for doc_index in range(len(self._doc_indexer))]
+
     def num_processed_docs(self):
         return len(self._doc_indexer)
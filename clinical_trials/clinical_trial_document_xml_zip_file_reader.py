@@ -2,6 +2,7 @@ from xml.etree import ElementTree
 from clinical_trials.clinical_trial_document import ClinicalTrialDocument
 from base.file_reader import FileReader
 from zipfile import ZipFile
+import os
 
 
 class ClinicalTrialDocumentXmlZipFileReader(FileReader):
@@ -37,6 +38,23 @@ class ClinicalTrialDocumentXmlZipFileReader(FileReader):
         xml = self._file_handler.open(file_name).read().decode()
         return self._parse(xml)
 
+    def nct_id_file_names(self) -> dict:
+        """
+        :return: nct_id -> the name of its xml file in the zip, assuming the files are named after the nct_id
+        """
+        if self._file_handler is None:
+            self.__enter__()
+        return {os.path.splitext(os.path.basename(file_name))[0]: file_name
+                for file_name in self._file_handler.namelist() if file_name.endswith('xml')}
+
+    def read(self, file_name: str) -> ClinicalTrialDocument:
+        """
+        Read a single document by the name of its xml file in the zip
+        """
+        if self._file_handler is None:
+            self.__enter__()
+        return self._parse(self._file_handler.open(file_name).read().decode())
+
     def _parse(self, xml: str):
         tree = ElementTree.fromstring(xml)
         record = dict()
@@ -61,6 +61,9 @@ class MeshTrie(object):
         idx = self.get_index(tokens)
         return self._mesh_indexer[idx]
 
+    def get_heading_of_index(self, index: int) -> str:
+        return self._mesh_indexer[index]
+
     def count_mesh_indices(self, text: str) -> Counter:
         def lazy_mesh_finder(start) -> int:
             """
@@ -1,10 +1,10 @@
 from base import *
 from abc import ABC, abstractmethod
 from scipy.sparse import csc_matrix
-from scipy.sparse.linalg import norm
+from ml.recommend_mixin import RecommendMixin
 
 
-class AbstractLatentFactorModel(ABC):
+class AbstractLatentFactorModel(ABC, RecommendMixin):
     def __init__(self, tau, k, alpha, lambda_):
         self._tau = tau
         self._k = k
@@ -15,16 +15,44 @@ class AbstractLatentFactorModel(ABC):
         self._training_history = None
         self.mse_test = None
         self.apk_test = None
+        self.metrics_test = None
 
-    def _calculate_neighbor_weight_matrix(self, train_r: csc_matrix) -> np.ndarray:
-        l2norm = norm(train_r, ord=2, axis=1)
+    @staticmethod
+    def _calculate_gram_matrix(train_r: csc_matrix) -> np.ndarray:
+        """
+        R*R^T of the training utility matrix, it can be accumulated over column blocks of R
+        """
+        return train_r.dot(train_r.transpose()).toarray()  # dense
+
+    @staticmethod
+    def _calculate_cosine_similarity_from_gram(gram: np.ndarray) -> np.ndarray:
+        """
+        UUT, the cosine similarity of the mesh terms. It does not depend on tau and k, so it can be shared by models
+        """
+        l2norm = np.sqrt(np.diag(gram))
         l2norm[l2norm == 0] = 1  # handel 0 vector
-        U: csc_matrix = train_r.multiply(1 / l2norm.reshape(-1, 1))
-        UUT = U.dot(U.transpose()).toarray()  # dense
+        UUT = gram / l2norm.reshape(-1, 1) / l2norm.reshape(1, -1)
+        np.minimum(UUT, 1, out=UUT)  # rounding errors
+        return UUT
+
+    def _calculate_neighbor_weight_matrix_from_cosine_similarity(self, UUT: np.ndarray) -> np.ndarray:
         W = np.exp(self._tau * np.power(1 - UUT, self._k))
         np.fill_diagonal(W, 0)
         return W
 
+    def _calculate_neighbor_weight_matrix_from_gram(self, gram: np.ndarray) -> np.ndarray:
+        return self._calculate_neighbor_weight_matrix_from_cosine_similarity(
+            self._calculate_cosine_similarity_from_gram(gram))
+
+    def _calculate_neighbor_weight_matrix(self, train_r: csc_matrix) -> np.ndarray:
+        return self._calculate_neighbor_weight_matrix_from_gram(self._calculate_gram_matrix(train_r))
+
+    @staticmethod
+    def _calculate_loss(W_theta: np.ndarray, b: np.ndarray, r: np.ndarray) -> float:
+        rhat = W_theta.dot(r) + b
+        rhat[rhat < 0] = 0
+        return np.sum(np.power(rhat - r, 2)) / (2 * r.shape[1])
+
     @abstractmethod
     def train(self, *args, **kwargs):
         raise Exception("Not implemented yet.")
@@ -1,34 +1,110 @@
 from abc import ABC, abstractmethod
 import numpy as np
+import typing as tp
+import math
+from tqdm import tqdm
 from ml.abstract_model import AbstractLatentFactorModel
+from ml.masked_test_fixture import MaskedTestFixture
 from scipy.sparse import csc_matrix
 
 
 class AbstractTester(ABC):
-    def __init__(self, model: AbstractLatentFactorModel, fraction_of_masking=0.5):
+    def __init__(self, model: AbstractLatentFactorModel, fraction_of_masking=0.5, block_size=1000, seed=None):
         """
         Test the model
         :param model: Model to be tested
         :param fraction_of_masking: the fraction of the non-zero values that will be masked to zero
+        :param block_size: number of documents masked, predicted and scored together as a matrix
+        :param seed: seed of the random masks
         """
         self._model = model
         self._fraction_of_masking = fraction_of_masking
+        self._block_size = block_size
+        self._rng = np.random.default_rng(seed)
 
     def choose_mask_indices(self, r: np.ndarray) -> np.ndarray:
         """
 
         :param r: mx1 np array to be masked
-        :return:
+        :return: mx1 array of 0 (masked) and 1
         """
-        non_zeros_indices = np.argwhere(r.ravel() != 0).ravel()
-        indices = np.random.choice(non_zeros_indices, int(len(non_zeros_indices) * self._fraction_of_masking))
+        non_zeros_indices = np.flatnonzero(r)
+        indices = self._rng.choice(non_zeros_indices, int(len(non_zeros_indices) * self._fraction_of_masking),
+                                   replace=False)
         res = np.ones(r.shape)
-        for idx in indices:
-            res[idx][0] = 0
+        res.reshape(-1)[indices] = 0
         return res
 
+    def choose_block_masks(self, block: csc_matrix) -> np.ndarray:
+        """
+        Choose int(nnz * fraction_of_masking) of the nnz non-zero values of every column to be masked
+        :param block: csc matrix without explicit zeros
+        :return: boolean array over block.data, True for the masked values
+        """
+        return MaskedTestFixture.choose_masks(block, self._fraction_of_masking, self._rng)
+
+    @staticmethod
+    def top_k(scores: np.ndarray, candidates: np.ndarray, k: int) -> tp.Tuple[np.ndarray, np.ndarray]:
+        """
+        The top k candidates of every column, in descending order of scores
+        :param scores: mxn scores
+        :param candidates: mxn boolean array of the entries that can be chosen
+        :return: kxn row indices, and kxn boolean array which is False where a column has less than k candidates
+        """
+        k = min(k, scores.shape[0])
+        scores = np.where(candidates, scores, -np.inf)
+        top = np.argpartition(-scores, k - 1, axis=0)[:k]
+        top_scores = np.take_along_axis(scores, top, axis=0)
+        order = np.argsort(-top_scores, axis=0, kind='stable')
+        top = np.take_along_axis(top, order, axis=0)
+        return top, np.isfinite(np.take_along_axis(top_scores, order, axis=0))
+
+    def iterate_blocks(self, docs: tp.Union[csc_matrix, MaskedTestFixture]) -> tp.Iterator[
+            tp.Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Iterate over the documents with non zero values in blocks of block_size columns. The documents are masked
+        block by block, unless a MaskedTestFixture with the masks already chosen is given.
+        :return: iterator of dense (r, masked r, held out) blocks. held out is True for the masked values
+        """
+        if isinstance(docs, MaskedTestFixture):
+            yield from tqdm(docs.iterate_blocks(self._block_size), total=math.ceil(docs.shape[1] / self._block_size))
+            return
+        for start in tqdm(range(0, docs.shape[1], self._block_size)):
+            fixture = MaskedTestFixture.create(docs[:, start:start + self._block_size], self._fraction_of_masking,
+                                               self._rng)
+            yield from fixture.iterate_blocks(self._block_size)
+
+    def test(self, r: np.ndarray) -> tp.Tuple:
+        """
+        Mask and test a single record
+        :param r: mx1 test record
+        :return: the metrics of the record
+        """
+        masks = self.choose_mask_indices(r)
+        return tuple(num[0] / den[0] for num, den in self.test_block(r, r * masks, masks == 0))
+
+    def evaluate(self, docs: tp.Union[csc_matrix, MaskedTestFixture]) -> tp.Tuple:
+        """
+        Test all documents with non zero values block by block, reducing the metrics on the fly
+        :param docs: the documents to be masked, or a MaskedTestFixture
+        :return: the metrics over all documents
+        """
+        sums = None
+        for r, masked_r, held_out in self.iterate_blocks(docs):
+            block_sums = np.array([(np.sum(num), np.sum(den)) for num, den in self.test_block(r, masked_r, held_out)])
+            sums = block_sums if sums is None else sums + block_sums
+        return tuple(num / den for num, den in sums)
+
     @abstractmethod
-    def test(self, r: np.ndarray):
+    def test_block(self, r: np.ndarray, masked_r: np.ndarray,
+                   held_out: np.ndarray) -> tp.Tuple[tp.Tuple[np.ndarray, np.ndarray], ...]:
+        """
+        :param r: mxn block of records
+        :param masked_r: the block with the held out values masked to zero
+        :param held_out: True for the masked values
+        :return: for every metric, the numerators and denominators of the n documents. The metric over many documents
+         is sum(numerators) / sum(denominators)
+        """
         pass
 
     @abstractmethod
@@ -2,7 +2,6 @@ from base import *
 from ml.abstract_model import AbstractLatentFactorModel
 from ml.abstract_tester import AbstractTester
 from scipy.sparse import csc_matrix
-import heapq
 
 
 class AveragePrecisionKTester(AbstractTester):
@@ -14,49 +13,36 @@ class AveragePrecisionKTester(AbstractTester):
         NOTE: rank by the tf-idf is not considered
     """
 
-    def __init__(self, model: AbstractLatentFactorModel, k=3, fraction_of_masking=0.8):
-        super(AveragePrecisionKTester, self).__init__(model, fraction_of_masking)
+    def __init__(self, model: AbstractLatentFactorModel, k=3, fraction_of_masking=0.8, **kwargs):
+        super(AveragePrecisionKTester, self).__init__(model, fraction_of_masking, **kwargs)
         self._k = k
+        self.metric_names = [f'p@{k}', f'random_p@{k}']
 
-    def test(self, r: np.ndarray) -> tp.Tuple[float, float]:
+    def test_block(self, r, masked_r, held_out):
         """
-        return Precision@K
-        :param r: test record
-        :return: precision @ K
+        Precision@K of the model and of random guess, which picks as many of the zeros before prediction as the
+        model predicted
         """
-        masks = self.choose_mask_indices(r)
-        new_r = r * masks
+        zeros_before_prediction = masked_r == 0
+        predicted_r = self._model.predict(masked_r)
+        predicted, valid = self.top_k(predicted_r, zeros_before_prediction & (predicted_r > 0), self._k)
+        num_predicted = np.sum(valid, axis=0)
+        hits = np.sum((np.take_along_axis(r, predicted, axis=0) != 0) & valid, axis=0)
 
-        zeros_before_prediction = new_r == 0
-        predicted_r = self._model.predict(new_r)
-        positive_after_prediction = predicted_r > 0
-        index_tf_idf = [(idx, value)
-                        for idx, value in enumerate(predicted_r.ravel())
-                        if zeros_before_prediction[idx] and positive_after_prediction[idx]]
+        random_picked, _ = self.top_k(self._rng.random(r.shape), zeros_before_prediction, self._k)
+        random_valid = np.arange(random_picked.shape[0]).reshape(-1, 1) < num_predicted.reshape(1, -1)
+        random_hits = np.sum((np.take_along_axis(r, random_picked, axis=0) != 0) & random_valid, axis=0)
 
-        predicted = heapq.nlargest(self._k, index_tf_idf, key=lambda x: x[1])
-        if len(predicted):
-            random_picked = np.random.choice(np.argwhere(zeros_before_prediction.ravel() == True).ravel(),
-                                             len(predicted))
-            return (sum([r[idx][0] != 0 for idx, _ in predicted]) / len(predicted),
-                    sum([r[idx][0] != 0 for idx in random_picked]) / len(random_picked))
-        else:
-            return 0, 0
+        divisor = np.maximum(num_predicted, 1)  # precision is 0 if nothing is predicted
+        ones = np.ones(r.shape[1])
+        return (hits / divisor, ones), (random_hits / divisor, ones)
 
-    def __call__(self, docs: csc_matrix)->tp.Tuple:
+    def __call__(self, docs: csc_matrix) -> tp.Tuple:
         """
-        Randomly mask the non-zero values in the docs, and return the mean squared error of the prediction
+        Randomly mask the non-zero values in the docs, and return the average precision at K of the prediction
         :param docs: 2-d array. each column vector is a mesh index vector
         :return: average precision at K of the model, average precision at K of random guess
         """
-        model = []
-        rand = []
-        for col in tqdm(range(docs.shape[1])):
-            r = docs[:, col].toarray()
-            if np.sum(r) > 0:
-                m, r = self.test(r)
-                model.append(m)
-                rand.append(r)
-        res = np.mean(model), np.mean(rand)
+        res = self.evaluate(docs)
         self._model.apk_test = res
         return res
@@ -1,6 +1,8 @@
 from base import *
+from hashlib import blake2b
 from scipy.sparse import lil_matrix, csc_matrix
 from clinical_trials.clinical_trial_document_mesh_counter import ClinicalTrialDocumentMeshCounter
+from ml.mesh_vocabulary import MeshVocabulary
 
 
 class DATA_SET_INDICATOR(object):
@@ -12,31 +14,98 @@ class DATA_SET_INDICATOR(object):
 class DataSetSplitter(object):
     __FILE_EXTENSION__ = ".sds"  # split data set
 
+    MAGIC = b'SDSZ'  # the header of a compressed data set file, the plain files start with num_mesh
+
     class SparseMatrixCompressor(object):
+        # the value encodings of the compressed rows, by their code in the file header
+        VALUE_DTYPES = ('f4', 'f2', 'u1')
+
         @staticmethod
-        def compress(src: tp.List) -> bytes:
-            # |4bytes total, 4bytes total_non_zeros|non zero float32 array|non zero int32 index|
+        def compress(src: tp.List, value_dtype: str = None) -> bytes:
+            """
+            :param value_dtype: None for the plain row, else one of VALUE_DTYPES for a compressed row
+            """
             arr = np.array(src, dtype='f4')
             total = np.uint32(len(arr))
             non_zeros_num = np.uint32(np.count_nonzero(arr))
             non_zeros_values = arr[arr != 0]
             non_zeros_indices = np.argwhere(arr).ravel().astype('u4')
-            return total.tobytes() + non_zeros_num.tobytes() + non_zeros_indices.tobytes() + non_zeros_values.tobytes()
+            if value_dtype is None:
+                # |4bytes total, 4bytes total_non_zeros|non zero int32 index|non zero float32 array|
+                return (total.tobytes() + non_zeros_num.tobytes() + non_zeros_indices.tobytes() +
+                        non_zeros_values.tobytes())
+
+            # |4bytes total, 4bytes total_non_zeros, 4bytes index bytes, 4bytes float32 scale|varint delta index|values|
+            # every row is decodable by itself
+            index_bytes = DataSetSplitter.SparseMatrixCompressor.encode_varint(
+                np.diff(non_zeros_indices, prepend=np.uint32(0)))
+            scale = np.float32(1)
+            if value_dtype == 'u1':
+                # 1..255 levels of the row's range, so the non zeros stay non zero
+                scale = np.float32(non_zeros_values.max() / 255) if non_zeros_num else scale
+                non_zeros_values = np.clip(np.rint(non_zeros_values / scale), 1, 255)
+            return (np.array([total, non_zeros_num, len(index_bytes)], dtype='u4').tobytes() + scale.tobytes() +
+                    index_bytes + non_zeros_values.astype(value_dtype).tobytes())
+
+        @staticmethod
+        def decompress_sparse(reader: tp.BinaryIO,
+                              value_dtype: str = None) -> tp.Tuple[int, np.ndarray, np.ndarray]:
+            """
+            :return: the length of the row, the indices and the float32 values of its non zeros
+            """
+            if value_dtype is None:
+                total, non_zeros_num = np.frombuffer(reader.read(4 + 4), dtype='u4')
+                non_zeros_indices = np.frombuffer(reader.read(4 * non_zeros_num), 'u4')
+                non_zeros_values = np.frombuffer(reader.read(4 * non_zeros_num), 'f4')
+                return total, non_zeros_indices, non_zeros_values
+
+            header = reader.read(4 * 4)
+            total, non_zeros_num, num_index_bytes = np.frombuffer(header, dtype='u4', count=3)
+            scale = np.frombuffer(header, dtype='f4', offset=3 * 4)[0]
+            non_zeros_indices = np.cumsum(DataSetSplitter.SparseMatrixCompressor.decode_varint(
+                np.frombuffer(reader.read(num_index_bytes), dtype='u1')), dtype='u4')
+            dtype = np.dtype(value_dtype)
+            non_zeros_values = np.frombuffer(reader.read(dtype.itemsize * non_zeros_num), dtype).astype('f4')
+            if value_dtype == 'u1':
+                non_zeros_values *= scale
+            return total, non_zeros_indices, non_zeros_values
 
         @staticmethod
-        def decompress(reader: tp.BinaryIO):
-            total, non_zeros_num = np.frombuffer(reader.read(4 + 4), dtype='u4')
-            non_zeros_indices = np.frombuffer(reader.read(4 * non_zeros_num), 'u4')
-            non_zeros_values = np.frombuffer(reader.read(4 * non_zeros_num), 'f4')
+        def decompress(reader: tp.BinaryIO, value_dtype: str = None):
+            total, non_zeros_indices, non_zeros_values = DataSetSplitter.SparseMatrixCompressor.decompress_sparse(
+                reader, value_dtype)
             res = np.zeros(total, dtype='f4')
-            np.put(res, non_zeros_indices, non_zeros_values)
             res[non_zeros_indices] = non_zeros_values
             return res
 
+        @staticmethod
+        def encode_varint(arr: np.ndarray) -> bytes:
+            """
+            7 bits of every number a byte, least significant first; the high bit is set on all but the last byte
+            """
+            arr = arr.astype('u8')
+            num_bytes = 1 + sum((arr >= 1 << (7 * i)).astype(int) for i in range(1, 5))
+            ends = np.cumsum(num_bytes)
+            res = np.zeros(ends[-1] if len(arr) else 0, dtype='u1')
+            for i in range(5):
+                chosen = num_bytes > i
+                res[ends[chosen] - num_bytes[chosen] + i] = ((arr[chosen] >> np.uint64(7 * i)) & np.uint64(0x7f)) | \
+                    np.where(num_bytes[chosen] > i + 1, 0x80, 0).astype('u8')
+            return res.tobytes()
+
+        @staticmethod
+        def decode_varint(arr: np.ndarray) -> np.ndarray:
+            if len(arr) == 0:
+                return np.zeros(0, dtype='u8')
+            ends = np.flatnonzero(arr < 0x80)
+            starts = np.concatenate([[0], ends[:-1] + 1])
+            shifts = 7 * (np.arange(len(arr)) - np.repeat(starts, ends - starts + 1))
+            return np.bitwise_or.reduceat((arr & 0x7f).astype('u8') << shifts.astype('u8'), starts)
+
     @classmethod
     def dump_split_data_set(cls, ctdmc: ClinicalTrialDocumentMeshCounter, output_file_path: str,
                             split_fractions: tp.Iterable = (0.8, 0.1, 0.1),
-                            frequency_threshold: tp.Union[int, float] = 0.005):
+                            frequency_threshold: tp.Union[int, float] = 0.005, salt='', compression: str = None):
         """
 
         :param ctdmc:
@@ -45,6 +114,9 @@ class DataSetSplitter(object):
         :param frequency_threshold: the mesh_indices showing up in the number of documents less than the threshold will
          not be kept. If the frequency_threshold is a float then frequency_threshold*num_processed_docs is the
          threshold
+        :param salt: the splits are assigned by the hash of the salted nct_ids, see hash_split_choice_map
+        :param compression: None for the plain file, else the value encoding of a compressed file, see
+         dump_utility_matrix
         :return:
         """
 
@@ -56,38 +128,107 @@ class DataSetSplitter(object):
             if counter is not None and len(counter) >= frequency_threshold:
                 mesh_index_map.append(mesh_index)
 
-        num_mesh = len(mesh_index_map)
         num_docs = ctdmc.num_processed_docs()
-        split_choice_map = np.random.choice((DATA_SET_INDICATOR.TRAIN,
-                                             DATA_SET_INDICATOR.VALIDATE,
-                                             DATA_SET_INDICATOR.TEST), size=num_docs,
-                                            p=np.array(split_fractions) / np.sum(split_fractions))
+        split_choice_map = cls.hash_split_choice_map(ctdmc.nct_ids, split_fractions, salt)
+        cls.dump_utility_matrix(output_file_path, mesh_index_map, split_choice_map,
+                                ([ctdmc.tf_idf(mesh_index, doc_index) for doc_index in range(num_docs)]
+                                 for mesh_index in mesh_index_map), compression)
+        MeshVocabulary.from_counter(ctdmc, mesh_index_map).dump(MeshVocabulary.vocabulary_path(output_file_path))
+
+        # return the two map for testing purpose
+        return mesh_index_map, split_choice_map
+
+    @classmethod
+    def hash_uniform(cls, nct_ids: tp.Iterable[str], salt='') -> np.ndarray:
+        """
+        a number in [0, 1) for every nct_id from a stable hash, independent of the other documents
+        """
+        # the top 53 bits of the hash are exact in a float64, so the numbers never round up to 1
+        return np.array([int.from_bytes(blake2b(f'{salt}{nct_id}'.encode(), digest_size=8).digest(), 'little') >> 11
+                         for nct_id in nct_ids], dtype='f8') / 2 ** 53
+
+    @classmethod
+    def hash_split_choice_map(cls, nct_ids: tp.Iterable[str], split_fractions: tp.Iterable = (0.8, 0.1, 0.1),
+                              salt='') -> np.ndarray:
+        """
+        Assign the train, validate and test splits by the hash of the nct_ids, so a document stays in its split when
+        the corpus grows, and the splits are reproducible
+        """
+        bounds = np.cumsum(split_fractions) / np.sum(split_fractions)
+        res = np.searchsorted(bounds, cls.hash_uniform(nct_ids, salt), side='right')
+        return np.minimum(res, DATA_SET_INDICATOR.TEST).astype('b')
+
+    @classmethod
+    def k_fold_split_choice_map(cls, nct_ids: tp.Iterable[str], k: int, fold: int, seed=0,
+                                test_fraction=0.1) -> np.ndarray:
+        """
+        The split of one fold of a seeded k-fold cross validation: the test documents are assigned by the hash of the
+        nct_ids as in hash_split_choice_map, the others to k folds by the hash salted with the seed. The documents of
+        the fold are validated, the others trained.
+        """
+        nct_ids = list(nct_ids)
+        res = cls.hash_split_choice_map(nct_ids, (1 - test_fraction, 0, test_fraction))
+        folds = np.floor(cls.hash_uniform(nct_ids, f'{seed}:') * k).astype(int)
+        res[(res != DATA_SET_INDICATOR.TEST) & (folds == fold)] = DATA_SET_INDICATOR.VALIDATE
+        return res
+
+    @classmethod
+    def dump_utility_matrix(cls, output_file_path: str, mesh_index_map: tp.List[int], split_choice_map: np.ndarray,
+                            rows: tp.Iterable, compression: str = None):
+        """
+        :param rows: the tf-idf of all documents of every kept mesh index, in the order of mesh_index_map
+        :param compression: None for the plain file, else one of SparseMatrixCompressor.VALUE_DTYPES: the indices are
+         delta and varint encoded, and the values stored as float32, float16 or uint8 levels of the row's range
+        """
         with open(output_file_path, 'wb') as writer:
+            if compression is not None:
+                value_dtype_code = cls.SparseMatrixCompressor.VALUE_DTYPES.index(compression)
+                writer.write(cls.MAGIC + np.uint32(value_dtype_code).tobytes())
             # first 8 bytes are
-            writer.write(np.array([num_mesh, num_docs], dtype='u4').tobytes())
+            writer.write(np.array([len(mesh_index_map), len(split_choice_map)], dtype='u4').tobytes())
             # mesh_index_map
             writer.write(np.array(mesh_index_map, dtype='u4').tobytes())
             # split_choice_map
-            writer.write(split_choice_map.astype('b').tobytes())
+            writer.write(np.asarray(split_choice_map).astype('b').tobytes())
             # utility_matrix
-            for mesh_index in tqdm(mesh_index_map):
-                writer.write(cls.SparseMatrixCompressor.compress(
-                    [ctdmc.tf_idf(mesh_index, doc_index) for doc_index in range(num_docs)]))
+            for row in tqdm(rows, total=len(mesh_index_map)):
+                writer.write(cls.SparseMatrixCompressor.compress(row, compression))
 
-        # return the two map for testing purpose
-        return mesh_index_map, split_choice_map
+    @classmethod
+    def file_identity(cls, file_path: str) -> np.ndarray:
+        """
+        the size and the modification time of a data set file, stored by the files derived from it, which are rebuilt
+        when the data set file is regenerated
+        """
+        stat = os.stat(file_path)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype='i8')
+
+    @classmethod
+    def read_header(cls, reader: tp.BinaryIO) -> tp.Tuple[np.ndarray, np.ndarray, tp.Optional[str]]:
+        """
+        Read the mesh_index_map, the split_choice_map and the compression of a plain or compressed file, and leave the
+        reader at the first row of the utility matrix
+        """
+        compression = None
+        first = reader.read(4)
+        if first == cls.MAGIC:
+            compression = cls.SparseMatrixCompressor.VALUE_DTYPES[np.frombuffer(reader.read(4), dtype='u4')[0]]
+            first = reader.read(4)
+        num_mesh, num_docs = np.frombuffer(first + reader.read(4), dtype='u4')
+        mesh_index_map = np.frombuffer(reader.read(4 * num_mesh), dtype='u4')
+        split_choice_map = np.frombuffer(reader.read(num_docs), dtype='b')
+        return mesh_index_map, split_choice_map, compression
 
     @classmethod
     def get_utility_matrix(cls, file_path: str, data_set_indicator: int) -> csc_matrix:
         with open(file_path, 'rb') as reader:
-            num_mesh, num_docs = np.frombuffer(reader.read(4 + 4), dtype='u4')
-            reader.seek(4 * num_mesh, io.SEEK_CUR)  # jump over mesh_index_map
-            split_choice_map = np.frombuffer(reader.read(num_docs), dtype='b')
+            mesh_index_map, split_choice_map, compression = cls.read_header(reader)
+            num_mesh = len(mesh_index_map)
             chosen_docs = split_choice_map == data_set_indicator
             num_chosen_docs = np.sum(chosen_docs)
             res = lil_matrix((num_mesh, num_chosen_docs))
             for i in tqdm(range(num_mesh)):
-                row = cls.SparseMatrixCompressor.decompress(reader)
+                row = cls.SparseMatrixCompressor.decompress(reader, compression)
                 res[i] = row[chosen_docs]  # set row to the chosen docs' values
         return res.tocsc()
 
@@ -106,15 +247,38 @@ class DataSetSplitter(object):
     @classmethod
     def get_mesh_index_map(cls, file_path: str) -> np.ndarray:
         with open(file_path, 'rb') as reader:
-            num_mesh, num_docs = np.frombuffer(reader.read(4 + 4), dtype='u4')
-            res = np.frombuffer(reader.read(num_mesh * 4), dtype='u4')
+            res, _, _ = cls.read_header(reader)
         return res
 
+    @classmethod
+    def get_vocabulary(cls, file_path: str) -> MeshVocabulary:
+        """
+        the vocabulary sidecar written by dump_split_data_set
+        """
+        return MeshVocabulary.load(MeshVocabulary.vocabulary_path(file_path))
+
+    @classmethod
+    def align_utility_matrix(cls, r: csc_matrix, mesh_index_map: np.ndarray,
+                             reference_mesh_index_map: np.ndarray) -> tp.Tuple[csc_matrix, np.ndarray]:
+        """
+        Reorder the rows of a utility matrix, so the mesh indices of the reference (e.g. the data set a model was
+        trained with) come first in the same order, followed by the mesh indices new in mesh_index_map. Reference mesh
+        indices missing in mesh_index_map get zero rows.
+        :return: the aligned utility matrix and its mesh_index_map
+        """
+        reference = set(reference_mesh_index_map.tolist())
+        new_mesh_indices = [mesh_index for mesh_index in mesh_index_map if mesh_index not in reference]
+        aligned_mesh_index_map = np.concatenate([reference_mesh_index_map,
+                                                 np.array(new_mesh_indices, dtype='u4')]).astype('u4')
+        position = {mesh_index: i for i, mesh_index in enumerate(aligned_mesh_index_map.tolist())}
+        rows = np.array([position[mesh_index] for mesh_index in mesh_index_map.tolist()], dtype=int)
+        r = r.tocoo()
+        res = csc_matrix((r.data, (rows[r.row], r.col)), shape=(len(aligned_mesh_index_map), r.shape[1]))
+        return res, aligned_mesh_index_map
+
     @classmethod
     def get_split_choice_map(cls, file_path: str) -> np.ndarray:
         with open(file_path, 'rb') as reader:
-            num_mesh, num_docs = np.frombuffer(reader.read(4 + 4), dtype='u4')
-            reader.seek(num_mesh * 4, io.SEEK_CUR)
-            res = np.frombuffer(reader.read(num_docs), dtype='b')
+            _, res, _ = cls.read_header(reader)
         return res
 
@@ -0,0 +1,98 @@
+from base import *
+from ml.abstract_model import AbstractLatentFactorModel
+import json
+import time
+
+
+class ExperimentRegistry(object):
+    """
+    A JSON lines file with a small record of every training run: the data set, the model class, the parameters, the
+    loss histories, the training times, the test metrics and the path of the saved model. The analysis reads the
+    records instead of loading the models. A run logged again with the same name, data set and model class, e.g. a
+    resumed training, supersedes the older records.
+    Every record is appended by a single write, so processes can log to the same file.
+    """
+    __FILE_EXTENSION__ = ".jsonl"  # json lines
+    DEFAULT_FILE_PATH = './output/experiments.jsonl'
+
+    def __init__(self, file_path: str = DEFAULT_FILE_PATH):
+        self._file_path = file_path
+
+    @staticmethod
+    def _to_json(obj):
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        raise TypeError(f"{type(obj)} is not JSON serializable.")
+
+    def log(self, name: str, params: dict, model: AbstractLatentFactorModel = None, metrics: dict = None,
+            artifact_path: str = None, data_set: str = None, **extra) -> dict:
+        """
+        :param name: the name of the run, e.g. the save name of the model
+        :param params: the parameters of the model
+        :param model: the trained model, whose class, histories, times and test metrics are recorded
+        :param metrics: metric name -> value, e.g. of MultiMetricEvaluator
+        :param artifact_path: where the model is saved
+        :param data_set: the path of the data set file the model is trained with
+        :param extra: anything else to record
+        :return: the record
+        """
+        record = {'name': name, 'time': time.time(), 'data_set': data_set,
+                  'model_class': None if model is None else type(model).__name__, 'params': params}
+        if model is not None:
+            record.update(training_history=getattr(model, '_training_history', None),
+                          validation_history=getattr(model, '_validation_history', None),
+                          training_times=getattr(model, '_training_times', None),
+                          partial_fit_history=getattr(model, '_partial_fit_history', None),
+                          mse_test=model.mse_test, apk_test=model.apk_test)
+        record.update(metrics=metrics, artifact_path=artifact_path, **extra)
+        line = json.dumps(record, default=self._to_json) + '\n'
+        fd = os.open(self._file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+        return json.loads(line)
+
+    @staticmethod
+    def _key(record: dict) -> tp.Tuple:
+        return record.get('data_set'), record.get('model_class'), record['name']
+
+    def records(self, name: str = None, data_set: str = None, model_class: tp.Union[type, str] = None,
+                **params) -> tp.List[dict]:
+        """
+        :param name: only the records of this run
+        :param data_set: only the records of models trained with this data set file
+        :param model_class: only the records of models of this class, or class name
+        :param params: only the records with these parameter values
+        :return: the latest record of every matching run, in the order they were logged first
+        """
+        if isinstance(model_class, type):
+            model_class = model_class.__name__
+        res = {}
+        if not os.path.exists(self._file_path):
+            return []
+        with open(self._file_path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if name is not None and record['name'] != name:
+                    continue
+                if data_set is not None and record.get('data_set') != data_set:
+                    continue
+                if model_class is not None and record.get('model_class') != model_class:
+                    continue
+                if any(record['params'].get(key) != value for key, value in params.items()):
+                    continue
+                res[self._key(record)] = record
+        return list(res.values())
+
+    def latest(self, name: str = None, data_set: str = None, model_class: tp.Union[type, str] = None,
+               **params) -> tp.Optional[dict]:
+        """
+        the latest matching record, or None
+        """
+        res = self.records(name, data_set, model_class, **params)
+        return max(res, key=lambda record: record['time']) if res else None
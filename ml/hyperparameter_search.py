@@ -0,0 +1,147 @@
+from base import *
+from base.shared_array import SharedArray, SharedCscMatrix
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from ml.data_set_splitter import DataSetSplitter
+from ml.experiment_registry import ExperimentRegistry
+from ml.mini_batch_relu_latent_factor_model import MiniBatchReLuLatentFactorModel
+from ml.multi_metric_evaluator import MultiMetricEvaluator
+import csv
+import multiprocessing
+import pickle
+import time
+
+# the shared data attached by every worker process once, see _initialize_worker
+_worker_data = {}
+
+
+def _initialize_worker(descriptors: dict):
+    _worker_data['train_r'] = SharedCscMatrix.attach(descriptors['train_r'])
+    _worker_data['validate_r'] = SharedCscMatrix.attach(descriptors['validate_r'])
+    _worker_data['gram'] = SharedArray.attach(descriptors['gram'])
+    _worker_data['cosine_similarity'] = SharedArray.attach(descriptors['cosine_similarity'])
+
+
+def _train_configuration(model_class: type, params: dict, model_kwargs: dict, output_directory: str,
+                         registry_file_path: str, sds_file_path: str) -> dict:
+    """
+    Train and evaluate one configuration in a worker process
+    :param sds_file_path: the data set of the shared data, recorded in the checkpoint and the registry
+    """
+    start_time = time.time()
+    save_name = f"model{'_'.join(map(str, params.values()))}"
+    checkpoint_path = os.path.join(output_directory, f'{save_name}.ckpt.npz')
+    model = model_class(**params, checkpoint_path=checkpoint_path, **model_kwargs)
+    train_r = _worker_data['train_r'].matrix
+    validate_r = _worker_data['validate_r'].matrix
+    model.train(train_r, validate_r, resume_from=checkpoint_path if os.path.exists(checkpoint_path) else None,
+                gram=_worker_data['gram'].array, cosine_similarity=_worker_data['cosine_similarity'].array,
+                data_set_identity=DataSetSplitter.file_identity(sds_file_path))
+    metrics = MultiMetricEvaluator(model)(validate_r)
+
+    model_path = os.path.join(output_directory, f'{save_name}.pickle')
+    with open(model_path, 'wb') as f:
+        pickle.dump(model, f)
+    ExperimentRegistry(registry_file_path).log(save_name, params, model, metrics, model_path, sds_file_path)
+    return {
+        **params,
+        'training_loss': float(model._training_history[-1]),
+        'validation_loss': float(model._validation_history[-1]) if model._validation_history else None,
+        'epochs': len(model._training_history) - 1,
+        **{name: float(value) for name, value in metrics.items()},
+        'seconds': time.time() - start_time,
+        'model_path': model_path,
+    }
+
+
+class HyperparameterSearch(object):
+    """
+    Train the configurations of a search in a process pool. The training and validation matrices are loaded once
+    into shared memory, and the gram matrix and its cosine similarity UUT are calculated once and shared as well;
+    they do not depend on the parameters, so W of every tau and k is an elementwise transform of UUT.
+    For the best speed up, limit the BLAS threads of every process, e.g. by OMP_NUM_THREADS=1.
+    """
+
+    def __init__(self, sds_file_path: str, model_class: type = MiniBatchReLuLatentFactorModel, num_workers: int = None,
+                 output_directory='./output', registry_file_path=ExperimentRegistry.DEFAULT_FILE_PATH,
+                 **model_kwargs):
+        """
+
+        :param model_class: a subclass of MiniBatchReLuLatentFactorModel
+        :param output_directory: where the checkpoints and the models are saved
+        :param registry_file_path: the ExperimentRegistry the saved models are logged to
+        :param model_kwargs: the arguments of every model besides the searched ones, e.g. patience
+        """
+        self._sds_file_path = sds_file_path
+        self._model_class = model_class
+        self._num_workers = multiprocessing.cpu_count() if num_workers is None else num_workers
+        self._output_directory = output_directory
+        self._registry_file_path = registry_file_path
+        self._model_kwargs = model_kwargs
+
+    @contextmanager
+    def _executor(self) -> tp.Iterator[ProcessPoolExecutor]:
+        """
+        the process pool whose workers attach to the shared data, which is released when the pool is closed
+        """
+        train_r = DataSetSplitter.get_train_utility_matrix(self._sds_file_path)
+        validate_r = DataSetSplitter.get_validate_utility_matrix(self._sds_file_path)
+        gram = MiniBatchReLuLatentFactorModel._calculate_gram_matrix(train_r)
+        shared = {
+            'train_r': SharedCscMatrix.copy_of(train_r),
+            'validate_r': SharedCscMatrix.copy_of(validate_r),
+            'gram': SharedArray.copy_of(gram),
+            'cosine_similarity': SharedArray.copy_of(MiniBatchReLuLatentFactorModel
+                                                     ._calculate_cosine_similarity_from_gram(gram)),
+        }
+        del train_r, validate_r, gram
+        try:
+            with ProcessPoolExecutor(self._num_workers, initializer=_initialize_worker,
+                                     initargs=({key: value.descriptor for key, value in shared.items()},)) as executor:
+                yield executor
+        finally:
+            for value in shared.values():
+                value.close()
+
+    def run(self, paramses: tp.List[dict], results_file_path: str) -> tp.List[dict]:
+        """
+        :param paramses: the searched parameters of every configuration
+        :param results_file_path: the csv file with a row of parameters, losses and validation metrics for every
+         configuration, written as the configurations finish
+        :return: the rows, in the order of paramses
+        """
+        res = [None] * len(paramses)
+        with self._executor() as executor, ResultsFile(results_file_path) as results:
+            futures = {executor.submit(_train_configuration, self._model_class, params, self._model_kwargs,
+                                       self._output_directory, self._registry_file_path, self._sds_file_path): i
+                       for i, params in enumerate(paramses)}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Configurations"):
+                res[futures[future]] = future.result()
+                results.write(res[futures[future]])
+        return res
+
+
+class ResultsFile(object):
+    """
+    A csv file of result rows, written and flushed one by one, the columns being the keys of the first row
+    """
+
+    def __init__(self, file_path: str):
+        self._file = open(file_path, 'w', newline='')
+        self._writer = None
+
+    def write(self, row: dict):
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._file, fieldnames=list(row.keys()))
+            self._writer.writeheader()
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self) -> 'ResultsFile':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
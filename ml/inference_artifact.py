@@ -0,0 +1,100 @@
+from base import *
+from hashlib import blake2b
+from ml.recommend_mixin import RecommendMixin
+
+
+class InferenceArtifact(RecommendMixin):
+    """
+    The parameters needed for inference only, loaded by memory mapping: the pages are shared by all processes mapping
+    the same file, and nothing is read before it is used.
+
+    |header, padded to 64 bytes|W_theta mxm|b m|log10 idf m float32|mesh_index_map m uint32|headings utf-8|
+    header: |4 bytes magic|uint32 format version|4 bytes dtype|uint32 m|uint64 headings size|16 bytes version hash|
+    every section starts at a multiple of 64 bytes. The version hash is computed from the content.
+    """
+    __FILE_EXTENSION__ = ".ia"  # inference artifact
+    MAGIC = b'XLIA'
+    FORMAT_VERSION = 1
+    HEADER = np.dtype([('magic', 'S4'), ('format_version', '<u4'), ('dtype', 'S4'), ('num_mesh', '<u4'),
+                       ('headings_size', '<u8'), ('version', 'u1', (16,))])
+    ALIGNMENT = 64
+
+    def __init__(self, W_theta: np.ndarray, b: np.ndarray, log_idf: np.ndarray, mesh_index_map: np.ndarray,
+                 headings: tp.List[str], version: str):
+        self._W_theta = W_theta
+        self._b = b.reshape(-1, 1)
+        self.log_idf = log_idf
+        self.mesh_index_map = mesh_index_map
+        self.headings = headings
+        self.version = version
+
+    @classmethod
+    def _offsets(cls, num_mesh: int, dtype: np.dtype, headings_size: int) -> tp.List[int]:
+        """
+        :return: the start of every section, and the end of the file
+        """
+        sizes = [cls.HEADER.itemsize, num_mesh * num_mesh * dtype.itemsize, num_mesh * dtype.itemsize, num_mesh * 4,
+                 num_mesh * 4, headings_size]
+        res = [0]
+        for size in sizes:
+            res.append(-(-(res[-1] + size) // cls.ALIGNMENT) * cls.ALIGNMENT)
+        return res
+
+    @classmethod
+    def export(cls, model: RecommendMixin, log_idf: np.ndarray, mesh_index_map: np.ndarray, headings: tp.List[str],
+               file_path: str, dtype='f4') -> str:
+        """
+        Write the parameters of a trained model, converted to dtype (f4 or f2)
+        :param log_idf: log10(idf) of the kept mesh terms, as frozen by MeshRecommender
+        :param headings: the headings of the kept mesh terms
+        :return: the version hash
+        """
+        dtype = np.dtype(dtype).newbyteorder('<')
+        if dtype.kind != 'f' or dtype.itemsize not in (2, 4):
+            raise Exception(f"Unsupported dtype {dtype}, use f4 or f2.")
+        num_mesh = len(mesh_index_map)
+        sections = [np.ascontiguousarray(model._W_theta, dtype=dtype), np.ascontiguousarray(model._b, dtype=dtype),
+                    np.ascontiguousarray(log_idf, dtype='<f4'), np.ascontiguousarray(mesh_index_map, dtype='<u4'),
+                    np.frombuffer('\n'.join(headings).encode(), dtype='u1')]
+        digest = blake2b(digest_size=16)
+        for section in sections:
+            digest.update(section.tobytes())
+        header = np.array([(cls.MAGIC, cls.FORMAT_VERSION, dtype.str.encode(), num_mesh, len(sections[-1]),
+                            np.frombuffer(digest.digest(), dtype='u1'))], dtype=cls.HEADER)
+        offsets = cls._offsets(num_mesh, dtype, len(sections[-1]))
+        with open(file_path, 'wb') as writer:
+            for offset, section in zip(offsets, [header] + sections):
+                writer.write(b'\0' * (offset - writer.tell()))
+                writer.write(section.tobytes())
+            writer.write(b'\0' * (offsets[-1] - writer.tell()))
+        return digest.hexdigest()
+
+    @classmethod
+    def read_header(cls, file_path: str) -> np.void:
+        with open(file_path, 'rb') as reader:
+            header = np.frombuffer(reader.read(cls.HEADER.itemsize), dtype=cls.HEADER)[0]
+        if header['magic'] != cls.MAGIC:
+            raise Exception(f"{file_path} is not an inference artifact.")
+        if header['format_version'] != cls.FORMAT_VERSION:
+            raise Exception(f"Unsupported format version {header['format_version']} of {file_path}.")
+        return header
+
+    @classmethod
+    def load(cls, file_path: str) -> 'InferenceArtifact':
+        header = cls.read_header(file_path)
+        num_mesh = int(header['num_mesh'])
+        dtype = np.dtype(header['dtype'].decode())
+        offsets = cls._offsets(num_mesh, dtype, int(header['headings_size']))
+        raw = np.memmap(file_path, dtype='u1', mode='r')
+        W_theta = raw[offsets[1]:offsets[1] + num_mesh * num_mesh * dtype.itemsize].view(dtype).reshape(num_mesh,
+                                                                                                       num_mesh)
+        b = raw[offsets[2]:offsets[2] + num_mesh * dtype.itemsize].view(dtype)
+        log_idf = raw[offsets[3]:offsets[3] + num_mesh * 4].view('<f4')
+        mesh_index_map = raw[offsets[4]:offsets[4] + num_mesh * 4].view('<u4')
+        headings = raw[offsets[5]:offsets[5] + int(header['headings_size'])].tobytes().decode().split('\n')
+        return cls(W_theta, b, log_idf, mesh_index_map, headings, header['version'].tobytes().hex())
+
+    def predict(self, r: np.ndarray):
+        res = np.dot(self._W_theta, r) + self._b
+        res[res < 0] = 0  # ReLu
+        return res
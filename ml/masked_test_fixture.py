@@ -0,0 +1,120 @@
+from base import *
+from scipy.sparse import csc_matrix
+from ml.data_set_splitter import DataSetSplitter
+
+
+class MaskedTestFixture(object):
+    """
+    Documents with a fraction of their non-zero values masked (held out), so many models can be tested against the same
+    masks. Both the masked input and the held out values are stored as sparse matrices.
+    """
+    __FILE_EXTENSION__ = ".mtf"  # masked test fixture
+
+    def __init__(self, masked_r: csc_matrix, held_out_r: csc_matrix, fraction_of_masking: float, seed=None,
+                 source_identity: np.ndarray = None):
+        """
+        :param masked_r: the documents (columns) with the held out values set to zero
+        :param held_out_r: the held out values
+        :param source_identity: DataSetSplitter.file_identity of the data set file the fixture is created from
+        """
+        self.masked_r = masked_r
+        self.held_out_r = held_out_r
+        self.fraction_of_masking = fraction_of_masking
+        self.seed = seed
+        self.source_identity = source_identity
+
+    @property
+    def shape(self):
+        return self.masked_r.shape
+
+    @staticmethod
+    def choose_masks(block: csc_matrix, fraction_of_masking: float, rng: np.random.Generator) -> np.ndarray:
+        """
+        Choose int(nnz * fraction_of_masking) of the nnz non-zero values of every column to be masked, drawn from the
+        stored values of the sparse block at once.
+        :param block: csc matrix without explicit zeros
+        :return: boolean array over block.data, True for the masked values
+        """
+        nnz_per_col = np.diff(block.indptr)
+        col_of_value = np.repeat(np.arange(block.shape[1]), nnz_per_col)
+        # rank the values of every column in a random order, and mask the first ones
+        order = np.lexsort((rng.random(block.nnz), col_of_value))
+        rank = np.empty(block.nnz, dtype=int)
+        rank[order] = np.arange(block.nnz) - block.indptr[col_of_value[order]]
+        num_masked = (nnz_per_col * fraction_of_masking).astype(int)
+        return rank < num_masked[col_of_value]
+
+    @classmethod
+    def create(cls, docs: csc_matrix, fraction_of_masking=0.5,
+               seed: tp.Union[int, np.random.Generator] = None) -> 'MaskedTestFixture':
+        """
+        Mask the documents having non zero values
+        :param seed: seed or random generator of the masks
+        """
+        docs = csc_matrix(docs, copy=True)
+        docs.eliminate_zeros()
+        docs = docs[:, np.diff(docs.indptr) > 0]
+        masks = cls.choose_masks(docs, fraction_of_masking, np.random.default_rng(seed))
+        masked_r = docs.copy()
+        masked_r.data[masks] = 0
+        masked_r.eliminate_zeros()
+        held_out_r = docs
+        held_out_r.data[~masks] = 0
+        held_out_r.eliminate_zeros()
+        return cls(masked_r, held_out_r, fraction_of_masking, seed if type(seed) is int else None)
+
+    def iterate_blocks(self, block_size: int) -> tp.Iterator[tp.Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        :return: iterator of dense (r, masked r, held out) blocks. held out is True for the masked values
+        """
+        for start in range(0, self.shape[1], block_size):
+            masked_r = self.masked_r[:, start:start + block_size].toarray()
+            held_out_r = self.held_out_r[:, start:start + block_size].toarray()
+            yield masked_r + held_out_r, masked_r, held_out_r != 0
+
+    @classmethod
+    def fixture_path(cls, sds_file_path: str, data_set_indicator: int, fraction_of_masking: float, seed: int) -> str:
+        """
+        the fixture of a split of the data set is stored next to the data set file
+        """
+        return (f"{os.path.splitext(sds_file_path)[0]}.{data_set_indicator}.{fraction_of_masking}.{seed}"
+                f"{cls.__FILE_EXTENSION__}")
+
+    @classmethod
+    def get_or_create(cls, sds_file_path: str, data_set_indicator: int, fraction_of_masking=0.5,
+                      seed=0) -> 'MaskedTestFixture':
+        """
+        Load the fixture of a split of the data set, creating and dumping it at the first time, or when the data set
+        file has changed since
+        """
+        file_path = cls.fixture_path(sds_file_path, data_set_indicator, fraction_of_masking, seed)
+        source_identity = DataSetSplitter.file_identity(sds_file_path)
+        if os.path.exists(file_path):
+            res = cls.load(file_path)
+            if res.source_identity is not None and np.array_equal(res.source_identity, source_identity):
+                return res
+            print(f"{sds_file_path} changed, recreating {file_path}")
+        res = cls.create(DataSetSplitter.get_utility_matrix(sds_file_path, data_set_indicator), fraction_of_masking,
+                         seed)
+        res.source_identity = source_identity
+        res.dump(file_path)
+        return res
+
+    def dump(self, file_path: str):
+        with open(file_path, 'wb') as writer:
+            np.savez(writer, shape=np.array(self.shape), fraction_of_masking=self.fraction_of_masking,
+                     seed=-1 if self.seed is None else self.seed,
+                     **({} if self.source_identity is None else {'source_identity': self.source_identity}),
+                     **{f"{name}_{attr}": getattr(matrix, attr)
+                        for name, matrix in (('masked', self.masked_r), ('held_out', self.held_out_r))
+                        for attr in ('data', 'indices', 'indptr')})
+
+    @classmethod
+    def load(cls, file_path: str) -> 'MaskedTestFixture':
+        with np.load(file_path) as f:
+            shape = tuple(f['shape'])
+            matrices = [csc_matrix((f[f"{name}_data"], f[f"{name}_indices"], f[f"{name}_indptr"]), shape=shape)
+                        for name in ('masked', 'held_out')]
+            seed = int(f['seed'])
+            source_identity = f['source_identity'] if 'source_identity' in f.files else None
+            return cls(*matrices, float(f['fraction_of_masking']), None if seed < 0 else seed, source_identity)
@@ -0,0 +1,129 @@
+from base import *
+from scipy.sparse import csr_matrix, csc_matrix
+from clinical_trials.clinical_trial_document_mesh_counter import ClinicalTrialDocumentMeshCounter
+from ml.data_set_splitter import DataSetSplitter
+from ml.mesh_vocabulary import MeshVocabulary
+import pickle
+
+
+class MasterMatrix(object):
+    """
+    The tf-idf of every mesh index found in the corpus, before any frequency threshold, with the document frequencies,
+    the headings and the nct_ids. It is built from the counter once; the vocabularies of any threshold or top n, and any
+    split of the documents, are then views selected by indices.
+    """
+    __FILE_EXTENSION__ = ".mm"  # master matrix
+
+    def __init__(self, tf_idf: csr_matrix, mesh_index_map: np.ndarray, headings: np.ndarray, df: np.ndarray,
+                 nct_ids: np.ndarray, source_identity: np.ndarray = None):
+        """
+        :param tf_idf: mesh terms x documents
+        :param mesh_index_map: row -> ctdmc mesh index
+        :param df: number of documents of every row
+        :param source_identity: DataSetSplitter.file_identity of the counter file the matrix is built from
+        """
+        self.tf_idf = tf_idf
+        self.mesh_index_map = mesh_index_map
+        self.headings = headings
+        self.df = df
+        self.nct_ids = nct_ids
+        self.source_identity = source_identity
+
+    @property
+    def num_docs(self) -> int:
+        return self.tf_idf.shape[1]
+
+    @classmethod
+    def from_counter(cls, ctdmc: ClinicalTrialDocumentMeshCounter) -> 'MasterMatrix':
+        num_docs = ctdmc.num_processed_docs()
+        mesh_index_map, indptr, indices, data = [], [0], [], []
+        for mesh_index, counter in tqdm(enumerate(ctdmc)):
+            if counter is None:
+                continue
+            tf = np.fromiter(counter.values(), dtype='f8', count=len(counter))
+            mesh_index_map.append(mesh_index)
+            indices.append(np.fromiter(counter.keys(), dtype='i4', count=len(counter)))
+            data.append((np.log10(1 + tf) * np.log10(num_docs / len(counter))).astype('f4'))  # as ctdmc.tf_idf
+            indptr.append(indptr[-1] + len(counter))
+        tf_idf = csr_matrix((np.concatenate(data), np.concatenate(indices), np.array(indptr)),
+                            shape=(len(mesh_index_map), num_docs))
+        tf_idf.sort_indices()
+        headings = [ctdmc.mesh_trie.get_heading_of_index(mesh_index) for mesh_index in mesh_index_map]
+        return cls(tf_idf, np.array(mesh_index_map, dtype='u4'), np.array(headings, dtype=str),
+                   np.diff(tf_idf.indptr).astype('u4'), np.array(ctdmc.nct_ids, dtype=str))
+
+    def select_mesh(self, frequency_threshold: tp.Union[int, float] = None, top_n: int = None) -> np.ndarray:
+        """
+        :param frequency_threshold: keep the mesh indices showing up in at least this number of documents. If it is a
+         float then frequency_threshold*num_docs is the threshold, as in DataSetSplitter.dump_split_data_set
+        :param top_n: keep the top_n most frequent mesh indices
+        :return: the kept rows, in the order of the mesh indices
+        """
+        keep = np.ones(len(self.df), dtype=bool)
+        if frequency_threshold is not None:
+            if type(frequency_threshold) is float:
+                frequency_threshold = frequency_threshold * self.num_docs
+            keep &= self.df >= frequency_threshold
+        if top_n is not None and top_n < np.sum(keep):
+            candidates = np.flatnonzero(keep)
+            keep[:] = False
+            keep[candidates[np.argsort(-self.df[candidates], kind='stable')[:top_n]]] = True
+        return np.flatnonzero(keep)
+
+    def vocabulary(self, rows: np.ndarray) -> MeshVocabulary:
+        return MeshVocabulary(self.mesh_index_map[rows], self.headings[rows], self.df[rows], self.num_docs)
+
+    def utility_matrix(self, rows: np.ndarray = None, docs: np.ndarray = None) -> csc_matrix:
+        """
+        :param rows: the kept rows, all by default
+        :param docs: indices or boolean mask of the documents, e.g. split_choice_map == DATA_SET_INDICATOR.TRAIN
+        """
+        res = self.tf_idf if rows is None else self.tf_idf[rows]
+        return (res if docs is None else res[:, docs]).tocsc()
+
+    def dump_split_data_set(self, output_file_path: str, split_choice_map: np.ndarray,
+                            frequency_threshold: tp.Union[int, float] = 0.005,
+                            top_n: int = None, compression: str = None) -> tp.Tuple[np.ndarray, np.ndarray]:
+        """
+        Write a split data set and its vocabulary, as DataSetSplitter.dump_split_data_set without the counter
+        """
+        rows = self.select_mesh(frequency_threshold, top_n)
+        tf_idf = self.tf_idf[rows]
+        DataSetSplitter.dump_utility_matrix(output_file_path, self.mesh_index_map[rows], split_choice_map,
+                                            (tf_idf[i].toarray().ravel() for i in range(len(rows))), compression)
+        self.vocabulary(rows).dump(MeshVocabulary.vocabulary_path(output_file_path))
+        return self.mesh_index_map[rows], split_choice_map
+
+    @classmethod
+    def get_or_create(cls, ctdmc_file_path: str) -> 'MasterMatrix':
+        """
+        Load the master matrix stored next to the counter file, building and dumping it at the first time, or when the
+        counter file has changed since
+        """
+        file_path = f"{os.path.splitext(ctdmc_file_path)[0]}{cls.__FILE_EXTENSION__}"
+        source_identity = DataSetSplitter.file_identity(ctdmc_file_path)
+        if os.path.exists(file_path):
+            res = cls.load(file_path)
+            if res.source_identity is not None and np.array_equal(res.source_identity, source_identity):
+                return res
+            print(f"{ctdmc_file_path} changed, rebuilding {file_path}")
+        with open(ctdmc_file_path, 'rb') as f:
+            ctdmc = pickle.load(f)
+        res = cls.from_counter(ctdmc)
+        res.source_identity = source_identity
+        res.dump(file_path)
+        return res
+
+    def dump(self, file_path: str):
+        with open(file_path, 'wb') as writer:
+            np.savez(writer, shape=np.array(self.tf_idf.shape), data=self.tf_idf.data, indices=self.tf_idf.indices,
+                     indptr=self.tf_idf.indptr, mesh_index_map=self.mesh_index_map, headings=self.headings,
+                     df=self.df, nct_ids=self.nct_ids,
+                     **({} if self.source_identity is None else {'source_identity': self.source_identity}))
+
+    @classmethod
+    def load(cls, file_path: str) -> 'MasterMatrix':
+        with np.load(file_path) as f:
+            tf_idf = csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            source_identity = f['source_identity'] if 'source_identity' in f.files else None
+            return cls(tf_idf, f['mesh_index_map'], f['headings'], f['df'], f['nct_ids'], source_identity)
@@ -0,0 +1,124 @@
+from base import *
+from collections import Counter, deque
+from math import log10
+from time import perf_counter
+from scipy.sparse import csc_matrix
+from mesh.trie.mesh_trie import MeshTrie
+from clinical_trials.clinical_trial_document import ClinicalTrialDocument
+from clinical_trials.clinical_trial_document_mesh_counter import ClinicalTrialDocumentMeshCounter
+from ml.recommend_mixin import RecommendMixin
+from ml.inference_artifact import InferenceArtifact
+
+
+class MeshRecommender(object):
+    """
+    Recommend mesh headings for the raw text of clinical trials, with everything needed preloaded:
+    mesh trie matching -> tf-idf with the frozen idf of the corpus -> mesh index map -> model scores and top k.
+    The latency of every stage is recorded per call.
+    """
+    STAGES = ('match', 'tf_idf', 'score', 'total')
+
+    def __init__(self, mesh_trie: MeshTrie, log_idf: np.ndarray, mesh_index_map: np.ndarray, model: RecommendMixin,
+                 latency_window=10000):
+        """
+
+        :param mesh_trie: the trie the utility matrix was counted with
+        :param log_idf: log10(idf) of the kept mesh terms, in the order of mesh_index_map
+        :param mesh_index_map: kept mesh index -> trie mesh index, as in the split data set the model was trained with
+        :param model: any model with recommend, e.g. a trained latent factor model
+        :param latency_window: number of the latest calls whose latencies are kept
+        """
+        self._mesh_trie = mesh_trie
+        self._log_idf = np.asarray(log_idf, dtype='f8')
+        self._mesh_index_map = np.asarray(mesh_index_map)
+        self._model = model
+        self._position = {mesh_index: i for i, mesh_index in enumerate(self._mesh_index_map.tolist())}
+        self._headings = [mesh_trie.get_heading_of_index(mesh_index) for mesh_index in self._mesh_index_map.tolist()]
+        self._latencies = {stage: deque(maxlen=latency_window) for stage in self.STAGES}
+
+    @classmethod
+    def from_counter(cls, ctdmc: ClinicalTrialDocumentMeshCounter, mesh_index_map: np.ndarray,
+                     model: RecommendMixin, **kwargs) -> 'MeshRecommender':
+        """
+        Freeze the idf of the kept mesh terms from the counter of the corpus
+        """
+        log_idf = np.array([log10(ctdmc.idf(mesh_index)) for mesh_index in mesh_index_map.tolist()])
+        return cls(ctdmc.mesh_trie, log_idf, mesh_index_map, model, **kwargs)
+
+    @classmethod
+    def from_artifact(cls, mesh_trie: MeshTrie, artifact: InferenceArtifact, **kwargs) -> 'MeshRecommender':
+        """
+        The artifact has the frozen idf and the mesh index map of the model
+        """
+        return cls(mesh_trie, artifact.log_idf, artifact.mesh_index_map, artifact, **kwargs)
+
+    @property
+    def headings(self) -> tp.List[str]:
+        """
+        the headings of the kept mesh terms
+        """
+        return self._headings
+
+    def count_mesh_indices(self, doc: tp.Union[ClinicalTrialDocument, tp.Dict[str, str]]) -> Counter:
+        """
+        :param doc: a ClinicalTrialDocument, or a dict of its MESH_ATTRIBUTES to raw text
+        :return: kept mesh index -> term frequency over the attributes of the document
+        """
+        res = Counter()
+        for attr in ClinicalTrialDocument.MESH_ATTRIBUTES:
+            text = doc.get(attr) if isinstance(doc, dict) else getattr(doc, attr)
+            for mesh_index, count in self._mesh_trie.count_mesh_indices(text).items():
+                if mesh_index in self._position:  # mesh terms unknown to the model are dropped
+                    res[self._position[mesh_index]] += count
+        return res
+
+    def vectorize(self, counters: tp.List[Counter]) -> csc_matrix:
+        """
+        :return: the tf-idf utility matrix of the documents, as in the split data set
+        """
+        indptr = np.cumsum([0] + [len(counter) for counter in counters])
+        indices = np.fromiter((i for counter in counters for i in counter.keys()), dtype=int, count=indptr[-1])
+        tf = np.fromiter((c for counter in counters for c in counter.values()), dtype='f8', count=indptr[-1])
+        data = (np.log10(1 + tf) * self._log_idf[indices]).astype('f4')
+        return csc_matrix((data, indices, indptr), shape=(len(self._mesh_index_map), len(counters)))
+
+    def recommend_many(self, docs: tp.Iterable[tp.Union[ClinicalTrialDocument, tp.Dict[str, str]]], k=10,
+                       exclude_present=True) -> tp.List[tp.List[tp.Tuple[str, float]]]:
+        """
+        Score the documents together with a single model call
+        :return: for every document, the top k (heading, score) in descending order of scores
+        """
+        start = perf_counter()
+        counters = [self.count_mesh_indices(doc) for doc in docs]
+        matched = perf_counter()
+        r = self.vectorize(counters)
+        vectorized = perf_counter()
+        indices, scores = self._model.recommend(r, k, exclude_present)
+        res = [[(self._headings[i], float(score)) for i, score in zip(doc_indices, doc_scores) if np.isfinite(score)]
+               for doc_indices, doc_scores in zip(indices, scores)]
+        end = perf_counter()
+        for stage, seconds in zip(self.STAGES, (matched - start, vectorized - matched, end - vectorized, end - start)):
+            self._latencies[stage].append(seconds)
+        return res
+
+    def recommend(self, doc: tp.Union[ClinicalTrialDocument, tp.Dict[str, str]], k=10,
+                  exclude_present=True) -> tp.List[tp.Tuple[str, float]]:
+        """
+        :param doc: a ClinicalTrialDocument, or a dict of its MESH_ATTRIBUTES to raw text
+        :return: the top k (heading, score) in descending order of scores
+        """
+        return self.recommend_many([doc], k, exclude_present)[0]
+
+    @property
+    def last_latency(self) -> tp.Dict[str, float]:
+        """
+        seconds spent in every stage by the latest call
+        """
+        return {stage: latencies[-1] for stage, latencies in self._latencies.items() if latencies}
+
+    def latency_percentiles(self, percentiles: tp.Iterable = (50, 90, 99)) -> tp.Dict[str, np.ndarray]:
+        """
+        :return: stage -> the percentiles of the latencies, in milliseconds, over the latest calls
+        """
+        return {stage: np.percentile(np.array(latencies) * 1000, list(percentiles))
+                for stage, latencies in self._latencies.items() if latencies}
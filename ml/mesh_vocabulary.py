@@ -0,0 +1,66 @@
+from base import *
+from clinical_trials.clinical_trial_document_mesh_counter import ClinicalTrialDocumentMeshCounter
+
+
+class MeshVocabulary(object):
+    """
+    The kept mesh terms of a split data set: kept index -> trie mesh index -> heading, with the document frequencies.
+    It is a small sidecar of the data set file, so the headings are shown without loading the counter or the trie.
+    """
+    __FILE_EXTENSION__ = ".msv"  # mesh vocabulary
+
+    def __init__(self, mesh_index_map: np.ndarray, headings: np.ndarray, df: np.ndarray, num_docs: int):
+        """
+        :param mesh_index_map: kept mesh index -> trie mesh index
+        :param headings: the headings of the kept mesh terms
+        :param df: number of documents of every kept mesh term
+        :param num_docs: number of documents of the corpus
+        """
+        self.mesh_index_map = mesh_index_map
+        self.headings = headings
+        self.df = df
+        self.num_docs = num_docs
+
+    @classmethod
+    def from_counter(cls, ctdmc: ClinicalTrialDocumentMeshCounter, mesh_index_map: tp.List[int]) -> 'MeshVocabulary':
+        headings = [ctdmc.mesh_trie.get_heading_of_index(mesh_index) for mesh_index in mesh_index_map]
+        df = [ctdmc.df(mesh_index) for mesh_index in mesh_index_map]
+        return cls(np.array(mesh_index_map, dtype='u4'), np.array(headings, dtype=str), np.array(df, dtype='u4'),
+                   ctdmc.num_processed_docs())
+
+    def __len__(self):
+        return len(self.mesh_index_map)
+
+    def __getitem__(self, index: int) -> str:
+        """
+        the heading of a kept mesh index
+        """
+        return self.headings[index]
+
+    @property
+    def idf(self) -> np.ndarray:
+        """
+        idf as in ClinicalTrialDocumentMeshCounter.idf
+        """
+        return self.num_docs / np.maximum(self.df, 1)
+
+    @property
+    def log_idf(self) -> np.ndarray:
+        return np.log10(self.idf)
+
+    @classmethod
+    def vocabulary_path(cls, sds_file_path: str) -> str:
+        """
+        the vocabulary of a split data set is stored next to the data set file
+        """
+        return f"{os.path.splitext(sds_file_path)[0]}{cls.__FILE_EXTENSION__}"
+
+    def dump(self, file_path: str):
+        with open(file_path, 'wb') as writer:
+            np.savez(writer, mesh_index_map=self.mesh_index_map, headings=self.headings, df=self.df,
+                     num_docs=self.num_docs)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'MeshVocabulary':
+        with np.load(file_path) as f:
+            return cls(f['mesh_index_map'], f['headings'], f['df'], int(f['num_docs']))
@@ -1,60 +1,378 @@
 from base import *
-from scipy.sparse import csc_matrix
+from scipy.sparse import csc_matrix, hstack, vstack
 from ml.abstract_model import AbstractLatentFactorModel
+from ml.optimizer import Optimizer, SGD, LearningRateSchedule, ConstantSchedule
+from ml.streaming_batch_source import StreamingBatchSource
 import math
+import time
 
 
 class MiniBatchReLuLatentFactorModel(AbstractLatentFactorModel):
-    def __init__(self, tau=-2, k=2, alpha=0.01, lambda_=0.0001, batch_size=10000, max_epoch=1000):
+    def __init__(self, tau=-2, k=2, alpha=0.01, lambda_=0.0001, batch_size=10000, max_epoch=1000,
+                 checkpoint_path: str = None, checkpoint_interval=1, patience: int = None, min_delta=0.0,
+                 validate_sample_size=1000, optimizer: Optimizer = None,
+                 learning_rate_schedule: LearningRateSchedule = None, target_loss: float = None):
+        """
+
+        :param checkpoint_path: if given, theta, b and the training history are saved to this file every
+         checkpoint_interval epochs, and training can be resumed from it
+        :param checkpoint_interval: number of epochs between two checkpoints
+        :param patience: stop training when the validation loss has not improved by more than min_delta for this
+         number of epochs. None disables early stopping
+        :param min_delta: the minimum decrease of the validation loss counted as an improvement
+        :param validate_sample_size: number of validation documents sampled to calculate the validation loss
+        :param optimizer: turns the gradients into updates, plain SGD by default
+        :param learning_rate_schedule: learning rate of every epoch given alpha, alpha for all epochs by default
+        :param target_loss: the first epoch whose training loss is not above target_loss is recorded, to compare the
+         convergence of optimizers
+        """
         super(MiniBatchReLuLatentFactorModel, self).__init__(tau, k, alpha, lambda_)
         self._batch_size = batch_size
         self._max_epoch = max_epoch
+        self._checkpoint_path = checkpoint_path
+        self._checkpoint_interval = checkpoint_interval
+        self._patience = patience
+        self._min_delta = min_delta
+        self._validate_sample_size = validate_sample_size
+        self._validation_history = None
+        self._training_times = None
+        self._optimizer = SGD() if optimizer is None else optimizer
+        self._learning_rate_schedule = ConstantSchedule() if learning_rate_schedule is None else learning_rate_schedule
+        self._target_loss = target_loss
+        self._epochs_to_target_loss = None
+        # the losses over the new (and replayed) documents of every partial_fit pass, which are not comparable with
+        # the training losses over all documents
+        self._partial_fit_history = []
+        self._partial_fit_times = []
+        # kept after training for partial_fit, but not pickled, see dump_training_state
+        self._theta = None
+        self._gram = None
+
+    def __getstate__(self):
+        # theta and the gram matrix are two dense mxm arrays only needed by partial_fit
+        state = self.__dict__.copy()
+        state.update(_theta=None, _gram=None)
+        return state
+
+    def dump_training_state(self, file_path: str):
+        """
+        Save theta, the gram matrix and the optimizer state, which are not pickled with the model, for partial_fit of
+        the loaded model
+        """
+        with open(file_path, 'wb') as writer:
+            np.savez(writer, theta=self._theta, gram=self._gram,
+                     **{f"optimizer{key}": value for key, value in self._optimizer.state().items()})
+
+    def load_training_state(self, file_path: str):
+        with np.load(file_path) as training_state:
+            self._theta = training_state['theta']
+            self._gram = training_state['gram']
+            m = self._theta.shape[0]
+            self._optimizer.initialize((m, m), (m, 1))
+            optimizer_state = {key[len('optimizer'):]: training_state[key]
+                               for key in training_state.files if key.startswith('optimizer')}
+            if optimizer_state:
+                self._optimizer.load_state(optimizer_state)
+
+    def _save_checkpoint(self, epoch: int, theta: np.ndarray, b: np.ndarray, best_theta: np.ndarray,
+                         best_b: np.ndarray, validate_columns: np.ndarray = None, stopped=False,
+                         data_set_identity: np.ndarray = None):
+        """
+        :param validate_columns: the sampled validation documents, so a resumed training validates on the same ones
+        :param stopped: whether the training stopped early, so a resumed training does not continue
+        :param data_set_identity: DataSetSplitter.file_identity of the data set trained with, see _is_checkpoint_of
+        """
+        # write to a temporary file first, so a crash while writing does not corrupt the last checkpoint
+        tmp_path = f"{self._checkpoint_path}.tmp"
+        with open(tmp_path, 'wb') as writer:
+            np.savez(writer, epoch=epoch, shape=np.array(theta.shape), theta=theta, b=b, best_theta=best_theta,
+                     best_b=best_b, stopped=stopped,
+                     **({} if validate_columns is None else {'validate_columns': validate_columns}),
+                     **({} if data_set_identity is None else {'data_set_identity': data_set_identity}),
+                     training_history=np.array(self._training_history),
+                     training_times=np.array(self._training_times),
+                     validation_history=np.array(self._validation_history),
+                     **{f"optimizer{key}": value for key, value in self._optimizer.state().items()})
+        os.replace(tmp_path, self._checkpoint_path)
+
+    @staticmethod
+    def _is_checkpoint_of(checkpoint_path: str, m: int, data_set_identity: np.ndarray = None) -> bool:
+        """
+        :return: whether the checkpoint is of a training with m mesh terms, and of the data set file of the
+         data_set_identity if given
+        """
+        with np.load(checkpoint_path) as checkpoint:
+            shape = tuple(checkpoint['shape']) if 'shape' in checkpoint.files else checkpoint['theta'].shape
+            if shape != (m, m):
+                return False
+            return data_set_identity is None or ('data_set_identity' in checkpoint.files and
+                                                 np.array_equal(checkpoint['data_set_identity'], data_set_identity))
+
+    def _load_checkpoint(self, checkpoint_path: str) -> tp.Tuple[int, np.ndarray, np.ndarray, np.ndarray, np.ndarray,
+                                                                  tp.Optional[np.ndarray], bool]:
+        """
+        :return: epoch, theta, b, best_theta, best_b, the sampled validation documents (None if not saved) and whether
+         the training stopped early
+        """
+        with np.load(checkpoint_path) as checkpoint:
+            self._training_history = checkpoint['training_history'].tolist()
+            self._training_times = checkpoint['training_times'].tolist()
+            self._validation_history = checkpoint['validation_history'].tolist()
+            self._optimizer.load_state({key[len('optimizer'):]: checkpoint[key]
+                                        for key in checkpoint.files if key.startswith('optimizer')})
+            return (int(checkpoint['epoch']), checkpoint['theta'], checkpoint['b'],
+                    checkpoint['best_theta'], checkpoint['best_b'],
+                    checkpoint['validate_columns'] if 'validate_columns' in checkpoint.files else None,
+                    bool(checkpoint['stopped']) if 'stopped' in checkpoint.files else False)
+
+    def _check_validation_history(self) -> tp.Tuple[bool, int]:
+        """
+        :return: whether the last validation loss is the best so far, and the number of epochs since the best one
+        """
+        best = self._validation_history[0]
+        epochs_without_improvement = 0
+        for loss in self._validation_history[1:]:
+            if loss < best - self._min_delta:
+                best = loss
+                epochs_without_improvement = 0
+            else:
+                epochs_without_improvement += 1
+        return epochs_without_improvement == 0, epochs_without_improvement
 
-    def train(self, train_r: csc_matrix):
-        def cal_loss():
-            rhat = W_theta.dot(R) + b
-            rhat[rhat < 0] = 0
-            return np.sum(np.power(rhat - R, 2)) / (2 * n)
+    def _sample_validate_columns(self, validate_r: tp.Union[csc_matrix, StreamingBatchSource]) -> np.ndarray:
+        n = validate_r.shape[1]
+        if n > self._validate_sample_size:
+            return np.sort(np.random.choice(n, self._validate_sample_size, replace=False))
+        return np.arange(n)
 
-        R = train_r.toarray()
-        m, n = train_r.shape
-        theta = np.zeros((m, m))
-        b = np.zeros((m, 1))
-        W = self._calculate_neighbor_weight_matrix(train_r)
+    @staticmethod
+    def _validate_matrix(validate_r: tp.Union[csc_matrix, StreamingBatchSource], columns: np.ndarray) -> np.ndarray:
+        if isinstance(validate_r, StreamingBatchSource):
+            return validate_r.columns(columns).toarray()
+        return validate_r[:, columns].toarray()
 
+    def _iterate_batches(self, train_r: tp.Union[csc_matrix, StreamingBatchSource],
+                         epoch: int) -> tp.Iterator[csc_matrix]:
+        if isinstance(train_r, StreamingBatchSource):
+            yield from train_r.batches(self._batch_size, epoch)
+        else:
+            for start in range(0, train_r.shape[1], self._batch_size):
+                yield train_r[:, start:start + self._batch_size]
+
+    def _calculate_training_gram_matrix(self, train_r: tp.Union[csc_matrix, StreamingBatchSource]) -> np.ndarray:
+        if not isinstance(train_r, StreamingBatchSource):
+            return self._calculate_gram_matrix(train_r)
+        m = train_r.shape[0]
+        res = np.zeros((m, m))
+        for B in tqdm(train_r.batches(self._batch_size), desc="Gram matrix"):
+            res += self._calculate_gram_matrix(B)
+        return res
+
+    def _calculate_training_loss(self, W_theta: np.ndarray, b: np.ndarray,
+                                 R: tp.Union[np.ndarray, StreamingBatchSource]) -> float:
+        """
+        the loss of the dense training matrix, or accumulated over the batches of a streaming batch source
+        """
+        if not isinstance(R, StreamingBatchSource):
+            return self._calculate_loss(W_theta, b, R)
+        res = 0.0
+        for B in R.batches(self._batch_size):
+            res += self._calculate_loss(W_theta, b, B.toarray()) * B.shape[1]
+        return res / R.shape[1]
+
+    def _update(self, theta: np.ndarray, b: np.ndarray, grad_theta: np.ndarray, grad_b: np.ndarray,
+                learning_rate: float) -> tp.Tuple[np.ndarray, np.ndarray, float]:
+        """
+        One optimization step with weight decay lambda. Return the new theta, b and the squared size of the step
+        """
+        update_theta, update_b = self._optimizer.compute_update(grad_theta, grad_b, learning_rate)
+        delta_theta = update_theta + self._lambda * theta
+        theta = theta - delta_theta
+        b = b - update_b
+        return theta, b, np.sum(np.power(delta_theta, 2)) + np.sum(np.power(update_b, 2))
+
+    def _train_epoch(self, epoch: int, train_r: tp.Union[csc_matrix, StreamingBatchSource], W: np.ndarray,
+                     theta: np.ndarray, b: np.ndarray) -> tp.Tuple[np.ndarray, np.ndarray]:
+        """
+        Run one epoch of mini-batch gradient descent and return the updated theta and b
+        """
+        n = train_r.shape[1]
         W_theta = W * theta
-        alpha_W = self._alpha * W
-        self._training_history = [cal_loss()]
-        print(f"Loss before training: {self._training_history[-1]:0.8E}")
-        for epoch in range(self._max_epoch):
-            pbar = tqdm(range(math.ceil(n / self._batch_size)))
-            for batch_index in pbar:
-                start = batch_index * self._batch_size
-                B = train_r[:, start:start + self._batch_size].toarray()
-                bsize = B.shape[1]
-                B_hat = W_theta.dot(B) + b
-                B_hat_B = (B_hat - B)
-                B_hat_B[B_hat < 0] = 0  # multiply ReLu'(r_hat)
-
-                delta_theta = alpha_W / bsize * (B_hat_B.dot(B.transpose())) + self._lambda * theta
-                delta_b = self._alpha / bsize * (np.sum(B_hat_B, axis=1, keepdims=True))
-
-                # update theta
-                theta = theta - delta_theta
-                b = b - delta_b
-
-                # update W_theta
-                W_theta = W * theta
-                delta_eps = np.sum(np.power(delta_theta, 2) + np.power(delta_b, 2))
-                pbar.set_description(f"Epoch {epoch + 1} batch {batch_index + 1} delta={delta_eps:.8E}")
-            pbar.close()
-
-            loss = cal_loss()
+        learning_rate = self._learning_rate_schedule(self._alpha, epoch)
+        pbar = tqdm(self._iterate_batches(train_r, epoch), total=math.ceil(n / self._batch_size))
+        for batch_index, B in enumerate(pbar):
+            B = B.toarray()
+            bsize = B.shape[1]
+            B_hat = W_theta.dot(B) + b
+            B_hat_B = (B_hat - B)
+            B_hat_B[B_hat < 0] = 0  # multiply ReLu'(r_hat)
+
+            grad_theta = W / bsize * (B_hat_B.dot(B.transpose()))
+            grad_b = np.sum(B_hat_B, axis=1, keepdims=True) / bsize
+            theta, b, delta_eps = self._update(theta, b, grad_theta, grad_b, learning_rate)
+
+            # update W_theta
+            W_theta = W * theta
+            pbar.set_description(f"Epoch {epoch + 1} batch {batch_index + 1} delta={delta_eps:.8E}")
+        pbar.close()
+        return theta, b
+
+    def _initial_parameters(self, train_r: csc_matrix, gram: np.ndarray,
+                            W: np.ndarray) -> tp.Tuple[np.ndarray, np.ndarray]:
+        """
+        theta and b to start the training from
+        """
+        m = train_r.shape[0]
+        return np.zeros((m, m)), np.zeros((m, 1))
+
+    def train(self, train_r: tp.Union[csc_matrix, StreamingBatchSource],
+              validate_r: tp.Union[csc_matrix, StreamingBatchSource] = None, resume_from: str = None,
+              gram: np.ndarray = None, cosine_similarity: np.ndarray = None, data_set_identity: np.ndarray = None):
+        """
+
+        :param train_r: mxn training utility matrix, or a streaming batch source of it, so the training matrix is not
+         held in memory; the gram matrix and the losses are then accumulated over its batches
+        :param validate_r: validation utility matrix, a sample of which is used for the validation loss and early
+         stopping
+        :param resume_from: path of a checkpoint written by a previous (interrupted) training to continue from
+        :param gram: the gram matrix of train_r if it is already calculated, e.g. shared by the models of a search
+        :param cosine_similarity: the cosine similarity of the gram matrix if it is already calculated, W is then an
+         elementwise transform of it
+        :param data_set_identity: DataSetSplitter.file_identity of the data set file of train_r, stored in the
+         checkpoints. A checkpoint of another data set file, or of another number of mesh terms, is not resumed from
+        """
+        start_time = time.time()
+        R = train_r if isinstance(train_r, StreamingBatchSource) else train_r.toarray()
+        m = train_r.shape[0]
+        if gram is None:
+            gram = self._calculate_training_gram_matrix(train_r)
+        if cosine_similarity is None:
+            cosine_similarity = self._calculate_cosine_similarity_from_gram(gram)
+        W = self._calculate_neighbor_weight_matrix_from_cosine_similarity(cosine_similarity)
+
+        self._optimizer.initialize((m, m), (m, 1))
+        validate_columns, stop = None, False
+        if resume_from is not None and not self._is_checkpoint_of(resume_from, m, data_set_identity):
+            print(f"{resume_from} is of another data set, training from scratch.")
+            resume_from = None
+        if resume_from is not None:
+            start_epoch, theta, b, best_theta, best_b, validate_columns, stop = self._load_checkpoint(resume_from)
+        V = None
+        if validate_r is not None:
+            if validate_columns is None:
+                validate_columns = self._sample_validate_columns(validate_r)
+            V = self._validate_matrix(validate_r, validate_columns)
+
+        if resume_from is None:
+            start_epoch = 0
+            theta, b = self._initial_parameters(train_r, gram, W)
+            W_theta = W * theta
+            self._training_history = [self._calculate_training_loss(W_theta, b, R)]
+            self._validation_history = [] if V is None else [self._calculate_loss(W_theta, b, V)]
+            self._training_times = [time.time() - start_time]
+            self._partial_fit_history, self._partial_fit_times = [], []
+            self._epochs_to_target_loss = None
+            best_theta, best_b = theta, b
+            print(f"Loss before training: {self._training_history[-1]:0.8E}")
+        else:
+            start_time -= self._training_times[-1]  # keep the times accumulated before the interruption
+            W_theta = W * theta
+            print(f"Resume from epoch {start_epoch} with loss: {self._training_history[-1]:0.8E}")
+            if stop:
+                print(f"The training stopped early at epoch {start_epoch}, it is not continued.")
+
+        for epoch in range(start_epoch, start_epoch if stop else self._max_epoch):
+            theta, b = self._train_epoch(epoch, train_r, W, theta, b)
+            W_theta = W * theta
+
+            loss = self._calculate_training_loss(W_theta, b, R)
             self._training_history.append(loss)
+            self._training_times.append(time.time() - start_time)
             print(f"Final Loss of epoch {epoch + 1}: {loss:0.8E}")
+            if self._target_loss is not None and self._epochs_to_target_loss is None and loss <= self._target_loss:
+                self._epochs_to_target_loss = epoch + 1
+                print(f"Target loss {self._target_loss:0.8E} reached at epoch {epoch + 1}")
+
+            if V is not None:
+                validate_loss = self._calculate_loss(W_theta, b, V)
+                self._validation_history.append(validate_loss)
+                print(f"Validation Loss of epoch {epoch + 1}: {validate_loss:0.8E}")
+                improved, epochs_without_improvement = self._check_validation_history()
+                if improved:
+                    best_theta, best_b = theta, b
+                stop = self._patience is not None and epochs_without_improvement >= self._patience
+
+            if self._checkpoint_path is not None and (stop or (epoch + 1) % self._checkpoint_interval == 0):
+                self._save_checkpoint(epoch + 1, theta, b, best_theta, best_b, validate_columns, stop,
+                                      data_set_identity)
+
+            if stop:
+                print(f"Early stopping at epoch {epoch + 1}: "
+                      f"validation loss has not improved for {self._patience} epochs.")
+                break
+
+        if stop:
+            theta, b = best_theta, best_b
+            W_theta = W * theta
 
         self._W_theta = W_theta
         self._b = b
+        self._theta = theta
+        self._gram = gram
+
+    def partial_fit(self, new_r: csc_matrix, replay_r: csc_matrix = None, replay_size: int = None, max_passes=1):
+        """
+        Continue the training of a trained model with new documents, instead of retraining from scratch. The gram
+        matrix is updated with the new documents, so W is the one of all documents seen, and theta and b are warm
+        started from the trained ones. The cost is proportional to the number of new (and replayed) documents.
+        :param new_r: utility matrix of the new documents. Rows beyond the current vocabulary are new mesh terms, see
+         DataSetSplitter.align_utility_matrix; theta, b are padded with zeros for them.
+        :param replay_r: utility matrix of old documents, a sample of which is trained together with the new ones to
+         avoid forgetting
+        :param replay_size: number of replayed old documents, the number of new documents by default
+        :param max_passes: number of passes over the new (and replayed) documents
+        """
+        if self._theta is None or self._gram is None:
+            raise Exception("partial_fit needs a model trained by train, or its training state loaded by "
+                            "load_training_state.")
+        m_old = self._theta.shape[0]
+        m, n = new_r.shape
+        if m < m_old:
+            raise Exception(f"new_r has {m} mesh terms, but the model is trained with {m_old}.")
+        theta, b, gram = self._theta, self._b, self._gram
+        if m > m_old:
+            # vocabulary growth
+            theta = np.pad(theta, ((0, m - m_old), (0, m - m_old)))
+            b = np.pad(b, ((0, m - m_old), (0, 0)))
+            gram = np.pad(gram, ((0, m - m_old), (0, m - m_old)))
+            self._optimizer.initialize((m, m), (m, 1))
+        gram = gram + self._calculate_gram_matrix(new_r)
+        W = self._calculate_neighbor_weight_matrix_from_gram(gram)
+
+        docs = new_r
+        if replay_r is not None:
+            replay_size = min(n if replay_size is None else replay_size, replay_r.shape[1])
+            replay = replay_r[:, np.random.choice(replay_r.shape[1], replay_size, replace=False)]
+            replay = vstack([replay, csc_matrix((m - replay.shape[0], replay_size))])  # pad new mesh terms
+            docs = hstack([new_r, replay])
+            docs = docs.tocsc()[:, np.random.permutation(docs.shape[1])]  # mix new and replayed documents
+        docs = csc_matrix(docs)
+        R = docs.toarray()
+
+        start_time = time.time() - (self._partial_fit_times or self._training_times)[-1]
+        print(f"Loss before partial fit: {self._calculate_loss(W * theta, b, R):0.8E}")
+        for _ in range(max_passes):
+            epoch = len(self._training_history) - 1 + len(self._partial_fit_history)
+            theta, b = self._train_epoch(epoch, docs, W, theta, b)
+            loss = self._calculate_loss(W * theta, b, R)
+            self._partial_fit_history.append(loss)
+            self._partial_fit_times.append(time.time() - start_time)
+            print(f"Final Loss of partial fit epoch {epoch + 1}: {loss:0.8E}")
+
+        self._W_theta = W * theta
+        self._b = b
+        self._theta = theta
+        self._gram = gram
 
     def predict(self, r: np.ndarray):
         res = np.dot(self._W_theta, r) + self._b
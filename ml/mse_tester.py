@@ -7,18 +7,19 @@ from scipy.sparse import csc_matrix
 class MseTester(AbstractTester):
     """
     Test the model's using Mean Squared Error (MSE). Concretely, this works by the following steps:
+    (1) a fraction of mesh terms (fraction_of_masking) having non zero tf-idf will be masked to zero
+    (2) the masked records will undergo prediction by the given model
+    (3) the squared errors over all mesh terms, and over the relevant ones (predicted or actually positive) are averaged
     """
+    metric_names = ['mse', 'mse_relevant']
 
-    def test(self, r):
-        masks = self.choose_mask_indices(r)
-        new_r = np.array(r) * masks
-
-        predicted_r = self._model.predict(new_r)
-
+    def test_block(self, r, masked_r, held_out):
+        predicted_r = self._model.predict(masked_r)
+        squared_error = np.power(predicted_r - r, 2)
         relevant = (predicted_r > 0) | (r > 0)
 
-        return (np.power(predicted_r - r, 2).ravel(),
-                np.power(predicted_r[relevant] - r[relevant], 2).ravel())
+        return ((np.sum(squared_error, axis=0), np.full(r.shape[1], r.shape[0])),
+                (np.sum(squared_error, axis=0, where=relevant), np.sum(relevant, axis=0)))
 
     def __call__(self, docs: csc_matrix) -> tp.Tuple:
         """
@@ -26,15 +27,6 @@ class MseTester(AbstractTester):
         :param docs: 2-d array. each column vector is a mesh index vector
         :return: mean squared error, mean squared error of relevant
         """
-        mse = []
-        mser = []
-
-        for col in tqdm(range(docs.shape[1])):
-            r = docs[:, col].toarray()
-            if np.sum(r) > 0:
-                a, b = self.test(r)
-                mse.extend(a)
-                mser.extend(b)
-        res = (np.mean(mse), np.mean(mser))
+        res = self.evaluate(docs)
         self._model.mse_test = res
         return res
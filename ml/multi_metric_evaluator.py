@@ -0,0 +1,96 @@
+from base import *
+from ml.abstract_model import AbstractLatentFactorModel
+from ml.abstract_tester import AbstractTester
+from ml.average_precision_k_tester import AveragePrecisionKTester
+from ml.masked_test_fixture import MaskedTestFixture
+from scipy.sparse import csc_matrix
+
+
+class MultiMetricEvaluator(AbstractTester):
+    """
+    Evaluate the model with all metrics from a single masking and prediction pass over the documents:
+        mse, mse_relevant: as MseTester
+        p@k, random_p@k: precision at k of the model and of random guess, as AveragePrecisionKTester
+        recall@k: the fraction of the masked mesh terms found in the top k
+        ndcg@k: normalized discounted cumulative gain of the top k, the masked mesh terms being relevant
+        map@k: mean average precision at k
+    """
+
+    def __init__(self, model: AbstractLatentFactorModel, ks: tp.Iterable = (1, 3, 5, 10), apk_k=3,
+                 fraction_of_masking=0.5, apk_fraction_of_masking=0.8, **kwargs):
+        """
+
+        :param ks: the k of the ranking metrics
+        :param apk_k: the k of the precision written to model.apk_test
+        :param apk_fraction_of_masking: the masking of the precision written to model.apk_test, that of
+         AveragePrecisionKTester so it is comparable with the earlier models. If it is not the masking of the single
+         pass, the precision is tested in a separate pass.
+        """
+        super(MultiMetricEvaluator, self).__init__(model, fraction_of_masking, **kwargs)
+        self._ks = sorted(set(ks) | {apk_k})
+        self._apk_k = apk_k
+        self._apk_fraction_of_masking = apk_fraction_of_masking
+        self.metric_names = ['mse', 'mse_relevant']
+        for k in self._ks:
+            self.metric_names.extend([f'p@{k}', f'random_p@{k}', f'recall@{k}', f'ndcg@{k}', f'map@{k}'])
+
+    def test_block(self, r, masked_r, held_out):
+        res = []
+        predicted_r = self._model.predict(masked_r)
+
+        # mse
+        squared_error = np.power(predicted_r - r, 2)
+        relevant = (predicted_r > 0) | (r > 0)
+        res.append((np.sum(squared_error, axis=0), np.full(r.shape[1], r.shape[0])))
+        res.append((np.sum(squared_error, axis=0, where=relevant), np.sum(relevant, axis=0)))
+
+        # ranking of the top max(ks) predictions, previously zero and now positive
+        zeros_before_prediction = masked_r == 0
+        max_k = self._ks[-1]
+        predicted, valid = self.top_k(predicted_r, zeros_before_prediction & (predicted_r > 0), max_k)
+        hits = np.take_along_axis(held_out, predicted, axis=0) & valid
+        random_picked, _ = self.top_k(self._rng.random(r.shape), zeros_before_prediction, max_k)
+        random_hits = np.take_along_axis(held_out, random_picked, axis=0)
+
+        num_held_out = np.sum(held_out, axis=0)
+        has_held_out = (num_held_out > 0).astype(float)
+        divisor_held_out = np.maximum(num_held_out, 1)
+        ranks = np.arange(1, hits.shape[0] + 1).reshape(-1, 1)
+        discounts = 1 / np.log2(ranks + 1)
+        cumulative_hits = np.cumsum(hits, axis=0)
+        ones = np.ones(r.shape[1])
+        for k in self._ks:
+            num_predicted = np.sum(valid[:k], axis=0)
+            divisor = np.maximum(num_predicted, 1)  # precision is 0 if nothing is predicted
+            hits_k = cumulative_hits[min(k, len(hits)) - 1]
+            random_hits_k = np.sum(random_hits[:k] & (ranks[:k] <= num_predicted.reshape(1, -1)), axis=0)
+            ideal = np.cumsum(discounts)[np.minimum(np.minimum(num_held_out, k), len(discounts)) - 1]
+            dcg = np.sum(hits[:k] * discounts[:k], axis=0)
+            average_precision = np.sum(hits[:k] * cumulative_hits[:k] / ranks[:k], axis=0)
+
+            res.append((hits_k / divisor, ones))
+            res.append((random_hits_k / divisor, ones))
+            res.append((hits_k / divisor_held_out, has_held_out))
+            res.append((np.where(num_held_out > 0, dcg / ideal, 0), has_held_out))
+            res.append((average_precision / np.minimum(divisor_held_out, k), has_held_out))
+        return tuple(res)
+
+    def __call__(self, docs: tp.Union[csc_matrix, MaskedTestFixture]) -> dict:
+        """
+        Randomly mask the non-zero values in the docs and evaluate the prediction with all metrics
+        :param docs: 2-d array. each column vector is a mesh index vector
+        :return: dict of metric name -> value
+        """
+        res = dict(zip(self.metric_names, self.evaluate(docs)))
+        self._model.mse_test = res['mse'], res['mse_relevant']
+        fraction_of_masking = (docs.fraction_of_masking if isinstance(docs, MaskedTestFixture)
+                               else self._fraction_of_masking)
+        if fraction_of_masking == self._apk_fraction_of_masking:
+            self._model.apk_test = res[f'p@{self._apk_k}'], res[f'random_p@{self._apk_k}']
+        else:
+            if isinstance(docs, MaskedTestFixture):
+                docs = docs.masked_r + docs.held_out_r
+            AveragePrecisionKTester(self._model, self._apk_k, self._apk_fraction_of_masking,
+                                    block_size=self._block_size, seed=self._rng)(docs)
+        self._model.metrics_test = res
+        return res
@@ -0,0 +1,178 @@
+from base import *
+from abc import ABC, abstractmethod
+import math
+
+
+class Optimizer(ABC):
+    """
+    Turns the gradients of theta and b into the updates subtracted from them. The state buffers are allocated once by
+    initialize, and the updates are computed in place into preallocated buffers.
+    """
+
+    def __init__(self):
+        self._update_theta = None
+        self._update_b = None
+
+    def initialize(self, theta_shape: tp.Tuple, b_shape: tp.Tuple):
+        self._update_theta = np.zeros(theta_shape)
+        self._update_b = np.zeros(b_shape)
+        for name in self._state_names():
+            setattr(self, name, (np.zeros(theta_shape), np.zeros(b_shape)))
+
+    def __getstate__(self):
+        # the buffers are as large as theta, they are checkpointed instead of pickled with the model
+        state = self.__dict__.copy()
+        state.update({name: None for name in ('_update_theta', '_update_b') + self._state_names()})
+        return state
+
+    def _state_names(self) -> tp.Tuple:
+        return tuple()
+
+    def state(self) -> dict:
+        """
+        state buffers to be checkpointed
+        """
+        res = dict()
+        for name in self._state_names():
+            res[f"{name}_theta"], res[f"{name}_b"] = getattr(self, name)
+        return res
+
+    def load_state(self, state: dict):
+        for name in self._state_names():
+            theta_buffer, b_buffer = getattr(self, name)
+            theta_buffer[...] = state[f"{name}_theta"]
+            b_buffer[...] = state[f"{name}_b"]
+
+    def compute_update(self, grad_theta: np.ndarray, grad_b: np.ndarray,
+                       learning_rate: float) -> tp.Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the updates of theta and b. They are buffers owned by the optimizer, overwritten by the next call
+        """
+        self._compute_update(grad_theta, self._update_theta, learning_rate, 0)
+        self._compute_update(grad_b, self._update_b, learning_rate, 1)
+        return self._update_theta, self._update_b
+
+    @abstractmethod
+    def _compute_update(self, grad: np.ndarray, out: np.ndarray, learning_rate: float, param_index: int):
+        """
+        write the update of the parameter (0 for theta and 1 for b) into out
+        """
+        raise Exception("Not implemented yet.")
+
+
+class SGD(Optimizer):
+    def _compute_update(self, grad, out, learning_rate, param_index):
+        np.multiply(grad, learning_rate, out=out)
+
+
+class Momentum(Optimizer):
+    def __init__(self, momentum=0.9):
+        super(Momentum, self).__init__()
+        self._momentum = momentum
+        self._velocity = None
+
+    def _state_names(self):
+        return '_velocity',
+
+    def _compute_update(self, grad, out, learning_rate, param_index):
+        velocity = self._velocity[param_index]
+        velocity *= self._momentum
+        velocity += grad
+        np.multiply(velocity, learning_rate, out=out)
+
+
+class AdaGrad(Optimizer):
+    def __init__(self, epsilon=1e-8):
+        super(AdaGrad, self).__init__()
+        self._epsilon = epsilon
+        self._squared_sum = None
+
+    def _state_names(self):
+        return '_squared_sum',
+
+    def _compute_update(self, grad, out, learning_rate, param_index):
+        squared_sum = self._squared_sum[param_index]
+        np.square(grad, out=out)
+        squared_sum += out
+        np.sqrt(squared_sum, out=out)
+        out += self._epsilon
+        np.divide(grad, out, out=out)
+        out *= learning_rate
+
+
+class Adam(Optimizer):
+    def __init__(self, beta1=0.9, beta2=0.999, epsilon=1e-8):
+        super(Adam, self).__init__()
+        self._beta1 = beta1
+        self._beta2 = beta2
+        self._epsilon = epsilon
+        self._first_moment = None
+        self._second_moment = None
+        self._steps = None
+
+    def _state_names(self):
+        return '_first_moment', '_second_moment', '_steps'
+
+    def initialize(self, theta_shape, b_shape):
+        super(Adam, self).initialize(theta_shape, b_shape)
+        self._steps = (np.zeros(1), np.zeros(1))
+
+    def _compute_update(self, grad, out, learning_rate, param_index):
+        first_moment = self._first_moment[param_index]
+        second_moment = self._second_moment[param_index]
+        steps = self._steps[param_index]
+        steps += 1
+        # out is used as scratch space before holding the update
+        first_moment *= self._beta1
+        np.multiply(grad, 1 - self._beta1, out=out)
+        first_moment += out
+        second_moment *= self._beta2
+        np.square(grad, out=out)
+        out *= 1 - self._beta2
+        second_moment += out
+        # bias corrected moments
+        step_size = learning_rate * math.sqrt(1 - self._beta2 ** steps[0]) / (1 - self._beta1 ** steps[0])
+        np.sqrt(second_moment, out=out)
+        out += self._epsilon
+        np.divide(first_moment, out, out=out)
+        out *= step_size
+
+
+class LearningRateSchedule(ABC):
+    """
+    learning rate of an epoch given the initial learning rate alpha
+    """
+
+    @abstractmethod
+    def __call__(self, alpha: float, epoch: int) -> float:
+        raise Exception("Not implemented yet.")
+
+
+class ConstantSchedule(LearningRateSchedule):
+    def __call__(self, alpha, epoch):
+        return alpha
+
+
+class StepDecaySchedule(LearningRateSchedule):
+    def __init__(self, drop=0.5, epochs_per_drop=2):
+        self._drop = drop
+        self._epochs_per_drop = epochs_per_drop
+
+    def __call__(self, alpha, epoch):
+        return alpha * self._drop ** (epoch // self._epochs_per_drop)
+
+
+class ExponentialDecaySchedule(LearningRateSchedule):
+    def __init__(self, decay=0.9):
+        self._decay = decay
+
+    def __call__(self, alpha, epoch):
+        return alpha * self._decay ** epoch
+
+
+class InverseTimeDecaySchedule(LearningRateSchedule):
+    def __init__(self, decay=1.0):
+        self._decay = decay
+
+    def __call__(self, alpha, epoch):
+        return alpha / (1 + self._decay * epoch)
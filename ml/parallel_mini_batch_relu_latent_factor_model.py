@@ -0,0 +1,205 @@
+from base import *
+from base.shared_array import SharedArray, SharedCscMatrix
+from scipy.sparse import csc_matrix
+from ml.mini_batch_relu_latent_factor_model import MiniBatchReLuLatentFactorModel
+from ml.optimizer import SGD
+import multiprocessing
+import math
+import threading
+
+# commands sent from the main process to the workers through the shared command array
+_STOP = 0
+_SYNC_STEP = 1
+_ASYNC_EPOCH = 2
+
+
+def _worker(worker_index: int, num_workers: int, barrier, descriptors: dict):
+    """
+    Worker loop of ParallelMiniBatchReLuLatentFactorModel. Every round starts and ends at the barrier; between them
+    the worker executes the command written by the main process.
+    """
+    R = None
+    arrays = {}
+    try:
+        R = SharedCscMatrix.attach(descriptors['train_r'])
+        arrays = {key: SharedArray.attach(descriptors[key]) for key in ('command', 'W', 'theta', 'b', 'W_theta',
+                                                                         'grad_theta', 'grad_b', 'grad_size')}
+        command, W, theta, b = (arrays[key].array for key in ('command', 'W', 'theta', 'b'))
+        train_r: csc_matrix = R.matrix
+        n = train_r.shape[1]
+        while True:
+            barrier.wait()
+            cmd, step, batch_size, learning_rate, lambda_ = command
+            if cmd == _STOP:
+                break
+            elif cmd == _SYNC_STEP:
+                # the global batch of this step is split evenly over the workers
+                sub_batch_size = math.ceil(batch_size / num_workers)
+                start = min(int(step * batch_size + worker_index * sub_batch_size), n)
+                end = min(start + sub_batch_size, int((step + 1) * batch_size), n)
+                B = train_r[:, start:end].toarray()
+                B_hat = arrays['W_theta'].array.dot(B) + b
+                B_hat_B = (B_hat - B)
+                B_hat_B[B_hat < 0] = 0  # multiply ReLu'(r_hat)
+                arrays['grad_theta'].array[worker_index] = B_hat_B.dot(B.transpose())
+                arrays['grad_b'].array[worker_index] = np.sum(B_hat_B, axis=1, keepdims=True)
+                arrays['grad_size'].array[worker_index] = B.shape[1]
+            elif cmd == _ASYNC_EPOCH:
+                # every worker owns a contiguous column shard and updates the shared theta and b without locking
+                shard_size = math.ceil(n / num_workers)
+                shard_start = min(worker_index * shard_size, n)
+                shard_end = min(shard_start + shard_size, n)
+                batch_size = int(batch_size)
+                for start in range(shard_start, shard_end, batch_size):
+                    B = train_r[:, start:min(start + batch_size, shard_end)].toarray()
+                    bsize = B.shape[1]
+                    B_hat = (W * theta).dot(B) + b
+                    B_hat_B = (B_hat - B)
+                    B_hat_B[B_hat < 0] = 0  # multiply ReLu'(r_hat)
+                    theta -= learning_rate * W / bsize * (B_hat_B.dot(B.transpose())) + lambda_ * theta
+                    b -= learning_rate / bsize * (np.sum(B_hat_B, axis=1, keepdims=True))
+            barrier.wait()
+    except threading.BrokenBarrierError:
+        pass  # another process failed or gave up, and aborted the barrier
+    except BaseException:
+        # let the main process and the other workers fail instead of waiting for this worker at the barrier forever
+        barrier.abort()
+        raise
+    finally:
+        if R is not None:
+            R.close()
+        for arr in arrays.values():
+            arr.close()
+
+
+class ParallelMiniBatchReLuLatentFactorModel(MiniBatchReLuLatentFactorModel):
+    """
+    Data parallel version of MiniBatchReLuLatentFactorModel. The training matrix, W, theta and b are held once in
+    shared memory and worker processes compute the gradients of the mini-batches:
+        synchronous: every mini-batch is split over the workers, the main process averages their gradients and
+            updates theta and b, which gives the same updates as the single process training.
+        asynchronous: every worker runs mini-batch gradient descent on its own column shard and updates the shared
+            theta and b without locking (Hogwild!).
+    For the best speed up, limit the BLAS threads of every process, e.g. by OMP_NUM_THREADS=1.
+    """
+
+    def __init__(self, tau=-2, k=2, alpha=0.01, lambda_=0.0001, batch_size=10000, max_epoch=1000,
+                 num_workers: int = None, synchronous=True, command_timeout: float = 3600, **kwargs):
+        """
+
+        :param command_timeout: seconds the main process waits for the workers to execute a command, e.g. an
+         asynchronous epoch. A worker killed while executing a command, e.g. out of memory, can not abort the
+         barrier, the training fails after the timeout instead of blocking forever
+        """
+        super(ParallelMiniBatchReLuLatentFactorModel, self).__init__(tau, k, alpha, lambda_, batch_size, max_epoch,
+                                                                     **kwargs)
+        self._num_workers = multiprocessing.cpu_count() if num_workers is None else num_workers
+        self._synchronous = synchronous
+        self._command_timeout = command_timeout
+        if not synchronous and type(self._optimizer) is not SGD:
+            raise Exception("Asynchronous training only supports the SGD optimizer.")
+        self._shared = None
+        self._workers = None
+        self._barrier = None
+
+    def __getstate__(self):
+        # the worker processes and shared memory are only alive during training
+        state = super(ParallelMiniBatchReLuLatentFactorModel, self).__getstate__()
+        state.update(_shared=None, _workers=None, _barrier=None)
+        return state
+
+    def _start_workers(self, train_r: csc_matrix, W: np.ndarray):
+        m = train_r.shape[0]
+        self._shared = {
+            'train_r': SharedCscMatrix.copy_of(train_r),
+            'command': SharedArray((5,), 'f8'),
+            'W': SharedArray.copy_of(W),
+            'theta': SharedArray((m, m), 'f8'),
+            'b': SharedArray((m, 1), 'f8'),
+            'W_theta': SharedArray((m, m), 'f8'),
+            'grad_theta': SharedArray((self._num_workers, m, m), 'f8'),
+            'grad_b': SharedArray((self._num_workers, m, 1), 'f8'),
+            'grad_size': SharedArray((self._num_workers,), 'f8'),
+        }
+        descriptors = {key: value.descriptor for key, value in self._shared.items()}
+        self._barrier = multiprocessing.Barrier(self._num_workers + 1)
+        self._workers = [multiprocessing.Process(target=_worker, daemon=True,
+                                                 args=(i, self._num_workers, self._barrier, descriptors))
+                         for i in range(self._num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _stop_workers(self):
+        if self._workers is not None:
+            if not self._barrier.broken and all(worker.is_alive() for worker in self._workers):
+                self._run_command(_STOP)
+            for worker in self._workers:
+                worker.join(timeout=1)
+                if worker.is_alive():
+                    worker.terminate()
+        if self._shared is not None:
+            for value in self._shared.values():
+                value.close()
+        self._shared = None
+        self._workers = None
+        self._barrier = None
+
+    def _run_command(self, cmd: int, step=0, learning_rate=0.0):
+        """
+        Let the workers execute the command and wait until all of them have finished
+        """
+        self._shared['command'].array[:] = (cmd, step, self._batch_size, learning_rate, self._lambda)
+        try:
+            self._barrier.wait(self._command_timeout)
+            if cmd != _STOP:
+                self._barrier.wait(self._command_timeout)
+        except threading.BrokenBarrierError:
+            raise Exception(f"A worker of the parallel training failed, see its error above, or did not finish the "
+                            f"command within {self._command_timeout} seconds.")
+
+    def _train_epoch(self, epoch: int, train_r: csc_matrix, W: np.ndarray, theta: np.ndarray,
+                     b: np.ndarray) -> tp.Tuple[np.ndarray, np.ndarray]:
+        if not isinstance(train_r, csc_matrix):
+            raise Exception("The parallel training shares the training matrix in memory, it can not stream it.")
+        if self._workers is None:
+            self._start_workers(train_r, W)
+        shared_theta = self._shared['theta'].array
+        shared_b = self._shared['b'].array
+        shared_theta[...] = theta
+        shared_b[...] = b
+
+        if not self._synchronous:
+            print(f"Epoch {epoch + 1}: asynchronous training with {self._num_workers} workers")
+            self._run_command(_ASYNC_EPOCH, learning_rate=self._learning_rate_schedule(self._alpha, epoch))
+            return shared_theta.copy(), shared_b.copy()
+
+        W_theta = self._shared['W_theta'].array
+        grad_theta = self._shared['grad_theta'].array
+        grad_b = self._shared['grad_b'].array
+        grad_size = self._shared['grad_size'].array
+        learning_rate = self._learning_rate_schedule(self._alpha, epoch)
+        pbar = tqdm(range(math.ceil(train_r.shape[1] / self._batch_size)))
+        for batch_index in pbar:
+            np.multiply(W, theta, out=W_theta)
+            shared_b[...] = b
+            self._run_command(_SYNC_STEP, batch_index)
+            bsize = np.sum(grad_size)
+
+            grad_theta_sum = W / bsize * np.sum(grad_theta, axis=0)
+            grad_b_sum = np.sum(grad_b, axis=0) / bsize
+            theta, b, delta_eps = self._update(theta, b, grad_theta_sum, grad_b_sum, learning_rate)
+            pbar.set_description(f"Epoch {epoch + 1} batch {batch_index + 1} delta={delta_eps:.8E}")
+        pbar.close()
+        return theta, b
+
+    def train(self, *args, **kwargs):
+        try:
+            super(ParallelMiniBatchReLuLatentFactorModel, self).train(*args, **kwargs)
+        finally:
+            self._stop_workers()
+
+    def partial_fit(self, *args, **kwargs):
+        try:
+            super(ParallelMiniBatchReLuLatentFactorModel, self).partial_fit(*args, **kwargs)
+        finally:
+            self._stop_workers()
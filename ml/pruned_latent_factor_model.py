@@ -0,0 +1,53 @@
+from base import *
+from scipy.sparse import csr_matrix
+from ml.recommend_mixin import RecommendMixin
+
+
+class PrunedLatentFactorModel(RecommendMixin):
+    """
+    A trained latent factor model with the small weights of W_theta dropped, kept as a csr matrix. The prediction of
+    sparse documents is a sparse x sparse product, whose cost scales with the few non-zero mesh terms of a document.
+    """
+
+    def __init__(self, W_theta: csr_matrix, b: np.ndarray):
+        self._W_theta = W_theta
+        self._W_theta_t = W_theta.transpose().tocsr()
+        self._b = b.reshape(-1, 1)
+        self.mse_test = None
+        self.apk_test = None
+        self.metrics_test = None
+
+    @classmethod
+    def prune(cls, model: RecommendMixin, top_n: int = None, threshold: float = None,
+              dtype='f4') -> 'PrunedLatentFactorModel':
+        """
+        :param model: a trained model having the dense _W_theta and _b
+        :param top_n: keep the top_n weights of largest magnitude of every row
+        :param threshold: keep the weights whose magnitude is at least threshold. With top_n, both must hold
+        """
+        W_theta = np.asarray(model._W_theta, dtype=dtype)
+        keep = np.ones(W_theta.shape, dtype=bool)
+        if top_n is not None and top_n < W_theta.shape[1]:
+            top = np.argpartition(-np.abs(W_theta), top_n - 1, axis=1)[:, :top_n]
+            keep[:] = False
+            np.put_along_axis(keep, top, True, axis=1)
+        if threshold is not None:
+            keep &= np.abs(W_theta) >= threshold
+        res = csr_matrix(np.where(keep, W_theta, 0))
+        res.eliminate_zeros()
+        return cls(res, np.asarray(model._b, dtype=dtype))
+
+    @property
+    def nbytes(self) -> int:
+        """
+        size of the parameters
+        """
+        return self._W_theta.data.nbytes + self._W_theta.indices.nbytes + self._W_theta.indptr.nbytes + self._b.nbytes
+
+    def _score_block(self, block: csr_matrix) -> np.ndarray:
+        return block.dot(self._W_theta_t).toarray() + self._b.reshape(1, -1)
+
+    def predict(self, r: np.ndarray):
+        res = np.asarray(self._W_theta.dot(r)) + self._b
+        res[res < 0] = 0  # ReLu
+        return res
@@ -0,0 +1,103 @@
+from base import *
+from scipy.sparse import csr_matrix
+from ml.recommend_mixin import RecommendMixin
+
+
+class QuantizedLatentFactorModel(RecommendMixin):
+    """
+    A trained latent factor model with W_theta quantized to int8 with a float32 scale per row, and a float32 b.
+    The documents are quantized to int8 with a scale per document, so W_theta * r is an integer matrix product followed
+    by dequantization with the two scales, before adding b and ReLu.
+    """
+    MAX_INT8 = 127
+
+    def __init__(self, W_theta: np.ndarray, W_theta_scale: np.ndarray, b: np.ndarray, row_block_size=1024):
+        """
+
+        :param W_theta: mxm int8
+        :param W_theta_scale: the scales of the rows of W_theta
+        :param row_block_size: number of rows of W_theta multiplied together
+        """
+        self._W_theta = W_theta
+        self._W_theta_scale = W_theta_scale.reshape(-1, 1).astype('f4')
+        self._b = b.reshape(-1, 1).astype('f4')
+        self._row_block_size = row_block_size
+        self.mse_test = None
+        self.apk_test = None
+        self.metrics_test = None
+
+    @classmethod
+    def quantize(cls, model: RecommendMixin, **kwargs) -> 'QuantizedLatentFactorModel':
+        """
+        :param model: a trained model having the dense _W_theta and _b
+        """
+        W_theta, W_theta_scale = cls._quantize(np.asarray(model._W_theta), axis=1)
+        return cls(W_theta, W_theta_scale, np.asarray(model._b), **kwargs)
+
+    @classmethod
+    def _quantize(cls, x: np.ndarray, axis: int) -> tp.Tuple[np.ndarray, np.ndarray]:
+        """
+        Symmetric quantization to int8, with a scale per slice along the axis
+        :return: the int8 array and the scales, keeping the dims
+        """
+        scale = np.max(np.abs(x), axis=axis, keepdims=True) / cls.MAX_INT8
+        scale[scale == 0] = 1  # handel 0 vector
+        return np.rint(x / scale).astype(np.int8), scale.astype('f4')
+
+    @classmethod
+    def _accumulator_dtype(cls, num_terms: int) -> np.dtype:
+        """
+        The integer products are computed exactly by the float BLAS, in float32 while no sum of num_terms products of
+        int8 can exceed 2^24
+        """
+        return np.dtype('f4' if num_terms * cls.MAX_INT8 ** 2 < 2 ** 24 else 'f8')
+
+    @property
+    def nbytes(self) -> int:
+        """
+        size of the parameters
+        """
+        return self._W_theta.nbytes + self._W_theta_scale.nbytes + self._b.nbytes
+
+    def _linear(self, r: np.ndarray) -> np.ndarray:
+        """
+        :return: the dequantized W_theta * r + b, before ReLu
+        """
+        r_q, r_scale = self._quantize(r, axis=0)
+        dtype = self._accumulator_dtype(r.shape[0])
+        r_q = r_q.astype(dtype)
+        res = np.empty((self._W_theta.shape[0], r.shape[1]), dtype='f4')
+        for start in range(0, self._W_theta.shape[0], self._row_block_size):
+            end = start + self._row_block_size
+            res[start:end] = self._W_theta[start:end].astype(dtype).dot(r_q)
+        res *= self._W_theta_scale
+        res *= r_scale
+        res += self._b
+        return res
+
+    def _score_block(self, block: csr_matrix) -> np.ndarray:
+        """
+        The documents stay sparse, each quantized with the scale of its largest value
+        """
+        nnz_per_row = np.diff(block.indptr)
+        non_empty = nnz_per_row > 0
+        scale = np.ones(block.shape[0], dtype='f4')
+        if block.nnz:
+            scale[non_empty] = np.maximum.reduceat(np.abs(block.data), block.indptr[:-1][non_empty]) / self.MAX_INT8
+        scale[scale == 0] = 1  # handel 0 vector
+        dtype = self._accumulator_dtype(np.max(nnz_per_row, initial=0))
+        block_q = csr_matrix((np.rint(block.data / np.repeat(scale, nnz_per_row)).astype(dtype), block.indices,
+                              block.indptr), shape=block.shape)
+        res = np.empty((block.shape[0], self._W_theta.shape[0]), dtype='f4')
+        for start in range(0, self._W_theta.shape[0], self._row_block_size):
+            end = start + self._row_block_size
+            res[:, start:end] = block_q.dot(self._W_theta[start:end].T.astype(dtype))
+        res *= self._W_theta_scale.reshape(1, -1)
+        res *= scale.reshape(-1, 1)
+        res += self._b.reshape(1, -1)
+        return res
+
+    def predict(self, r: np.ndarray):
+        res = self._linear(np.asarray(r).reshape(self._W_theta.shape[1], -1))
+        res[res < 0] = 0  # ReLu
+        return res
@@ -0,0 +1,46 @@
+from base import *
+from scipy.sparse import csc_matrix, csr_matrix
+
+
+class RecommendMixin(object):
+    """
+    Top k mesh term recommendation for the models predicting max(W_theta * r + b, 0), having _W_theta and _b
+    """
+
+    def _score_block(self, block: csr_matrix) -> np.ndarray:
+        """
+        :param block: documents x mesh terms
+        :return: dense documents x mesh terms scores W_theta * r + b, before ReLu
+        """
+        return np.asarray(block.dot(self._W_theta.T)) + self._b.reshape(1, -1)
+
+    def recommend(self, docs: tp.Union[csc_matrix, np.ndarray], k=10, exclude_present=True,
+                  block_size=10000) -> tp.Tuple[np.ndarray, np.ndarray]:
+        """
+        Score the documents with one matrix product per block, and pick the top k of every document by argpartition
+        :param docs: mxn matrix, each column is a mesh index vector, or a single vector of length m
+        :param k: number of recommendations of every document
+        :param exclude_present: the mesh terms already in a document are not recommended to it
+        :param block_size: number of documents scored together
+        :return: nxk mesh indices and nxk scores, in descending order of scores. Excluded terms, only picked when a
+         document has less than k candidates, have the score -inf
+        """
+        docs = csc_matrix(docs.reshape(-1, 1) if isinstance(docs, np.ndarray) and docs.ndim == 1 else docs)
+        m, n = docs.shape
+        k = min(k, m)
+        indices = np.empty((n, k), dtype=int)
+        scores = np.empty((n, k), dtype=np.result_type(self._W_theta.dtype, self._b.dtype, np.float32))
+        for start in range(0, n, block_size):
+            block = docs[:, start:start + block_size].transpose().tocsr()  # documents x mesh terms
+            block_scores = self._score_block(block)
+            np.maximum(block_scores, 0, out=block_scores)  # ReLu
+            if exclude_present:
+                rows = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+                present = block.data != 0
+                block_scores[rows[present], block.indices[present]] = -np.inf
+            top = np.argpartition(-block_scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(block_scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            indices[start:start + block.shape[0]] = np.take_along_axis(top, order, axis=1)
+            scores[start:start + block.shape[0]] = np.take_along_axis(top_scores, order, axis=1)
+        return indices, scores
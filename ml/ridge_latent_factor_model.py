@@ -0,0 +1,62 @@
+from base import *
+from scipy.sparse import csc_matrix
+from scipy.sparse.linalg import LinearOperator, cg
+from scipy.linalg import cho_factor, cho_solve
+from ml.mini_batch_relu_latent_factor_model import MiniBatchReLuLatentFactorModel
+from ml.streaming_batch_source import StreamingBatchSource
+
+
+class RidgeLatentFactorModel(MiniBatchReLuLatentFactorModel):
+    """
+    Solve theta and b of the latent factor model in closed form. Without the ReLu, the training objective
+        1/(2n) * ||(W.*theta)R + b - R||^2 + lambda/(2*alpha) * ||theta||^2
+    is a ridge regression for every row i of theta:
+        (D_i C D_i + lambda/alpha * I) theta_i = D_i C[:, i],     b_i = mean_i - (w_i.*theta_i) mean
+    where D_i = diag(W[i]), mean is the mean document and C = R*R^T/n - mean*mean^T is the covariance, so one pass over
+    the data (for the gram matrix R*R^T) is enough. lambda/alpha is the penalty of the weight decay used by the mini
+    batch gradient descent. The solution can be refined by max_epoch ReLu aware mini batch gradient descent epochs.
+    """
+
+    def __init__(self, tau=-2, k=2, alpha=0.01, lambda_=0.0001, batch_size=10000, max_epoch=0, solver='cholesky',
+                 cg_tol=1e-6, **kwargs):
+        """
+
+        :param max_epoch: number of mini batch gradient descent epochs refining the closed form solution
+        :param solver: 'cholesky' factorizes the mxm system of every row, 'cg' solves it with conjugate gradient
+         without forming the system, which is preferred for large m
+        :param cg_tol: relative tolerance of the conjugate gradient solver
+        """
+        super(RidgeLatentFactorModel, self).__init__(tau, k, alpha, lambda_, batch_size, max_epoch, **kwargs)
+        if solver not in ('cholesky', 'cg'):
+            raise Exception(f"Unknown solver {solver}.")
+        self._solver = solver
+        self._cg_tol = cg_tol
+
+    def _initial_parameters(self, train_r: tp.Union[csc_matrix, StreamingBatchSource], gram: np.ndarray,
+                            W: np.ndarray) -> tp.Tuple[np.ndarray, np.ndarray]:
+        m, n = train_r.shape
+        if isinstance(train_r, StreamingBatchSource):
+            # accumulated over the batches, as the gram matrix
+            mean = np.zeros(m)
+            for B in train_r.batches(self._batch_size):
+                mean += np.asarray(B.sum(axis=1)).ravel()
+            mean /= n
+        else:
+            mean = np.asarray(train_r.mean(axis=1)).ravel()
+        C = gram / n - np.outer(mean, mean)
+        penalty = self._lambda / self._alpha
+        theta = np.zeros((m, m))
+        for i in tqdm(range(m), desc=f"Solving theta ({self._solver})"):
+            w = W[i]
+            rhs = w * C[:, i]
+            if self._solver == 'cholesky':
+                A = w.reshape(-1, 1) * C * w.reshape(1, -1)
+                A[np.diag_indices(m)] += penalty
+                theta[i] = cho_solve(cho_factor(A), rhs)
+            else:
+                A = LinearOperator((m, m), matvec=lambda x: w * C.dot(w * x.ravel()) + penalty * x.ravel())
+                theta[i], info = cg(A, rhs, rtol=self._cg_tol)
+                if info > 0:
+                    print(f"Conjugate gradient did not converge for row {i} in {info} iterations.")
+        b = (mean - np.sum(W * theta * mean.reshape(1, -1), axis=1)).reshape(-1, 1)
+        return theta, b
@@ -0,0 +1,127 @@
+from base import *
+from scipy.sparse import csc_matrix
+from ml.abstract_tester import AbstractTester
+
+
+class SampledEvaluator(object):
+    """
+    Estimate the metrics of a tester from a sample of the documents, stratified by the number of non-zero mesh terms,
+    with bootstrap confidence intervals. The sample can be grown until the intervals are narrow enough.
+    """
+
+    def __init__(self, tester: AbstractTester, sample_size=1000, num_strata=5, num_bootstrap=1000, confidence=0.95,
+                 seed=None):
+        """
+
+        :param tester: computes the per document metrics of the sampled documents
+        :param sample_size: the initial number of sampled documents
+        :param num_strata: the documents are split into strata by the quantiles of their number of non-zero terms
+        :param num_bootstrap: number of bootstrap resamples of the confidence intervals
+        :param confidence: confidence level of the intervals
+        """
+        self._tester = tester
+        self._sample_size = sample_size
+        self._num_strata = num_strata
+        self._num_bootstrap = num_bootstrap
+        self._confidence = confidence
+        self._rng = np.random.default_rng(seed)
+
+    def _stratify(self, nnz: np.ndarray) -> np.ndarray:
+        """
+        :return: the stratum of every document
+        """
+        edges = np.unique(np.quantile(nnz, np.linspace(0, 1, self._num_strata + 1)[1:-1]))
+        return np.searchsorted(edges, nnz, side='right')
+
+    def _draw(self, remaining: tp.List[np.ndarray], strata_sizes: np.ndarray, size: int) -> tp.List[np.ndarray]:
+        """
+        Draw about size more documents, allocated to the strata in proportion to their sizes
+        :param remaining: shuffled documents not sampled yet of every stratum, consumed from the front
+        :return: the drawn documents of every stratum
+        """
+        allocation = np.ceil(size * strata_sizes / np.sum(strata_sizes)).astype(int)
+        res = []
+        for h in range(len(remaining)):
+            res.append(remaining[h][:allocation[h]])
+            remaining[h] = remaining[h][allocation[h]:]
+        return res
+
+    def _per_document_metrics(self, docs: csc_matrix) -> tp.Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: numerators and denominators (documents x metrics) of the documents, which must have non zero values
+        """
+        nums, dens = [], []
+        for r, masked_r, held_out in self._tester.iterate_blocks(docs):
+            metrics = self._tester.test_block(r, masked_r, held_out)
+            nums.append(np.stack([num for num, _ in metrics], axis=1))
+            dens.append(np.stack([den for _, den in metrics], axis=1))
+        return np.concatenate(nums), np.concatenate(dens)
+
+    def _estimate(self, nums: tp.List[np.ndarray], dens: tp.List[np.ndarray],
+                  strata_sizes: np.ndarray) -> tp.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Stratified ratio estimate of the metrics and the stratified bootstrap confidence intervals
+        """
+        num_total = np.zeros(nums[0].shape[1])
+        den_total = np.zeros(nums[0].shape[1])
+        num_boot = np.zeros((self._num_bootstrap, nums[0].shape[1]))
+        den_boot = np.zeros((self._num_bootstrap, nums[0].shape[1]))
+        for num, den, size in zip(nums, dens, strata_sizes):
+            n = len(num)
+            if n == 0:
+                continue
+            weight = size / n
+            num_total += weight * np.sum(num, axis=0)
+            den_total += weight * np.sum(den, axis=0)
+            # resampling with replacement, as the multiplicity of every document
+            counts = self._rng.multinomial(n, np.full(n, 1 / n), size=self._num_bootstrap)
+            num_boot += weight * counts.dot(num)
+            den_boot += weight * counts.dot(den)
+        tail = (1 - self._confidence) / 2 * 100
+        with np.errstate(invalid='ignore', divide='ignore'):
+            low, high = np.nanpercentile(num_boot / den_boot, [tail, 100 - tail], axis=0)
+        return num_total / den_total, low, high
+
+    def __call__(self, docs: csc_matrix, target_width: float = None, target_metrics: tp.Iterable = None,
+                 max_sample_size: int = None) -> dict:
+        """
+        :param docs: the documents to be evaluated
+        :param target_width: if given, the sample is doubled until the confidence intervals of the target metrics are
+         not wider than it
+        :param target_metrics: names of the metrics whose intervals must be narrow enough, all metrics by default
+        :param max_sample_size: the sample stops growing at this size
+        :return: dict of metric name -> (estimate, lower bound, upper bound), and 'sample_size'
+        """
+        docs = csc_matrix(docs)
+        docs.eliminate_zeros()
+        nnz = np.diff(docs.indptr)
+        non_empty = np.flatnonzero(nnz > 0)
+        strata = self._stratify(nnz[non_empty])
+        num_strata = np.max(strata) + 1
+        strata_sizes = np.bincount(strata, minlength=num_strata)
+        remaining = [self._rng.permutation(non_empty[strata == h]) for h in range(num_strata)]
+        max_sample_size = len(non_empty) if max_sample_size is None else min(max_sample_size, len(non_empty))
+
+        names = self._tester.metric_names
+        target = [names.index(name) for name in (names if target_metrics is None else target_metrics)]
+        nums = [np.zeros((0, len(names))) for _ in range(num_strata)]
+        dens = [np.zeros((0, len(names))) for _ in range(num_strata)]
+        sample_size, size = 0, self._sample_size
+        while True:
+            drawn = self._draw(remaining, strata_sizes, min(size, max_sample_size - sample_size))
+            for h, chosen in enumerate(drawn):
+                if len(chosen):
+                    num, den = self._per_document_metrics(docs[:, np.sort(chosen)])
+                    nums[h] = np.concatenate([nums[h], num])
+                    dens[h] = np.concatenate([dens[h], den])
+            sample_size = sum(len(num) for num in nums)
+            estimate, low, high = self._estimate(nums, dens, strata_sizes)
+            width = np.max((high - low)[target])
+            print(f"{sample_size} sampled documents, widest confidence interval {width:.6f}")
+            if target_width is None or width <= target_width or sample_size >= max_sample_size:
+                break
+            size = sample_size  # double the sample
+
+        res = {name: (estimate[i], low[i], high[i]) for i, name in enumerate(names)}
+        res['sample_size'] = sample_size
+        return res
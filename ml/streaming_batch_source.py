@@ -0,0 +1,133 @@
+from base import *
+from scipy.sparse import csc_matrix, hstack
+from ml.data_set_splitter import DataSetSplitter, DATA_SET_INDICATOR
+import shutil
+
+
+class StreamingBatchSource(object):
+    """
+    The documents of one split of a split data set, stored document major (the indptr, indices and data of a csc
+    matrix) in memory mapped files, so column batches are read from the disk instead of held in memory. It is built
+    from the row major data set file once, in two passes, and reused afterwards.
+    MiniBatchReLuLatentFactorModel.train accepts it in place of the training matrix.
+    """
+    __FILE_EXTENSION__ = ".sbs"  # streaming batch source, a directory of .npy files
+
+    SPLIT_NAMES = {DATA_SET_INDICATOR.TRAIN: 'train', DATA_SET_INDICATOR.VALIDATE: 'validate',
+                   DATA_SET_INDICATOR.TEST: 'test'}
+
+    def __init__(self, directory: str, shuffle=False, seed: int = None):
+        """
+
+        :param directory: written by from_data_set
+        :param shuffle: read the batches in a random order of the blocks of batch_size documents, else sequentially.
+         A block is read contiguously either way
+        :param seed: the order of every epoch is seeded by (seed, epoch), random if None
+        """
+        self._directory = directory
+        self._shuffle = shuffle
+        self._seed = seed
+        self._indptr = np.load(os.path.join(directory, 'indptr.npy'), mmap_mode='r')
+        self._indices = np.load(os.path.join(directory, 'indices.npy'), mmap_mode='r')
+        self._data = np.load(os.path.join(directory, 'data.npy'), mmap_mode='r')
+        self._num_mesh = int(np.load(os.path.join(directory, 'num_mesh.npy')))
+
+    @property
+    def shape(self) -> tp.Tuple[int, int]:
+        return self._num_mesh, len(self._indptr) - 1
+
+    @property
+    def nnz(self) -> int:
+        return int(self._indptr[-1])
+
+    @classmethod
+    def source_path(cls, sds_file_path: str, data_set_indicator: int) -> str:
+        return f"{os.path.splitext(sds_file_path)[0]}.{cls.SPLIT_NAMES[data_set_indicator]}{cls.__FILE_EXTENSION__}"
+
+    @classmethod
+    def from_data_set(cls, sds_file_path: str, data_set_indicator: int = DATA_SET_INDICATOR.TRAIN,
+                      directory: str = None, **kwargs) -> 'StreamingBatchSource':
+        """
+        Transpose the chosen documents of the data set file into the memory mapped files, unless they exist for the
+        same data set file. The first pass counts the non zeros of every document, the second one fills them in; the
+        memory used is proportional to the number of documents and one row, not to the non zeros.
+        :param directory: source_path of the data set file by default
+        :param kwargs: see __init__
+        """
+        directory = cls.source_path(sds_file_path, data_set_indicator) if directory is None else directory
+        source_identity = DataSetSplitter.file_identity(sds_file_path)
+        identity_path = os.path.join(directory, 'source_identity.npy')
+        if os.path.exists(directory):
+            if os.path.exists(identity_path) and np.array_equal(np.load(identity_path), source_identity):
+                return cls(directory, **kwargs)
+            print(f"{sds_file_path} changed, rebuilding {directory}")
+            shutil.rmtree(directory)
+
+        with open(sds_file_path, 'rb') as reader:
+            mesh_index_map, split_choice_map, compression = DataSetSplitter.read_header(reader)
+        num_mesh = len(mesh_index_map)
+        chosen_docs = split_choice_map == data_set_indicator
+
+        def rows():
+            with open(sds_file_path, 'rb') as reader:
+                DataSetSplitter.read_header(reader)
+                for i in tqdm(range(num_mesh)):
+                    row = DataSetSplitter.SparseMatrixCompressor.decompress(reader, compression)[chosen_docs]
+                    doc_indices = np.flatnonzero(row)
+                    yield i, doc_indices, row[doc_indices]
+
+        counts = np.zeros(np.sum(chosen_docs), dtype='i8')
+        for _, doc_indices, _ in rows():
+            counts[doc_indices] += 1
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+
+        # write to a temporary directory first, so an interrupted build is not taken for a complete one
+        tmp_directory = f"{directory}.tmp"
+        os.makedirs(tmp_directory, exist_ok=True)
+        nnz = int(indptr[-1])
+        indices = np.lib.format.open_memmap(os.path.join(tmp_directory, 'indices.npy'), 'w+', 'i4', (nnz,))
+        data = np.lib.format.open_memmap(os.path.join(tmp_directory, 'data.npy'), 'w+', 'f4', (nnz,))
+        fill = indptr[:-1].copy()  # the next position of every document
+        for i, doc_indices, values in rows():
+            # rows come in increasing order, so the indices of every document are sorted
+            indices[fill[doc_indices]] = i
+            data[fill[doc_indices]] = values
+            fill[doc_indices] += 1
+        indices.flush()
+        data.flush()
+        del indices, data
+        np.save(os.path.join(tmp_directory, 'indptr.npy'), indptr)
+        np.save(os.path.join(tmp_directory, 'num_mesh.npy'), np.int64(num_mesh))
+        np.save(os.path.join(tmp_directory, 'source_identity.npy'), source_identity)
+        if os.path.exists(directory):
+            shutil.rmtree(tmp_directory)
+        else:
+            os.replace(tmp_directory, directory)
+        return cls(directory, **kwargs)
+
+    def _columns(self, start: int, end: int) -> csc_matrix:
+        indptr = np.array(self._indptr[start:end + 1])
+        return csc_matrix((np.array(self._data[indptr[0]:indptr[-1]]), np.array(self._indices[indptr[0]:indptr[-1]]),
+                           indptr - indptr[0]), shape=(self._num_mesh, end - start))
+
+    def columns(self, docs: np.ndarray) -> csc_matrix:
+        """
+        the chosen documents, e.g. a sample of them
+        """
+        if len(docs) == 0:
+            return csc_matrix((self._num_mesh, 0), dtype='f4')
+        return hstack([self._columns(doc, doc + 1) for doc in docs], format='csc')
+
+    def batches(self, batch_size: int, epoch=0) -> tp.Iterator[csc_matrix]:
+        """
+        the column batches of one epoch, every one of at most batch_size documents
+        """
+        n = self.shape[1]
+        starts = np.arange(0, n, batch_size)
+        if self._shuffle:
+            starts = np.random.default_rng(None if self._seed is None else (self._seed, epoch)).permutation(starts)
+        for start in starts:
+            yield self._columns(int(start), min(int(start) + batch_size, n))
+
+    def to_csc(self) -> csc_matrix:
+        return self._columns(0, self.shape[1])
@@ -0,0 +1,157 @@
+from base import *
+from concurrent.futures import ProcessPoolExecutor
+from ml.experiment_registry import ExperimentRegistry
+from ml.hyperparameter_search import HyperparameterSearch, ResultsFile, _worker_data
+from ml.multi_metric_evaluator import MultiMetricEvaluator
+from ml.sampled_evaluator import SampledEvaluator
+import itertools
+import math
+import pickle
+import shutil
+import tempfile
+import time
+
+
+def _train_budget(model_class: type, params: dict, model_kwargs: dict, output_directory: str,
+                  checkpoint_directory: str, epochs: int, metric: str, sample_size: int, seed: int,
+                  registry_file_path: tp.Optional[str], sds_file_path: str) -> dict:
+    """
+    Train one candidate up to the epochs in a worker process, warm started from its checkpoint of the lower budget,
+    and estimate its validation metric on a sample of the validation documents. The model is saved and logged to the
+    registry if registry_file_path is given
+    :param checkpoint_directory: the checkpoints of one successive halving run only
+    :param sds_file_path: the data set of the shared data, recorded in the registry
+    """
+    start_time = time.time()
+    save_name = f"model{'_'.join(map(str, params.values()))}"
+    checkpoint_path = os.path.join(checkpoint_directory, f'{save_name}.ckpt.npz')
+    epochs_before = 0
+    if os.path.exists(checkpoint_path):
+        with np.load(checkpoint_path) as checkpoint:
+            epochs_before = int(checkpoint['epoch'])
+    assert epochs_before <= epochs, f"The checkpoint of {save_name} is trained for {epochs_before} > {epochs} epochs."
+    model = model_class(**params, max_epoch=epochs, checkpoint_path=checkpoint_path, checkpoint_interval=1,
+                        **model_kwargs)
+    # the checkpoint keeps the epoch, theta, b and the optimizer state, so the continued training is the same as an
+    # uninterrupted one
+    model.train(_worker_data['train_r'].matrix, resume_from=checkpoint_path if epochs_before else None,
+                gram=_worker_data['gram'].array, cosine_similarity=_worker_data['cosine_similarity'].array)
+
+    # the same seed samples the same documents and masks for every candidate
+    estimates = SampledEvaluator(MultiMetricEvaluator(model, seed=seed), sample_size,
+                                 seed=seed)(_worker_data['validate_r'].matrix)
+    estimate, low, high = estimates[metric]
+    model_path = None
+    if registry_file_path is not None:
+        model_path = os.path.join(output_directory, f'{save_name}.pickle')
+        with open(model_path, 'wb') as f:
+            pickle.dump(model, f)
+        ExperimentRegistry(registry_file_path).log(save_name, dict(params, max_epoch=epochs), model,
+                                                   {metric: estimate, f'{metric}_low': low, f'{metric}_high': high},
+                                                   model_path, sds_file_path, sample_size=sample_size)
+    return {
+        **params,
+        'epochs': epochs,
+        'epochs_trained': max(epochs - epochs_before, 0),
+        'training_loss': float(model._training_history[-1]),
+        metric: float(estimate),
+        f'{metric}_low': float(low),
+        f'{metric}_high': float(high),
+        'seconds': time.time() - start_time,
+        'model_path': model_path,
+    }
+
+
+class SuccessiveHalvingSearch(HyperparameterSearch):
+    """
+    Budget aware search on the shared data and process pool of HyperparameterSearch. Successive halving trains all
+    candidates for a few epochs, estimates their validation metric on a sample of the validation documents with
+    SampledEvaluator, and continues only the best 1/eta of them with eta times the epochs, until max_epoch. The
+    continued candidates are warm started from their checkpoints. Hyperband runs successive halving in brackets, from
+    many candidates with few epochs to few candidates with max_epoch, so the best number of epochs to compare the
+    candidates does not need to be known.
+    """
+
+    def __init__(self, sds_file_path: str, metric='p@3', greater_is_better=True, sample_size=1000, seed=0,
+                 **kwargs):
+        """
+
+        :param metric: the metric of MultiMetricEvaluator the candidates are ranked by
+        :param sample_size: number of validation documents sampled to estimate the metric
+        :param seed: the seed of the sampled documents and masks, the same for all candidates
+        :param kwargs: see HyperparameterSearch
+        """
+        super(SuccessiveHalvingSearch, self).__init__(sds_file_path, **kwargs)
+        self._metric = metric
+        self._greater_is_better = greater_is_better
+        self._sample_size = sample_size
+        self._seed = seed
+
+    def _successive_halving(self, executor: ProcessPoolExecutor, results: ResultsFile, paramses: tp.List[dict],
+                            min_epoch: int, max_epoch: int, eta: int, bracket=0) -> tp.List[dict]:
+        # the same candidate twice would write the same checkpoint
+        candidates = list({f"{'_'.join(map(str, params.values()))}": params for params in paramses}.values())
+        epochs = min_epoch
+        res = []
+        # the checkpoints of other runs, brackets or searches may be trained longer than the rungs of this one
+        checkpoint_directory = tempfile.mkdtemp(prefix='successive_halving_', dir=self._output_directory)
+        try:
+            for rung in itertools.count():
+                print(f"Bracket {bracket} rung {rung}: {len(candidates)} candidates with {epochs} epochs")
+                futures = [executor.submit(_train_budget, self._model_class, params, self._model_kwargs,
+                                           self._output_directory, checkpoint_directory, epochs, self._metric,
+                                           self._sample_size, self._seed,
+                                           self._registry_file_path if epochs >= max_epoch else None,
+                                           self._sds_file_path)
+                           for params in candidates]
+                rows = [future.result() for future in futures]
+                order = np.argsort([-row[self._metric] if self._greater_is_better else row[self._metric]
+                                    for row in rows], kind='stable')
+                num_promoted = max(1, len(candidates) // eta) if epochs < max_epoch else 0
+                for i, row in enumerate(rows):
+                    row.update(bracket=bracket, rung=rung, promoted=i in order[:num_promoted])
+                    results.write(row)
+                res.extend(rows)
+                if epochs >= max_epoch:
+                    break
+                candidates = [candidates[i] for i in order[:num_promoted]]
+                epochs = min(epochs * eta, max_epoch)
+        finally:
+            shutil.rmtree(checkpoint_directory, ignore_errors=True)
+        return res
+
+    def _best(self, rows: tp.List[dict], max_epoch: int) -> dict:
+        finished = [row for row in rows if row['epochs'] >= max_epoch]
+        scores = [row[self._metric] if self._greater_is_better else -row[self._metric] for row in finished]
+        best = finished[int(np.argmax(scores))]
+        print(f"Best {self._metric} {best[self._metric]:.6f} with {best['model_path']}, "
+              f"{sum(row['epochs_trained'] for row in rows)} epochs trained")
+        return best
+
+    def successive_halving(self, paramses: tp.List[dict], results_file_path: str, min_epoch=1, max_epoch=9,
+                           eta=3) -> tp.Tuple[dict, tp.List[dict]]:
+        """
+        :param paramses: the searched parameters of every candidate, without max_epoch
+        :param results_file_path: the csv file with a row of every candidate of every rung
+        :return: the row of the best candidate trained for max_epoch, and all rows
+        """
+        with self._executor() as executor, ResultsFile(results_file_path) as results:
+            rows = self._successive_halving(executor, results, paramses, min_epoch, max_epoch, eta)
+        return self._best(rows, max_epoch), rows
+
+    def hyperband(self, sample_params: tp.Callable[[np.random.Generator], dict], results_file_path: str,
+                  max_epoch=9, eta=3, seed=None) -> tp.Tuple[dict, tp.List[dict]]:
+        """
+        :param sample_params: draws the searched parameters of a candidate, without max_epoch
+        :return: the row of the best candidate trained for max_epoch, and all rows
+        """
+        rng = np.random.default_rng(seed)
+        s_max = int(math.log(max_epoch) / math.log(eta) + 1e-9)
+        rows = []
+        with self._executor() as executor, ResultsFile(results_file_path) as results:
+            for s in range(s_max, -1, -1):
+                num_candidates = math.ceil((s_max + 1) / (s + 1) * eta ** s)
+                min_epoch = max(1, round(max_epoch / eta ** s))
+                paramses = [sample_params(rng) for _ in range(num_candidates)]
+                rows.extend(self._successive_halving(executor, results, paramses, min_epoch, max_epoch, eta, s))
+        return self._best(rows, max_epoch), rows
@@ -0,0 +1,37 @@
+from base import *
+from ml.mini_batch_relu_latent_factor_model import MiniBatchReLuLatentFactorModel
+from ml.parallel_mini_batch_relu_latent_factor_model import ParallelMiniBatchReLuLatentFactorModel
+from ml.data_set_splitter import DataSetSplitter
+import time
+
+
+def benchmark(dataset: str, params: dict, num_workers_list: tp.Iterable, synchronous=True):
+    sds_file_path = f'./output/{dataset}.sds'
+    R = DataSetSplitter.get_train_utility_matrix(sds_file_path)
+
+    start = time.time()
+    model = MiniBatchReLuLatentFactorModel(**params)
+    model.train(R)
+    single_time = time.time() - start
+    single_history = np.array(model._training_history)
+
+    results = [('single', single_time, 1.0, 0.0)]
+    for num_workers in num_workers_list:
+        start = time.time()
+        model = ParallelMiniBatchReLuLatentFactorModel(**params, num_workers=num_workers, synchronous=synchronous)
+        model.train(R)
+        elapsed = time.time() - start
+        max_loss_diff = np.max(np.abs(np.array(model._training_history) - single_history))
+        results.append((num_workers, elapsed, single_time / elapsed, max_loss_diff))
+
+    print(f"{'workers':>8} {'seconds':>10} {'speedup':>8} {'max loss diff':>14}")
+    for num_workers, elapsed, speedup, max_loss_diff in results:
+        print(f"{num_workers:>8} {elapsed:>10.2f} {speedup:>8.2f} {max_loss_diff:>14.4E}")
+
+
+if __name__ == '__main__':
+    dataset = 'fullAllPublicXML'
+    params = {
+        'tau': -1e-3, 'k': 1e3, 'lambda_': 0.01, 'alpha': 0.1, 'max_epoch': 5,
+    }
+    benchmark(dataset, params, [2, 4, 8])
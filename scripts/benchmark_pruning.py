@@ -0,0 +1,59 @@
+from base import *
+from time import perf_counter
+from ml.pruned_latent_factor_model import PrunedLatentFactorModel
+from ml.average_precision_k_tester import AveragePrecisionKTester
+from ml.masked_test_fixture import MaskedTestFixture
+from ml.data_set_splitter import DataSetSplitter, DATA_SET_INDICATOR
+import pickle
+
+
+def time_recommend(model, docs, k: int, repeat=3) -> float:
+    """
+    the best seconds of recommending for the docs
+    """
+    res = np.inf
+    for _ in range(repeat):
+        start = perf_counter()
+        model.recommend(docs, k)
+        res = min(res, perf_counter() - start)
+    return res
+
+
+def benchmark(model_path: str, sds_file_path: str, top_ns: tp.Iterable = (None, 500, 200, 100, 50, 20, 10),
+              thresholds: tp.Iterable = None, k=3, fraction_of_masking=0.8):
+    """
+    :param top_ns: the top_n pruning levels, see PrunedLatentFactorModel.prune
+    :param thresholds: the threshold pruning levels, by default the magnitudes of the 50%, 80%, 90%, 95%, 98% and 99%
+     quantiles of the non-zero weights
+    """
+    with open(model_path, 'rb') as f:
+        model = pickle.load(f)
+    TEST = DataSetSplitter.get_test_utility_matrix(sds_file_path)
+    # all pruning levels are tested against the same masks
+    fixture = MaskedTestFixture.get_or_create(sds_file_path, DATA_SET_INDICATOR.TEST, fraction_of_masking)
+    if thresholds is None:
+        magnitudes = np.abs(model._W_theta[model._W_theta != 0])
+        thresholds = np.quantile(magnitudes, [0.5, 0.8, 0.9, 0.95, 0.98, 0.99]) if magnitudes.size else []
+
+    dense_bytes = model._W_theta.nbytes + model._b.nbytes
+    dense_p, _ = AveragePrecisionKTester(model, k, fraction_of_masking, seed=0)(fixture)
+    dense_seconds = time_recommend(model, TEST, k)
+    print(f"dense: P@{k} {dense_p:.6f}, {dense_bytes} bytes, {TEST.shape[1] / dense_seconds:.0f} docs/s")
+    print(f"{'pruning':>14} {'nnz/row':>8} {f'P@{k}':>9} {'change':>9} {'size':>7} {'speedup':>8}")
+    levels = ([(f"top {'all' if top_n is None else top_n}", {'top_n': top_n}) for top_n in top_ns] +
+              [(f">= {threshold:.3E}", {'threshold': threshold}) for threshold in thresholds])
+    for name, pruning in levels:
+        pruned = PrunedLatentFactorModel.prune(model, **pruning)
+        p, _ = AveragePrecisionKTester(pruned, k, fraction_of_masking, seed=0)(fixture)
+        seconds = time_recommend(pruned, TEST, k)
+        print(f"{name:>14} {pruned._W_theta.nnz / pruned._W_theta.shape[0]:>8.1f} "
+              f"{p:>9.6f} {p - dense_p:>+9.6f} {pruned.nbytes / dense_bytes:>7.3f} {dense_seconds / seconds:>8.2f}")
+
+
+if __name__ == '__main__':
+    dataset = 'fullAllPublicXML'
+    params = {
+        'tau': -1e-3, 'k': 1e3, 'lambda_': 0.01, 'alpha': 0.1, 'max_epoch': 5,
+    }
+    save_name = f"model{'_'.join(map(str, params.values()))}"
+    benchmark(f'./output/{save_name}.pickle', f'./output/{dataset}.sds')
@@ -0,0 +1,47 @@
+from base import *
+from ml.mini_batch_relu_latent_factor_model import MiniBatchReLuLatentFactorModel
+from ml.ridge_latent_factor_model import RidgeLatentFactorModel
+from ml.mse_tester import MseTester
+from ml.data_set_splitter import DataSetSplitter
+
+
+def time_to_reach(model: MiniBatchReLuLatentFactorModel, target: float) -> tp.Tuple[int, float]:
+    """
+    the first epoch and training time at which the validation loss of the model is not above target
+    """
+    for epoch, (loss, seconds) in enumerate(zip(model._validation_history, model._training_times)):
+        if loss <= target:
+            return epoch, seconds
+    return None, None
+
+
+def benchmark(dataset: str, params: dict, refinement_epochs=1):
+    sds_file_path = f'./output/{dataset}.sds'
+    R = DataSetSplitter.get_train_utility_matrix(sds_file_path)
+    VAL = DataSetSplitter.get_validate_utility_matrix(sds_file_path)
+
+    models = {
+        'sgd': MiniBatchReLuLatentFactorModel(**params),
+        'ridge': RidgeLatentFactorModel(**dict(params, max_epoch=0)),
+        'ridge+sgd': RidgeLatentFactorModel(**dict(params, max_epoch=refinement_epochs)),
+    }
+    for model in models.values():
+        model.train(R, VAL)
+
+    # the validation loss reached by the closed form solution is the target
+    target = models['ridge']._validation_history[-1]
+    print(f"Target validation loss: {target:0.8E}")
+    print(f"{'model':>10} {'val loss':>14} {'val mse':>10} {'epochs':>7} {'seconds':>8} {'to target (s)':>14}")
+    for name, model in models.items():
+        epoch, seconds = time_to_reach(model, target)
+        mse, _ = MseTester(model)(VAL)
+        print(f"{name:>10} {model._validation_history[-1]:>14.8E} {mse:>10.6f} {len(model._training_history) - 1:>7} "
+              f"{model._training_times[-1]:>8.2f} {'-' if seconds is None else f'{seconds:.2f}':>14}")
+
+
+if __name__ == '__main__':
+    dataset = 'fullAllPublicXML'
+    params = {
+        'tau': -1e-3, 'k': 1e3, 'lambda_': 0.01, 'alpha': 0.1, 'max_epoch': 5, 'validate_sample_size': 10000,
+    }
+    benchmark(dataset, params)
@@ -0,0 +1,82 @@
+from base import *
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from clinical_trials.clinical_trial_document_xml_zip_file_reader import ClinicalTrialDocumentXmlZipFileReader
+from ml.inference_artifact import InferenceArtifact
+from ml.mesh_recommender import MeshRecommender
+from service.recommendation_cache import RecommendationCache
+import csv
+import pickle
+
+# the state of every worker process, loaded once by _init_worker
+_recommender = None
+_reader = None
+
+
+def _init_worker(artifact_path: str, mesh_trie_path: str, zip_file_path: str, cache_file_path: str):
+    global _recommender, _reader
+    with open(mesh_trie_path, 'rb') as f:
+        mesh_trie = pickle.load(f)
+    # the memory mapped parameters are shared by all workers
+    artifact = InferenceArtifact.load(artifact_path)
+    _recommender = MeshRecommender.from_artifact(mesh_trie, artifact)
+    if cache_file_path is not None:
+        _recommender = RecommendationCache(_recommender, cache_file_path, artifact.version)
+    _reader = ClinicalTrialDocumentXmlZipFileReader(zip_file_path)
+
+
+def _score_chunk(file_names: tp.List[str], k: int) -> tp.List[tp.Tuple[str, tp.List[tp.Tuple[str, float]]]]:
+    docs = [_reader.read(file_name) for file_name in file_names]
+    return list(zip([doc.nct_id for doc in docs], _recommender.recommend_many(docs, k)))
+
+
+def _write_chunk(writer, rows: tp.List[tp.Tuple[str, tp.List[tp.Tuple[str, float]]]]) -> int:
+    for nct_id, recommendations in rows:
+        writer.writerow([nct_id] + [value for heading, score in recommendations
+                                    for value in (heading, f'{score:.6g}')])
+    return len(rows)
+
+
+def bulk_score(artifact_path: str, mesh_trie_path: str, zip_file_path: str, output_file_path: str, k=10,
+               num_workers=os.cpu_count(), chunk_size=256, max_in_flight: int = None,
+               cache_file_path: str = None) -> float:
+    """
+    Score every trial of the zip and write a csv of nct_id, heading_1, score_1, ..., heading_k, score_k.
+    The workers read the trials from the zip by the names of their files, and at most max_in_flight chunks are
+    scored or waiting to be written, so the memory is bounded whatever the size of the zip.
+    :param cache_file_path: if given, the trials unchanged since they were cached are not scored again
+    :return: documents per second
+    """
+    with ClinicalTrialDocumentXmlZipFileReader(zip_file_path) as reader:
+        file_names = list(reader.nct_id_file_names().values())
+    max_in_flight = 2 * num_workers if max_in_flight is None else max_in_flight
+
+    start = perf_counter()
+    with ProcessPoolExecutor(num_workers, initializer=_init_worker,
+                             initargs=(artifact_path, mesh_trie_path, zip_file_path, cache_file_path)) as executor, \
+            open(output_file_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['nct_id'] + [f'{column}_{i}' for i in range(1, k + 1) for column in ('heading', 'score')])
+        in_flight = deque()
+        chunks = (file_names[i:i + chunk_size] for i in range(0, len(file_names), chunk_size))
+        with tqdm(total=len(file_names), unit='doc') as progress:
+            for chunk in chunks:
+                in_flight.append(executor.submit(_score_chunk, chunk, k))
+                if len(in_flight) >= max_in_flight:
+                    progress.update(_write_chunk(writer, in_flight.popleft().result()))
+            while in_flight:
+                progress.update(_write_chunk(writer, in_flight.popleft().result()))
+    seconds = perf_counter() - start
+    print(f"{len(file_names)} documents scored in {seconds:.2f}s, {len(file_names) / seconds:.0f} documents/s")
+    return len(file_names) / seconds
+
+
+if __name__ == '__main__':
+    params = {
+        'tau': -1e-3, 'k': 1e3, 'lambda_': 0.01, 'alpha': 0.1, 'max_epoch': 5,
+    }
+    save_name = f"model{'_'.join(map(str, params.values()))}"
+    bulk_score(f'./output/{save_name}{InferenceArtifact.__FILE_EXTENSION__}', './output/AllPublicXML.trie.pickle',
+               './output/AllPublicXML.zip', f'./output/{save_name}.recommendations.csv',
+               cache_file_path='./output/recommendations.cache.sqlite')
@@ -0,0 +1,45 @@
+from base import *
+from ml.mini_batch_relu_latent_factor_model import MiniBatchReLuLatentFactorModel
+from ml.optimizer import SGD, Momentum, AdaGrad, Adam, ExponentialDecaySchedule
+from ml.data_set_splitter import DataSetSplitter
+
+
+def compare(dataset: str, params: dict, candidates: dict):
+    """
+    Train plain SGD for max_epoch epochs and record, for every candidate optimizer, the epoch at which it reaches the
+    final training loss of plain SGD.
+    """
+    sds_file_path = f'./output/{dataset}.sds'
+    R = DataSetSplitter.get_train_utility_matrix(sds_file_path)
+
+    baseline = MiniBatchReLuLatentFactorModel(**params)
+    baseline.train(R)
+    target_loss = baseline._training_history[-1]
+
+    results = {}
+    for name, (optimizer, alpha, schedule) in candidates.items():
+        model = MiniBatchReLuLatentFactorModel(**dict(params, alpha=alpha), optimizer=optimizer,
+                                               learning_rate_schedule=schedule, target_loss=target_loss)
+        model.train(R)
+        results[name] = model
+
+    print(f"Target loss (SGD after {params['max_epoch']} epochs): {target_loss:0.8E}")
+    print(f"{'optimizer':>20} {'final loss':>14} {'epochs to target':>17}")
+    for name, model in results.items():
+        epochs = model._epochs_to_target_loss
+        print(f"{name:>20} {model._training_history[-1]:>14.8E} {'-' if epochs is None else epochs:>17}")
+
+
+if __name__ == '__main__':
+    dataset = 'fullAllPublicXML'
+    params = {
+        'tau': -1e-3, 'k': 1e3, 'lambda_': 0.01, 'alpha': 0.1, 'max_epoch': 5,
+    }
+    candidates = {
+        'sgd': (SGD(), 0.1, None),
+        'momentum': (Momentum(0.9), 0.1, None),
+        'adagrad': (AdaGrad(), 0.01, None),
+        'adam': (Adam(), 0.001, None),
+        'adam+exp decay': (Adam(), 0.001, ExponentialDecaySchedule(0.7)),
+    }
+    compare(dataset, params, candidates)
@@ -0,0 +1,44 @@
+from base import *
+from time import perf_counter
+from ml.quantized_latent_factor_model import QuantizedLatentFactorModel
+from ml.average_precision_k_tester import AveragePrecisionKTester
+from ml.masked_test_fixture import MaskedTestFixture
+from ml.data_set_splitter import DataSetSplitter, DATA_SET_INDICATOR
+import pickle
+
+
+def evaluate(model_path: str, sds_file_path: str, k=3, fraction_of_masking=0.8, tolerance=0.005) -> bool:
+    """
+    Accept the int8 model if its P@k on the test split is within tolerance of the float model, tested against the
+    same masks
+    """
+    with open(model_path, 'rb') as f:
+        model = pickle.load(f)
+    quantized = QuantizedLatentFactorModel.quantize(model)
+    TEST = DataSetSplitter.get_test_utility_matrix(sds_file_path)
+    fixture = MaskedTestFixture.get_or_create(sds_file_path, DATA_SET_INDICATOR.TEST, fraction_of_masking)
+
+    print(f"{'model':>8} {f'P@{k}':>9} {'bytes':>12} {'docs/s':>10}")
+    results = []
+    for name, m in (('float', model), ('int8', quantized)):
+        p, _ = AveragePrecisionKTester(m, k, fraction_of_masking, seed=0)(fixture)
+        start = perf_counter()
+        m.recommend(TEST, k)
+        docs_per_second = TEST.shape[1] / (perf_counter() - start)
+        nbytes = m.nbytes if name == 'int8' else model._W_theta.nbytes + model._b.nbytes
+        print(f"{name:>8} {p:>9.6f} {nbytes:>12} {docs_per_second:>10.0f}")
+        results.append(p)
+
+    accepted = abs(results[1] - results[0]) <= tolerance
+    print(f"P@{k} change {results[1] - results[0]:+.6f}, {'accepted' if accepted else 'rejected'} "
+          f"with tolerance {tolerance}")
+    return accepted
+
+
+if __name__ == '__main__':
+    dataset = 'fullAllPublicXML'
+    params = {
+        'tau': -1e-3, 'k': 1e3, 'lambda_': 0.01, 'alpha': 0.1, 'max_epoch': 5,
+    }
+    save_name = f"model{'_'.join(map(str, params.values()))}"
+    evaluate(f'./output/{save_name}.pickle', f'./output/{dataset}.sds')
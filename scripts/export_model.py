@@ -0,0 +1,41 @@
+from base import *
+from math import log10
+from ml.data_set_splitter import DataSetSplitter
+from ml.inference_artifact import InferenceArtifact
+import pickle
+
+
+def export_model(model_path: str, ctdmc_file_path: str, sds_file_path: str, dtype='f4') -> str:
+    """
+    Export a pickled model to an inference artifact next to it, and the mesh trie of the counter next to the counter,
+    so serving loads neither the training object nor the counts of the corpus.
+    :return: the path of the inference artifact
+    """
+    with open(model_path, 'rb') as f:
+        model = pickle.load(f)
+    with open(ctdmc_file_path, 'rb') as f:
+        ctdmc = pickle.load(f)
+    mesh_index_map_path = f'{model_path}.mesh_index_map.npy'
+    if os.path.exists(mesh_index_map_path):
+        mesh_index_map = np.load(mesh_index_map_path)
+    else:
+        mesh_index_map = DataSetSplitter.get_mesh_index_map(sds_file_path)
+
+    log_idf = np.array([log10(ctdmc.idf(mesh_index)) for mesh_index in mesh_index_map.tolist()])
+    headings = [ctdmc.mesh_trie.get_heading_of_index(mesh_index) for mesh_index in mesh_index_map.tolist()]
+    artifact_path = f'{os.path.splitext(model_path)[0]}{InferenceArtifact.__FILE_EXTENSION__}'
+    version = InferenceArtifact.export(model, log_idf, mesh_index_map, headings, artifact_path, dtype)
+    print(f"exported {artifact_path} ({os.path.getsize(artifact_path)} bytes), version {version}")
+
+    with open(f'{os.path.splitext(ctdmc_file_path)[0]}.trie.pickle', 'wb') as f:
+        pickle.dump(ctdmc.mesh_trie, f)
+    return artifact_path
+
+
+if __name__ == '__main__':
+    dataset = 'fullAllPublicXML'
+    params = {
+        'tau': -1e-3, 'k': 1e3, 'lambda_': 0.01, 'alpha': 0.1, 'max_epoch': 5,
+    }
+    save_name = f"model{'_'.join(map(str, params.values()))}"
+    export_model(f'./output/{save_name}.pickle', './output/AllPublicXML.ctdmc', f'./output/{dataset}.sds')
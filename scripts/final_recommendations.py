@@ -6,9 +6,16 @@ Final working script to show recommendations without array comparison issues.
 import pickle
 import numpy as np
 from ml.data_set_splitter import DataSetSplitter
+from ml.mesh_vocabulary import MeshVocabulary
 import os
 import glob
 
+def mesh_name(vocabulary, mesh_idx):
+    """Show the heading of the MeSH index if the vocabulary of the dataset is available."""
+    if vocabulary is None:
+        return f"MeSH Index {mesh_idx}"
+    return f"{vocabulary[mesh_idx]} (MeSH Index {mesh_idx})"
+
 def get_latest_model_pickle(directory='./output/'):
     """Find the newest model pickle file."""
     list_of_files = glob.glob(os.path.join(directory, 'model*.pickle'))
@@ -45,6 +52,9 @@ def show_final_recommendations():
         train_data = DataSetSplitter.get_train_utility_matrix('./output/fullAllPublicXML.sds')
         val_data = DataSetSplitter.get_validate_utility_matrix('./output/fullAllPublicXML.sds')
         test_data = DataSetSplitter.get_test_utility_matrix('./output/fullAllPublicXML.sds')
+        vocabulary = None
+        if os.path.exists(MeshVocabulary.vocabulary_path('./output/fullAllPublicXML.sds')):
+            vocabulary = DataSetSplitter.get_vocabulary('./output/fullAllPublicXML.sds')
         
         print(f"Train data shape: {train_data.shape}")
         print(f"Validation data shape: {val_data.shape}")
@@ -66,23 +76,16 @@ def show_final_recommendations():
         # Show top current terms
         current_terms.sort(key=lambda x: x[1], reverse=True)
         for i, (mesh_idx, score) in enumerate(current_terms[:5]):
-            print(f"  {i+1}. MeSH Index {mesh_idx}: TF-IDF = {score:.4f}")
+            print(f"  {i+1}. {mesh_name(vocabulary, mesh_idx)}: TF-IDF = {score:.4f}")
         
         # Get predictions
         print("\nGetting predictions...")
-        predictions = model.predict(sample_doc)
-        
-        # Flatten predictions if it's 2D
-        if predictions.ndim > 1:
-            predictions = predictions.flatten()
+        indices, scores = model.recommend(test_data[:, [sample_doc_idx]], 10, exclude_present=False)
         
         # Show ALL predictions (not filtering)
         print(f"\nTop 10 MeSH term predictions (all terms):")
-        all_predictions = [(i, float(score)) for i, score in enumerate(predictions)]
-        all_predictions.sort(key=lambda x: x[1], reverse=True)
-        
-        for i, (mesh_idx, score) in enumerate(all_predictions[:10]):
-            print(f"  {i+1:2d}. MeSH Index {mesh_idx}: Score = {score:.4f}")
+        for i, (mesh_idx, score) in enumerate(zip(indices[0], scores[0])):
+            print(f"  {i+1:2d}. {mesh_name(vocabulary, mesh_idx)}: Score = {score:.4f}")
         
         # Show model performance
         print(f"\n=== Model Performance ===")
@@ -0,0 +1,21 @@
+from base import *
+from ml.successive_halving_search import SuccessiveHalvingSearch
+
+
+def sample_params(rng: np.random.Generator) -> dict:
+    """
+    the ranges of the grid of search_params.py and search_alpha.py
+    """
+    return {
+        'tau': -float(10 ** rng.uniform(-1, 1)),
+        'k': int(rng.choice([2, 4, 16])),
+        'lambda_': float(10 ** rng.uniform(-1, 0)),
+        'alpha': float(10 ** rng.uniform(-2, 0)),
+    }
+
+
+if __name__ == '__main__':
+    dataset = 'fullAllPublicXML'
+    search = SuccessiveHalvingSearch(f'./output/{dataset}.sds', metric='p@3', sample_size=1000)
+    best, rows = search.hyperband(sample_params, './output/hyperband_search.csv', max_epoch=9, eta=3, seed=0)
+    print(best)
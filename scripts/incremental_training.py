@@ -0,0 +1,50 @@
+from base import *
+from ml.data_set_splitter import DataSetSplitter
+import pickle
+
+
+def incremental_train(model_path: str, sds_file_path: str, new_sds_file_path: str, max_passes=1, replay=True):
+    """
+    Update a trained model with the training documents of a data set of new trials.
+    :param model_path: the pickled model, updated in place. Its training state (see
+     MiniBatchReLuLatentFactorModel.dump_training_state) and its mesh_index_map are kept next to it, the latter because
+     a vocabulary growth makes it differ from the one of the original data set
+    :param sds_file_path: the data set the model was trained with, used for replaying old documents
+    :param new_sds_file_path: the data set of the new trials only
+    """
+    with open(model_path, 'rb') as f:
+        model = pickle.load(f)
+    training_state_path = f'{model_path}.training_state.npz'
+    model.load_training_state(training_state_path)
+
+    mesh_index_map_path = f'{model_path}.mesh_index_map.npy'
+    if os.path.exists(mesh_index_map_path):
+        mesh_index_map = np.load(mesh_index_map_path)
+    else:
+        mesh_index_map = DataSetSplitter.get_mesh_index_map(sds_file_path)
+
+    NEW, new_mesh_index_map = DataSetSplitter.align_utility_matrix(
+        DataSetSplitter.get_train_utility_matrix(new_sds_file_path),
+        DataSetSplitter.get_mesh_index_map(new_sds_file_path), mesh_index_map)
+    print(f"{NEW.shape[1]} new documents, {len(new_mesh_index_map) - len(mesh_index_map)} new mesh terms")
+
+    REPLAY = None
+    if replay:
+        REPLAY, _ = DataSetSplitter.align_utility_matrix(DataSetSplitter.get_train_utility_matrix(sds_file_path),
+                                                         DataSetSplitter.get_mesh_index_map(sds_file_path),
+                                                         mesh_index_map)
+    model.partial_fit(NEW, REPLAY, max_passes=max_passes)
+
+    with open(model_path, 'wb') as f:
+        pickle.dump(model, f)
+    model.dump_training_state(training_state_path)
+    np.save(mesh_index_map_path, new_mesh_index_map)
+
+
+if __name__ == '__main__':
+    dataset = 'fullAllPublicXML'
+    params = {
+        'tau': -1e-3, 'k': 1e3, 'lambda_': 0.01, 'alpha': 0.1, 'max_epoch': 5,
+    }
+    save_name = f"model{'_'.join(map(str, params.values()))}"
+    incremental_train(f'./output/{save_name}.pickle', f'./output/{dataset}.sds', f'./output/new{dataset}.sds')
@@ -0,0 +1,53 @@
+from base import *
+from itertools import islice
+from clinical_trials.clinical_trial_document_xml_zip_file_reader import ClinicalTrialDocumentXmlZipFileReader
+from ml.data_set_splitter import DataSetSplitter
+from ml.inference_artifact import InferenceArtifact
+from ml.mesh_recommender import MeshRecommender
+import pickle
+
+
+def build_recommender(model_path: str, ctdmc_file_path: str, sds_file_path: str) -> MeshRecommender:
+    # prefer the inference artifact and the mesh trie written by export_model.py
+    artifact_path = f'{os.path.splitext(model_path)[0]}{InferenceArtifact.__FILE_EXTENSION__}'
+    mesh_trie_path = f'{os.path.splitext(ctdmc_file_path)[0]}.trie.pickle'
+    if os.path.exists(artifact_path) and os.path.exists(mesh_trie_path):
+        with open(mesh_trie_path, 'rb') as f:
+            mesh_trie = pickle.load(f)
+        return MeshRecommender.from_artifact(mesh_trie, InferenceArtifact.load(artifact_path))
+
+    with open(model_path, 'rb') as f:
+        model = pickle.load(f)
+    with open(ctdmc_file_path, 'rb') as f:
+        ctdmc = pickle.load(f)
+    # a model updated by incremental training keeps its grown mesh_index_map next to it
+    mesh_index_map_path = f'{model_path}.mesh_index_map.npy'
+    if os.path.exists(mesh_index_map_path):
+        mesh_index_map = np.load(mesh_index_map_path)
+    else:
+        mesh_index_map = DataSetSplitter.get_mesh_index_map(sds_file_path)
+    return MeshRecommender.from_counter(ctdmc, mesh_index_map, model)
+
+
+if __name__ == '__main__':
+    dataset = 'fullAllPublicXML'
+    params = {
+        'tau': -1e-3, 'k': 1e3, 'lambda_': 0.01, 'alpha': 0.1, 'max_epoch': 5,
+    }
+    save_name = f"model{'_'.join(map(str, params.values()))}"
+    recommender = build_recommender(f'./output/{save_name}.pickle', './output/AllPublicXML.ctdmc',
+                                    f'./output/{dataset}.sds')
+
+    with ClinicalTrialDocumentXmlZipFileReader('./output/AllPublicXML.zip') as reader:
+        docs = list(islice(reader, 1000))
+
+    for doc in docs[:3]:
+        print(doc.nct_id, recommender.recommend(doc, k=5))
+        print({stage: f'{seconds * 1000:.3f}ms' for stage, seconds in recommender.last_latency.items()})
+    for doc in tqdm(docs):
+        recommender.recommend(doc)
+    for stage, (p50, p90, p99) in recommender.latency_percentiles().items():
+        print(f'{stage}: p50 {p50:.3f}ms, p90 {p90:.3f}ms, p99 {p99:.3f}ms')
+
+    recommender.recommend_many(docs)
+    print(f"batch of {len(docs)}: {recommender.last_latency}")
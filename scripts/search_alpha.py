@@ -1,29 +1,31 @@
 from base import *
 from ml.mini_batch_relu_latent_factor_model import MiniBatchReLuLatentFactorModel
-from ml.mse_tester import MseTester
-from ml.average_precision_k_tester import AveragePrecisionKTester
+from ml.multi_metric_evaluator import MultiMetricEvaluator
 from ml.data_set_splitter import DataSetSplitter
+from ml.experiment_registry import ExperimentRegistry
 import pickle
 
 
 def train_test(dataset: str, params: dict):
     sds_file_path = f'./output/{dataset}.sds'
     save_name = f"model{'_'.join(map(str,params.values()))}"
-    model = MiniBatchReLuLatentFactorModel(**params)
+    checkpoint_path = f'./output/{save_name}.ckpt.npz'
+    model = MiniBatchReLuLatentFactorModel(**params, checkpoint_path=checkpoint_path, patience=2)
 
     R = DataSetSplitter.get_train_utility_matrix(sds_file_path)
-    model.train(R)
+    VAL = DataSetSplitter.get_validate_utility_matrix(sds_file_path)
+    model.train(R, VAL, resume_from=checkpoint_path if os.path.exists(checkpoint_path) else None,
+                data_set_identity=DataSetSplitter.file_identity(sds_file_path))
 
-    with open(f'./output/{save_name}.pickle', 'wb') as f:
+    model_path = f'./output/{save_name}.pickle'
+    with open(model_path, 'wb') as f:
         pickle.dump(model, f)
 
-    VAL = DataSetSplitter.get_validate_utility_matrix(sds_file_path)
-    mset = MseTester(model)
-    mse = mset(VAL)
-    print(mse)
-    apkt = AveragePrecisionKTester(model)
-    apk = apkt(VAL)
-    print(apk)
+    metrics = MultiMetricEvaluator(model)(VAL)
+    print(model.mse_test)
+    print(model.apk_test)
+    print(metrics)
+    ExperimentRegistry().log(save_name, params, model, metrics, model_path, sds_file_path)
 
 
 if __name__ == '__main__':
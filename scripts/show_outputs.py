@@ -6,9 +6,9 @@ Simple script to show model outputs and performance metrics.
 import pickle
 import os
 import glob
-from ml.data_set_splitter import DataSetSplitter
-from ml.mse_tester import MseTester
-from ml.average_precision_k_tester import AveragePrecisionKTester
+from ml.data_set_splitter import DATA_SET_INDICATOR
+from ml.masked_test_fixture import MaskedTestFixture
+from ml.multi_metric_evaluator import MultiMetricEvaluator
 
 def show_model_performance():
     """Show performance metrics for all trained models."""
@@ -20,8 +20,10 @@ def show_model_performance():
         print("No trained models found in output/ directory.")
         return
     
-    # Load test data
-    test_data = DataSetSplitter.get_test_utility_matrix('./output/fullAllPublicXML.sds')
+    # Load the masked test data, the same masks are used for all models. The masking of apk_test, so all metrics
+    # are calculated from the fixture in a single pass
+    test_fixture = MaskedTestFixture.get_or_create('./output/fullAllPublicXML.sds', DATA_SET_INDICATOR.TEST,
+                                                   fraction_of_masking=0.8)
     
     for model_file in sorted(model_files):
         print(f"Model: {os.path.basename(model_file)}")
@@ -30,16 +32,11 @@ def show_model_performance():
             with open(model_file, 'rb') as f:
                 model = pickle.load(f)
             
-            # Calculate MSE
-            mse_tester = MseTester(model)
-            mse = mse_tester(test_data)
+            # Calculate MSE and AP@K
+            metrics = MultiMetricEvaluator(model)(test_fixture)
             
-            # Calculate AP@K
-            apk_tester = AveragePrecisionKTester(model)
-            apk = apk_tester(test_data)
-            
-            print(f"  MSE: {mse:.6f}")
-            print(f"  AP@K: {apk:.6f}")
+            print(f"  MSE: {metrics['mse']:.6f}")
+            print(f"  AP@K: {metrics['p@3']:.6f}")
             
             # Show model parameters if available
             if hasattr(model, '_alpha'):
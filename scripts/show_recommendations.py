@@ -38,7 +38,7 @@ def show_recommendations(model, ctdmc, doc_index=0, top_k=10):
     
     print(f"\nCurrent MeSH terms in document {doc_index}:")
     for mesh_index, tfidf in sorted(current_terms, key=lambda x: x[1], reverse=True)[:5]:
-        print(f"  - MeSH Index {mesh_index}: TF-IDF = {tfidf:.4f}")
+        print(f"  - {ctdmc.mesh_trie.get_heading_of_index(mesh_index)} (MeSH Index {mesh_index}): TF-IDF = {tfidf:.4f}")
     
     # Get predictions for this document
     # Get the total number of MeSH terms
@@ -57,21 +57,14 @@ def show_recommendations(model, ctdmc, doc_index=0, top_k=10):
         if counter is not None:
             doc_vector[i] = counter[doc_index]
     
-    predictions = model.predict(doc_vector)
-    
     # Get top recommendations (excluding already present terms)
-    recommendations = []
-    for i, score in enumerate(predictions):
-        mesh_index = mesh_index_map[i]
-        counter = ctdmc._counter[mesh_index]
-        if counter is not None and counter[doc_index] == 0:  # Not already in document
-            recommendations.append((mesh_index, score))
-    
-    recommendations.sort(key=lambda x: x[1], reverse=True)
+    indices, scores = model.recommend(doc_vector, top_k)
+    recommendations = [(mesh_index_map[i], score) for i, score in zip(indices[0], scores[0]) if np.isfinite(score)]
     
     print(f"\nTop {top_k} recommended MeSH terms:")
     for i, (mesh_index, score) in enumerate(recommendations[:top_k]):
-        print(f"  {i+1:2d}. MeSH Index {mesh_index}: Score = {score:.4f}")
+        print(f"  {i+1:2d}. {ctdmc.mesh_trie.get_heading_of_index(mesh_index)} (MeSH Index {mesh_index}): "
+              f"Score = {score:.4f}")
     
     return recommendations[:top_k]
 
@@ -6,9 +6,16 @@ Simple script to show recommendations using the same data format as training.
 import pickle
 import numpy as np
 from ml.data_set_splitter import DataSetSplitter
+from ml.mesh_vocabulary import MeshVocabulary
 import os
 import glob
 
+def mesh_name(vocabulary, mesh_idx):
+    """Show the heading of the MeSH index if the vocabulary of the dataset is available."""
+    if vocabulary is None:
+        return f"MeSH Index {mesh_idx}"
+    return f"{vocabulary[mesh_idx]} (MeSH Index {mesh_idx})"
+
 def get_latest_model_pickle(directory='./output/'):
     """Find the newest model pickle file."""
     list_of_files = glob.glob(os.path.join(directory, 'model*.pickle'))
@@ -45,6 +52,9 @@ def show_simple_recommendations():
         train_data = DataSetSplitter.get_train_utility_matrix('./output/fullAllPublicXML.sds')
         val_data = DataSetSplitter.get_validate_utility_matrix('./output/fullAllPublicXML.sds')
         test_data = DataSetSplitter.get_test_utility_matrix('./output/fullAllPublicXML.sds')
+        vocabulary = None
+        if os.path.exists(MeshVocabulary.vocabulary_path('./output/fullAllPublicXML.sds')):
+            vocabulary = DataSetSplitter.get_vocabulary('./output/fullAllPublicXML.sds')
         
         print(f"Train data shape: {train_data.shape}")
         print(f"Validation data shape: {val_data.shape}")
@@ -66,22 +76,17 @@ def show_simple_recommendations():
         # Show top current terms
         current_terms.sort(key=lambda x: x[1], reverse=True)
         for i, (mesh_idx, score) in enumerate(current_terms[:5]):
-            print(f"  {i+1}. MeSH Index {mesh_idx}: TF-IDF = {score:.4f}")
-        
-        # Get predictions
-        predictions = model.predict(sample_doc)
+            print(f"  {i+1}. {mesh_name(vocabulary, mesh_idx)}: TF-IDF = {score:.4f}")
         
         # Show top recommendations (excluding current terms)
-        recommendations = []
-        for i, score in enumerate(predictions):
-            if np.isclose(sample_doc[i], 0.0):  # Not already in document
-                recommendations.append((i, score))
+        indices, scores = model.recommend(test_data[:, [sample_doc_idx]], 10)
         
-        recommendations.sort(key=lambda x: x[1], reverse=True)
+        # excluded terms are only picked, with the score -inf, when the document has less than 10 candidates
+        recommendations = [(mesh_idx, score) for mesh_idx, score in zip(indices[0], scores[0]) if np.isfinite(score)]
         
         print(f"\nTop 10 recommended MeSH terms:")
-        for i, (mesh_idx, score) in enumerate(recommendations[:10]):
-            print(f"  {i+1:2d}. MeSH Index {mesh_idx}: Score = {score:.4f}")
+        for i, (mesh_idx, score) in enumerate(recommendations):
+            print(f"  {i+1:2d}. {mesh_name(vocabulary, mesh_idx)}: Score = {score:.4f}")
         
         # Show model performance
         print(f"\n=== Model Performance ===")
@@ -1,10 +1,10 @@
 from ml.data_set_splitter import DataSetSplitter
+from ml.master_matrix import MasterMatrix
 
 if __name__ == '__main__':
-    import pickle
-
     dataset = 'AllPublicXML'
-    with open(f'./output/{dataset}.ctdmc', 'rb') as f:
-        ctdmc = pickle.load(f)
+    # the master matrix is built from the counter once, any threshold is then a view of it
+    master = MasterMatrix.get_or_create(f'./output/{dataset}.ctdmc')
 
-    path = DataSetSplitter.dump_split_data_set(ctdmc, f'./output/full{dataset}.sds', frequency_threshold=0.05)
+    split_choice_map = DataSetSplitter.hash_split_choice_map(master.nct_ids)
+    path = master.dump_split_data_set(f'./output/full{dataset}.sds', split_choice_map, frequency_threshold=0.05)
@@ -1,5 +1,4 @@
-from ml.mse_tester import MseTester
-from ml.average_precision_k_tester import AveragePrecisionKTester
+from ml.multi_metric_evaluator import MultiMetricEvaluator
 from ml.data_set_splitter import DataSetSplitter
 import pickle
 import sys
@@ -30,12 +29,10 @@ def main():
     sds_path = Path('./output/fullAllPublicXML.sds')
     TEST = DataSetSplitter.get_test_utility_matrix(str(sds_path))
 
-    mset = MseTester(model)
-    mse = mset(TEST)
-    print(mse)
-    apkt = AveragePrecisionKTester(model)
-    apk = apkt(TEST)
-    print(apk)
+    metrics = MultiMetricEvaluator(model)(TEST)
+    print(model.mse_test)
+    print(model.apk_test)
+    print(metrics)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,83 @@
+from base import *
+from itertools import islice
+from time import perf_counter
+from clinical_trials.clinical_trial_document import ClinicalTrialDocument
+from clinical_trials.clinical_trial_document_xml_zip_file_reader import ClinicalTrialDocumentXmlZipFileReader
+import argparse
+import asyncio
+import json
+
+
+async def request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, method: str, path: str,
+                  payload: dict = None) -> tp.Tuple[int, dict]:
+    """
+    send a request on a keep-alive connection
+    :return: status and the JSON body of the response
+    """
+    body = b'' if payload is None else json.dumps(payload).encode()
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status, json.loads(await reader.readexactly(int(headers['content-length'])))
+
+
+async def client(host: str, port: int, payloads: tp.Iterator[dict], latencies: tp.List[float], statuses: tp.List[int]):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for payload in payloads:  # shared by all clients
+            start = perf_counter()
+            status, _ = await request(reader, writer, 'POST', '/recommend', payload)
+            latencies.append(perf_counter() - start)
+            statuses.append(status)
+    finally:
+        writer.close()
+
+
+async def load_test(host: str, port: int, payloads: tp.List[dict], concurrency: int):
+    latencies, statuses = [], []
+    iterator = iter(payloads)
+    start = perf_counter()
+    await asyncio.gather(*[client(host, port, iterator, latencies, statuses) for _ in range(concurrency)])
+    seconds = perf_counter() - start
+
+    latencies, statuses = np.array(latencies) * 1000, np.array(statuses)
+    ok = statuses == 200
+    print(f"{len(statuses)} requests with {concurrency} connections in {seconds:.2f}s: "
+          f"{len(statuses) / seconds:.0f} requests/s")
+    print(f"status: {dict(zip(*np.unique(statuses, return_counts=True)))}")
+    if np.any(ok):
+        p50, p90, p99 = np.percentile(latencies[ok], [50, 90, 99])
+        print(f"latency of 200: p50 {p50:.2f}ms, p90 {p90:.2f}ms, p99 {p99:.2f}ms")
+
+    reader, writer = await asyncio.open_connection(host, port)
+    _, stats = await request(reader, writer, 'GET', '/stats')
+    writer.close()
+    print(f"service: {stats}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the recommendation service on localhost")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--zip', default='./output/AllPublicXML.zip', help="the trials sent to the service")
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--by-nct-id', action='store_true', help="send the nct_ids instead of the text")
+    args = parser.parse_args()
+
+    with ClinicalTrialDocumentXmlZipFileReader(args.zip) as reader:
+        docs = list(islice(reader, args.requests))
+    if args.by_nct_id:
+        payloads = [{'nct_id': doc.nct_id} for doc in docs]
+    else:
+        payloads = [{attr: getattr(doc, attr) for attr in ClinicalTrialDocument.MESH_ATTRIBUTES} for doc in docs]
+    payloads = [payloads[i % len(payloads)] for i in range(args.requests)]  # the zip may have fewer trials
+    asyncio.run(load_test(args.host, args.port, payloads, args.concurrency))
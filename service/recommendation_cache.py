@@ -0,0 +1,159 @@
+from base import *
+from collections import OrderedDict, deque
+from hashlib import blake2b
+from threading import Lock
+from time import perf_counter, time
+from clinical_trials.clinical_trial_document import ClinicalTrialDocument
+from ml.mesh_recommender import MeshRecommender
+import json
+import sqlite3
+
+
+class RecommendationCache(object):
+    """
+    Cache in front of a MeshRecommender, keyed by (nct_id, hash of the text, version of the model), so unchanged
+    trials are served without matching and prediction. An in-memory LRU tier is backed by a sqlite file, which keeps
+    the max_entries most recently used recommendations. The recommendations exclude the mesh terms present.
+    It can be shared by threads, and the sqlite file by processes.
+    """
+
+    def __init__(self, recommender: MeshRecommender, file_path: str, version: str, max_entries=1000000,
+                 max_memory_entries=10000, latency_window=10000):
+        """
+
+        :param file_path: the sqlite file
+        :param version: the version of the model, e.g. InferenceArtifact.version
+        :param max_entries: the most entries kept in the file, the least recently used are evicted
+        :param max_memory_entries: the most entries kept in memory
+        """
+        self._recommender = recommender
+        self._version = version
+        self._max_entries = max_entries
+        self._max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+        self._lock = Lock()
+        self._connection = sqlite3.connect(file_path, timeout=60, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS recommendations (nct_id TEXT, content_hash TEXT, "
+                                 "version TEXT, k INTEGER, value TEXT, last_access REAL, "
+                                 "PRIMARY KEY (nct_id, content_hash, version))")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS last_access_index ON recommendations (last_access)")
+        self._connection.commit()
+        self._num_entries = self._connection.execute("SELECT COUNT(*) FROM recommendations").fetchone()[0]
+        self._num_memory_hits = 0
+        self._num_disk_hits = 0
+        self._num_misses = 0
+        self._latencies = deque(maxlen=latency_window)
+
+    def key(self, doc: tp.Union[ClinicalTrialDocument, tp.Dict[str, str]]) -> tp.Tuple[str, str, str]:
+        """
+        :param doc: a ClinicalTrialDocument, or a dict of its MESH_ATTRIBUTES to raw text and optionally its nct_id
+        """
+        texts = [doc.get(attr) if isinstance(doc, dict) else getattr(doc, attr)
+                 for attr in ClinicalTrialDocument.MESH_ATTRIBUTES]
+        content_hash = blake2b(json.dumps(texts).encode(), digest_size=16).hexdigest()
+        nct_id = doc.get('nct_id') if isinstance(doc, dict) else doc.nct_id
+        return nct_id or '', content_hash, self._version
+
+    def _get_many(self, keys: tp.List[tp.Tuple[str, str, str]],
+                  k: int) -> tp.List[tp.Optional[tp.List[tp.Tuple[str, float]]]]:
+        """
+        the cached recommendations, if at least k were cached, else None
+        """
+        res = []
+        disk_hits = []
+        with self._lock:
+            for key in keys:
+                if key in self._memory and self._memory[key][0] >= k:
+                    self._memory.move_to_end(key)
+                    self._num_memory_hits += 1
+                    res.append(self._memory[key][1][:k])
+                    continue
+                row = self._connection.execute("SELECT k, value FROM recommendations "
+                                               "WHERE nct_id = ? AND content_hash = ? AND version = ?", key).fetchone()
+                if row is not None and row[0] >= k:
+                    value = [tuple(recommendation) for recommendation in json.loads(row[1])]
+                    self._put_memory(key, row[0], value)
+                    self._num_disk_hits += 1
+                    disk_hits.append(key)
+                    res.append(value[:k])
+                else:
+                    self._num_misses += 1
+                    res.append(None)
+            if disk_hits:
+                now = time()
+                self._connection.executemany("UPDATE recommendations SET last_access = ? "
+                                             "WHERE nct_id = ? AND content_hash = ? AND version = ?",
+                                             [(now,) + key for key in disk_hits])
+                self._connection.commit()
+        return res
+
+    def _put_memory(self, key: tp.Tuple[str, str, str], k: int, value: tp.List[tp.Tuple[str, float]]):
+        self._memory[key] = (k, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _put_many(self, keys: tp.List[tp.Tuple[str, str, str]], k: int,
+                  values: tp.List[tp.List[tp.Tuple[str, float]]]):
+        with self._lock:
+            now = time()
+            self._connection.executemany("INSERT OR REPLACE INTO recommendations VALUES (?, ?, ?, ?, ?, ?)",
+                                         [key + (k, json.dumps(value), now) for key, value in zip(keys, values)])
+            for key, value in zip(keys, values):
+                self._put_memory(key, k, value)
+            self._num_entries += len(keys)
+            if self._num_entries > self._max_entries:
+                self._num_entries = self._connection.execute("SELECT COUNT(*) FROM recommendations").fetchone()[0]
+                if self._num_entries > self._max_entries:
+                    # evict a tenth more than needed, so the eviction does not run on every put
+                    num_evicted = self._num_entries - self._max_entries + self._max_entries // 10
+                    self._connection.execute("DELETE FROM recommendations WHERE rowid IN (SELECT rowid FROM "
+                                             "recommendations ORDER BY last_access LIMIT ?)", (num_evicted,))
+                    self._num_entries -= num_evicted
+            self._connection.commit()
+
+    def recommend_many(self, docs: tp.Iterable[tp.Union[ClinicalTrialDocument, tp.Dict[str, str]]],
+                       k=10) -> tp.List[tp.List[tp.Tuple[str, float]]]:
+        """
+        the cached recommendations, and those of the missed documents scored together by the recommender
+        """
+        start = perf_counter()
+        docs = list(docs)
+        keys = [self.key(doc) for doc in docs]
+        res = self._get_many(keys, k)
+        self._latencies.append(perf_counter() - start)
+
+        missed = [i for i, value in enumerate(res) if value is None]
+        if missed:
+            values = self._recommender.recommend_many([docs[i] for i in missed], k)
+            self._put_many([keys[i] for i in missed], k, values)
+            for i, value in zip(missed, values):
+                res[i] = value
+        return res
+
+    def recommend(self, doc: tp.Union[ClinicalTrialDocument, tp.Dict[str, str]], k=10) -> tp.List[tp.Tuple[str, float]]:
+        return self.recommend_many([doc], k)[0]
+
+    def latency_percentiles(self, percentiles: tp.Iterable = (50, 90, 99)) -> tp.Dict[str, np.ndarray]:
+        """
+        :return: the latencies of the recommender stages, and of the cache lookups as 'cache', in milliseconds
+        """
+        res = self._recommender.latency_percentiles(percentiles)
+        if self._latencies:
+            res['cache'] = np.percentile(np.array(self._latencies) * 1000, list(percentiles))
+        return res
+
+    def stats(self) -> dict:
+        num_lookups = self._num_memory_hits + self._num_disk_hits + self._num_misses
+        return {
+            'memory_hits': self._num_memory_hits,
+            'disk_hits': self._num_disk_hits,
+            'misses': self._num_misses,
+            'hit_rate': (self._num_memory_hits + self._num_disk_hits) / max(num_lookups, 1),
+            'memory_entries': len(self._memory),
+            'entries': self._num_entries,
+        }
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,256 @@
+from base import *
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from clinical_trials.clinical_trial_document import ClinicalTrialDocument
+from clinical_trials.clinical_trial_document_xml_zip_file_reader import ClinicalTrialDocumentXmlZipFileReader
+from ml.inference_artifact import InferenceArtifact
+from ml.mesh_recommender import MeshRecommender
+from service.recommendation_cache import RecommendationCache
+import argparse
+import asyncio
+import json
+import pickle
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super(HttpError, self).__init__(message)
+        self.status = status
+
+
+class RecommendationService(object):
+    """
+    HTTP/1.1 service of a MeshRecommender on asyncio. Concurrent requests are queued and gathered into micro batches,
+    up to max_batch_size requests or max_wait seconds, so a single model call serves a whole batch. A full queue
+    rejects the requests with 503.
+
+    POST /recommend: {"nct_id": "NCT..."} or the raw text of ClinicalTrialDocument.MESH_ATTRIBUTES, and optionally "k"
+    GET /stats: the request, batch and latency statistics
+    GET /health
+    """
+    REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error',
+               503: 'Service Unavailable'}
+
+    def __init__(self, recommender: tp.Union[MeshRecommender, RecommendationCache], zip_file_path: str = None,
+                 num_workers=1, max_batch_size=64, max_wait=0.005, max_queue_size=1024, default_k=10,
+                 version: str = None):
+        """
+
+        :param recommender: the recommender, or the cache in front of it
+        :param zip_file_path: the trials looked up by nct_id
+        :param num_workers: number of batches scored at the same time, each in a thread
+        :param max_batch_size: the most requests scored by one model call
+        :param max_wait: seconds the first request of a batch waits for more requests
+        :param max_queue_size: the most requests waiting to be batched, more requests are rejected
+        :param version: the version of the model, reported by /health
+        """
+        self._recommender = recommender
+        self._num_workers = num_workers
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._max_queue_size = max_queue_size
+        self._default_k = default_k
+        self._version = version
+        self._executor = ThreadPoolExecutor(num_workers)
+        self._queue = None  # created in the event loop
+        self._reader = None
+        self._nct_id_file_names = {}
+        if zip_file_path is not None:
+            self._reader = ClinicalTrialDocumentXmlZipFileReader(zip_file_path)
+            self._nct_id_file_names = self._reader.nct_id_file_names()
+        self._num_requests = 0
+        self._num_rejected = 0
+        self._num_batches = 0
+        self._num_batched_requests = 0
+
+    def _recommend_batch(self, docs: tp.List[tp.Union[str, dict]],
+                         k: int) -> tp.List[tp.Union[tp.List[tp.Tuple[str, float]], Exception]]:
+        """
+        runs in the worker threads. The nct_ids are read from the zip here, off the event loop
+        :return: the recommendations of every document, or the exception of the documents failed, so a bad document
+         does not fail the others of the batch
+        """
+        res = []
+        for doc in docs:
+            try:
+                res.append(self._reader.read(self._nct_id_file_names[doc]) if type(doc) is str else doc)
+            except Exception as e:
+                res.append(e)
+        valid = [i for i, doc in enumerate(res) if not isinstance(doc, Exception)]
+        try:
+            for i, recommendations in zip(valid, self._recommender.recommend_many([res[i] for i in valid], k)):
+                res[i] = recommendations
+        except Exception:
+            # score the documents one by one, to find the failing ones
+            for i in valid:
+                try:
+                    res[i] = self._recommender.recommend_many([res[i]], k)[0]
+                except Exception as e:
+                    res[i] = e
+        return res
+
+    async def _batch_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            if self._queue.qsize() < self._max_batch_size - 1 and self._max_wait > 0:
+                await asyncio.sleep(self._max_wait)
+            while len(batch) < self._max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            k = max(request_k for _, request_k, _ in batch)
+            try:
+                results = await loop.run_in_executor(self._executor, self._recommend_batch,
+                                                     [doc for doc, _, _ in batch], k)
+                for (_, request_k, future), res in zip(batch, results):
+                    if future.done():
+                        continue
+                    if isinstance(res, Exception):
+                        future.set_exception(res)
+                    else:
+                        future.set_result(res[:request_k])
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            self._num_batches += 1
+            self._num_batched_requests += len(batch)
+
+    async def _recommend(self, payload: dict) -> dict:
+        start = perf_counter()
+        # bad requests are rejected here, before they are batched with others
+        if not isinstance(payload, dict):
+            raise HttpError(400, "The body must be a JSON object.")
+        k = payload.get('k', self._default_k)
+        if type(k) is not int or k <= 0:
+            raise HttpError(400, "k must be a positive integer.")
+        if 'nct_id' in payload:
+            if type(payload['nct_id']) is not str:
+                raise HttpError(400, "nct_id must be a string.")
+            if payload['nct_id'] not in self._nct_id_file_names:
+                raise HttpError(404, f"Unknown nct_id {payload['nct_id']}.")
+            doc = payload['nct_id']
+        else:
+            doc = {attr: payload.get(attr) for attr in ClinicalTrialDocument.MESH_ATTRIBUTES}
+            if all(text is None for text in doc.values()):
+                raise HttpError(400, f"Either nct_id or any of {ClinicalTrialDocument.MESH_ATTRIBUTES} is required.")
+            for attr, text in doc.items():
+                if text is not None and type(text) is not str:
+                    raise HttpError(400, f"{attr} must be a string.")
+
+        if self._queue.full():  # back-pressure
+            self._num_rejected += 1
+            raise HttpError(503, "Too many requests in the queue.")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((doc, k, future))
+        recommendations = await future
+        return {'recommendations': [{'heading': heading, 'score': score} for heading, score in recommendations],
+                'latency_ms': (perf_counter() - start) * 1000}
+
+    def _stats(self) -> dict:
+        return {
+            'requests': self._num_requests,
+            'rejected': self._num_rejected,
+            'batches': self._num_batches,
+            'mean_batch_size': self._num_batched_requests / max(self._num_batches, 1),
+            'queue_size': self._queue.qsize(),
+            'latency_ms_p50_p90_p99': {stage: percentiles.tolist()
+                                       for stage, percentiles in self._recommender.latency_percentiles().items()},
+            **({'cache': self._recommender.stats()} if isinstance(self._recommender, RecommendationCache) else {}),
+        }
+
+    async def _route(self, method: str, path: str, body: bytes) -> tp.Tuple[int, dict]:
+        try:
+            if path == '/recommend':
+                if method != 'POST':
+                    raise HttpError(405, "Use POST.")
+                self._num_requests += 1
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    raise HttpError(400, "The body is not JSON.")
+                return 200, await self._recommend(payload)
+            elif path == '/stats':
+                return 200, self._stats()
+            elif path == '/health':
+                return 200, {'status': 'ok', 'version': self._version}
+            raise HttpError(404, f"Unknown path {path}.")
+        except HttpError as e:
+            return e.status, {'error': str(e)}
+        except Exception as e:
+            return 500, {'error': repr(e)}
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        a minimal HTTP/1.1 connection with keep-alive and Content-Length bodies
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, payload = await self._route(method, path, body)
+                data = json.dumps(payload).encode()
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(f"HTTP/1.1 {status} {self.REASONS[status]}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        self._queue = asyncio.Queue(self._max_queue_size)
+        workers = [asyncio.create_task(self._batch_worker()) for _ in range(self._num_workers)]
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        print(f"Serving on http://{host}:{port} with {self._num_workers} workers")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self._executor.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve mesh heading recommendations over HTTP")
+    parser.add_argument('--artifact', default='./output/model-0.001_1000.0_0.01_0.1_5.ia',
+                        help="the inference artifact written by scripts/export_model.py")
+    parser.add_argument('--mesh-trie', default='./output/AllPublicXML.trie.pickle')
+    parser.add_argument('--zip', default='./output/AllPublicXML.zip', help="the trials looked up by nct_id")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5)
+    parser.add_argument('--max-queue-size', type=int, default=1024)
+    parser.add_argument('--cache', default=None, help="the sqlite file caching the recommendations")
+    args = parser.parse_args()
+
+    with open(args.mesh_trie, 'rb') as f:
+        mesh_trie = pickle.load(f)
+    artifact = InferenceArtifact.load(args.artifact)
+    recommender = MeshRecommender.from_artifact(mesh_trie, artifact)
+    if args.cache is not None:
+        recommender = RecommendationCache(recommender, args.cache, artifact.version)
+    service = RecommendationService(recommender,
+                                    args.zip if os.path.exists(args.zip) else None, args.workers,
+                                    args.max_batch_size, args.max_wait_ms / 1000, args.max_queue_size,
+                                    version=artifact.version)
+    asyncio.run(service.serve(args.host, args.port))
@@ -0,0 +1,23 @@
+from base import *
+from scipy.sparse import random as sparse_random
+from ml.data_set_splitter import DataSetSplitter, DATA_SET_INDICATOR
+from ml.ridge_latent_factor_model import RidgeLatentFactorModel
+from ml.streaming_batch_source import StreamingBatchSource
+
+
+def test_train_with_streaming_batch_source(tmp_path):
+    m, n = 12, 300
+    r = sparse_random(m, n, density=0.2, format='csr', dtype='f4', random_state=0)
+    split_choice_map = np.zeros(n, dtype='b')
+    split_choice_map[::5] = DATA_SET_INDICATOR.VALIDATE
+    sds_file_path = str(tmp_path / 'data.sds')
+    DataSetSplitter.dump_utility_matrix(sds_file_path, list(range(m)), split_choice_map,
+                                        (r[i].toarray().ravel() for i in range(m)))
+
+    in_memory = RidgeLatentFactorModel(tau=-1, k=2, batch_size=50)
+    in_memory.train(DataSetSplitter.get_train_utility_matrix(sds_file_path))
+    streaming = RidgeLatentFactorModel(tau=-1, k=2, batch_size=50)
+    streaming.train(StreamingBatchSource.from_data_set(sds_file_path, directory=str(tmp_path / 'data.train.sbs')))
+
+    np.testing.assert_allclose(streaming._W_theta, in_memory._W_theta, atol=1e-8)
+    np.testing.assert_allclose(streaming._b, in_memory._b, atol=1e-8)